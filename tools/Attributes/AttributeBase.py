@@ -8,13 +8,26 @@ Should fully define abstracted Attribute class interface
 
 import time
 
+from RunContext import RunField, ArrayField
 from tools.Utilities.Logger import LogTools
 dlog = LogTools('AttributeTypes.log', 'AttributeBase')
 dlog.rootlog.warning('AttributeBase initialized')
 
 class AttributeBase(object):
     '''Base class for various types of system . Contains hooks, method stubs and normalized instance
-        attributes for derivative classes.'''
+        attributes for derivative classes.
+        Fields changed by executing the attribute are run state, held by the active RunContext.'''
+
+    # run state, with its value before the first execution
+    _complete = ArrayField('complete', 'b', None, none_value=-1)  # value of attribute evaluation, None if not evaluated
+    active = ArrayField('active', 'b', False)  # flag to indicate if the self.execute() method should be evaluated
+    exe_cnt = ArrayField('exe_cnt', 'l', 0)  # number of times self.execute() has been called
+    exe_start = ArrayField('exe_start', 'd', None, none_value=float('nan'))  # internal timer, set on self.execute
+    data = RunField('data', default=list)  # list of timeseries data for trending/checking historical data
+    readhook = RunField('readhook')
+    writehook = RunField('writehook')
+    leftval = RunField('leftval')
+    rightval = RunField('rightval')
 
     def __init__(self, tag, **kwargs):
         '''
@@ -38,17 +51,23 @@ class AttributeBase(object):
 
         self.raw_string = kwargs.pop('raw_string', '')  # string from which this attribute was parsed
 
-        # internal plumbing
-        self._complete = None   # value of attribute evaluation - set in self.evaluate method.
-                                # Nonetype means not yet evaluated
-        self.active = False  # flag to indicate if the self.execute() method should be evaluated during a test
-
-        self.data = list()  # list of timeseries data for trending/checking historical data
-        self.exe_cnt = 0    # number of times self.execute() has been called
-        self.exe_start = None  # internal timer, intended to be initiated on call to self.execute
-
         self._default_test = None  # function hook to set default testing behavior of execute
 
+    def __getstate__(self):
+        '''Run state is not part of the pickled attribute, the attribute is indexed again when its model is loaded'''
+        state = self.__dict__.copy()
+        state.pop('run_slot', None)
+        return state
+
+    def run_attributes(self):
+        '''Returns list of the attributes executed by this attribute, each holding run state of its own'''
+        found = list()
+        for value in self.__dict__.values():
+            for item in (value if isinstance(value, (list, tuple)) else [value]):
+                if isinstance(item, AttributeBase):
+                    found.append(item)
+        return found
+
     def __str__(self):
         '''String method for base attribute - can be overridden in subclasses'''
         return self.OPC_path()
@@ -98,10 +117,10 @@ class AttributeBase(object):
         return self._complete
 
     def activate(self):
-        self._active = True
+        self.active = True
 
     def deactivate(self):
-        self._active = False
+        self.active = False
 
     def OPC_path(self):
         '''
@@ -6,15 +6,21 @@ facilitated by a DVConfigClient connection.
 '''
 
 from AttributeTypes import *
+import copy
 import socket
+import threading
+import Queue
 
 from DVConfigClient import DVConfigClient
 from AttributeParser import AttributeParser
+from AttributePreprocessor import expand_member, state_check
+from pyparsing import ParseResults
 
 __author__ = 'ekopache'
 
 
 from tools.Utilities.Logger import LogTools
+from tools.Utilities.Profiler import stage
 dlog = LogTools('AttributeBuilder.log', 'AttributeBuilder')
 dlog.rootlog.debug('Module initialized')
 
@@ -41,9 +47,55 @@ class AttributeIgnored(Exception):
         Exception.__init__(self, args, kwargs)
 
 
+class LazyAttribute(object):
+    '''
+    Placeholder for an attribute string, solved into an AttributeType instance on first use.
+    Resolution is done once even when placeholders are touched from several threads; any attribute
+    lookup on the placeholder resolves it and is forwarded to the solved instance.
+    '''
+    __slots__ = ('raw_string', 'default_tag', 'lists', 'builder', '_attribute')
+
+    def __init__(self, raw_string, builder, default_tag='', lists=None):
+        self.raw_string = raw_string
+        self.default_tag = default_tag  # default tag of the diagram the attribute was defined in
+        self.lists = lists if lists is not None else dict()  # list definitions of that diagram
+        self.builder = builder
+        self._attribute = None
+
+    def is_resolved(self):
+        return self._attribute is not None
+
+    def resolve(self):
+        '''
+        Solves the attribute string on the first call
+        :return: AttributeType instance, or raw string if no attribute could be solved
+        '''
+        if self._attribute is None:
+            with self.builder.lock:
+                if self._attribute is None:
+                    # solve in the context of the diagram, the builder may have moved on to other diagrams
+                    default_tag, self.builder.default_tag = self.builder.default_tag, self.default_tag
+                    lists, self.builder.lists = self.builder.lists, self.lists
+                    try:
+                        attribute = self.builder.solve_attribute(self.raw_string)
+                    finally:
+                        self.builder.default_tag = default_tag
+                        self.builder.lists = lists
+                    self._attribute = attribute or self.raw_string
+        return self._attribute
+
+    def __getattr__(self, name):
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        if self._attribute is None:
+            return 'LazyAttribute: ' + repr(self.raw_string)
+        return repr(self._attribute)
+
+
 class AttributeBuilder(object):
 
-    def __init__(self, parser, client, default_tag='', abort_on_error=False):
+    def __init__(self, parser, client, default_tag='', abort_on_error=False, workers=1, client_factory=None):
 
         if isinstance(parser, AttributeParser):
             self.parser = parser
@@ -62,6 +114,26 @@ class AttributeBuilder(object):
         # parsing option flags
         self.abort_on_error = abort_on_error  # fails program on parsing/instansiation errors
 
+        # DeltaV configuration cached for the lifetime of the builder, each tag and path is queried once
+        self.module_info = dict()  # {tag: module info dictionary}
+        self.config_values = dict()  # {config path: value}
+        self.aliases = dict()  # {unit tag: {alias: resolved tag or None}}
+        # {list name: [member tags]} of the list definitions of the diagram being built, see set_lists.
+        # Comprehensions solved one at a time only see the lists defined before them.
+        self.lists = dict()
+        self.client_requests = 0  # number of requests sent to the DVConfig server
+
+        # serializes solving of LazyAttribute instances, the parser and client connection are not thread-safe
+        self.lock = threading.RLock()
+
+        # number of concurrent server connections used to fetch module info in solve_attributes
+        self.workers = workers
+        # function returning a new client for each worker, defaults to a client of the same class and server
+        self.client_factory = client_factory or \
+            (lambda: self.client.__class__(address=self.client.address, port=self.client.port))
+
+        self.profile = None  # Utilities.Profiler.BuildProfile timing solving and server requests, if profiled
+
     def connect_client(self):
         try:
             self.client.connect()
@@ -71,10 +143,19 @@ class AttributeBuilder(object):
     def disconnect_client(self):
         self.client.disconnect()
 
+    def set_profile(self, profile):
+        '''Sets the BuildProfile timing this builder and its parser, None stops profiling'''
+        self.profile = profile
+        self.parser.profile = profile
+
     def set_default_tag(self, tag):
         '''Sets a default tag for this diagram'''
         self.default_tag = tag
 
+    def set_lists(self, lists):
+        '''Sets the list definitions comprehensions are expanded from, ex. StateDiagram.lists of a diagram'''
+        self.lists = lists
+
     def attribute_building_error(self, raw_string):
         '''
         :param raw_string: string definition of attribute from puml diagram
@@ -88,15 +169,80 @@ class AttributeBuilder(object):
             print self.parser.parse(raw_string).dump()
         return raw_string
 
-    def solve_attribute(self, raw_string):
+    def lazy_attribute(self, raw_string):
+        '''Returns a LazyAttribute solving raw_string on first use, with the current default tag and lists'''
+        return LazyAttribute(raw_string, self, self.default_tag, self.lists)
+
+    def solve_attributes(self, raw_strings):
+        '''
+        Solves a batch of raw strings. Each unique string is parsed once and the configuration of every
+        tag they reference is fetched before solving, module info once per tag and all OPEN/CLOSE target
+        values in a single request, so that solving itself needs no further server round trips.
+        With self.workers > 1 module info is fetched concurrently, see fetch_module_info.
+        :param raw_strings: list of attribute string definitions from a diagram, usually with duplicates
+        :return: list of AttributeType instances (or raw strings on failure) in the order of raw_strings.
+            Every occurrence gets its own instance, each occurrence is executed on its own during a test run.
+        '''
+        parsed = dict()  # {unique raw string: parse results}
+        remaining = dict()  # {unique raw string: occurrences not solved yet}
+        for raw_string in raw_strings:
+            if raw_string not in parsed:
+                parsed[raw_string] = self.parser.parse(raw_string)
+            remaining[raw_string] = remaining.get(raw_string, 0) + 1
+        self.prefetch_tags(set().union(*[self.find_tags(results) for results in parsed.values() if results]))
+
+        attributes = list()
+        for raw_string in raw_strings:
+            # parse results are modified by solving, repeated strings are solved from copies
+            remaining[raw_string] -= 1
+            results = parsed[raw_string]
+            if remaining[raw_string] and results:
+                results = copy.deepcopy(results)
+            attributes.append(self.solve_attribute(raw_string, results))
+        return attributes
+
+    def find_tags(self, parse_results):
+        '''Returns set of module tags referenced anywhere in parse_results'''
+        tags = set()
+        stack = [parse_results]
+        while stack:
+            node = stack.pop()
+            try:
+                tags.add(self.parser.get_tag(node))
+            except AttributeError:
+                pass
+            stack.extend(item for item in node if isinstance(item, ParseResults))
+        return set(tag for tag in tags if tag and 'ignore' not in tag)
+
+    def prefetch_tags(self, tags):
+        '''
+        Caches module info of each tag, then the OPEN/CLOSE target values of all discrete modules in one request
+        :param tags: iterable of module tags
+        '''
+        self.fetch_module_info(tags, self.workers)
+        paths = list()
+        for tag in sorted(tags):
+            module_info = self.lookup_module_info(tag)
+            if isinstance(module_info, dict) and \
+                    '/'.join(['/', tag, 'OPEN']) in module_info.get('attribute_paths', []):
+                paths.extend('/'.join([tag, attr_path]) for attr_path in ['OPEN', 'CLOSE'])
+        self.prefetch_config_values(paths)
+
+    def solve_attribute(self, raw_string, parse_results=None):
         '''
         Solves for what attributes should be generated from a raw string taken from the diagram
         :param raw_string: attribute string definition from diagram
+        :param parse_results: result of self.parser.parse(raw_string) if already parsed, modified by solving
         :return: new_attribute: AttributeType instance or raw_string on failure to produce attribute
         '''
         #TODO: expand to handle compound expressions and multiple attributes in a single raw string
 
-        parse_results = self.parser.parse(raw_string)
+        with stage(self.profile, 'attribute_solve', items=1):
+            return self._solve_attribute(raw_string, parse_results)
+
+    def _solve_attribute(self, raw_string, parse_results):
+        if parse_results is None:
+            parse_results = self.parser.parse(raw_string)
 
         if not parse_results:
             self.logger.error("Attribute string:: %s :: not parsed, returning raw string", raw_string)
@@ -105,7 +251,16 @@ class AttributeBuilder(object):
         new_attribute = None
 
         try:
-            if 'action_word' in parse_results:
+            if 'list_definition' in parse_results:
+                self.logger.debug('Defining list %s', raw_string)
+                self.lists[parse_results['list_name']] = list(parse_results['members'])
+                new_attribute = AttributeDummy(raw_string)
+
+            elif 'comprehension' in parse_results:
+                self.logger.debug('Expanding list comprehension %s', raw_string)
+                new_attribute = self.generate_group(parse_results)
+
+            elif 'action_word' in parse_results:
                 action = parse_results['action_word'].lower()
 
                 if action in ['open', 'close', 'start', 'stop']:
@@ -156,7 +311,8 @@ class AttributeBuilder(object):
                 # TODO: expressions = parse_results['expression'] for multiple attributes in given string
                 if 'condition' in parse_results:
                     self.logger.debug("Adding single condition from %s", raw_string)
-                    new_attribute = self.generate_attribute(parse_results.condition, 'condition')
+                    # comparison operands are named in the results of the whole expression
+                    new_attribute = self.generate_attribute(parse_results, 'condition')
 
                 elif 'command' in parse_results:
                     self.logger.debug("Adding command")
@@ -172,6 +328,36 @@ class AttributeBuilder(object):
         else:
             return self.attribute_building_error(raw_string)
 
+    def generate_group(self, parse_results):
+        '''
+        Expands a list comprehension into a GroupAttribute, solving the member expression for each list member
+        :param parse_results: comprehension parse results, see AttributeGrammar.comprehension
+        :return: GroupAttribute, or None if the list is not defined or a member attribute can't be solved
+        '''
+        if 'members' in parse_results:
+            list_name, members = '', list(parse_results['members'])
+        else:
+            list_name = parse_results['list_name']
+            if list_name not in self.lists:
+                self.logger.error('List %s not defined before use', list_name)
+                return None
+            members = self.lists[list_name]
+
+        attributes = list()
+        for member in members:
+            member_string = expand_member(parse_results['member_exp'], parse_results['variable'], member)
+            member_results = self.parser.parse(member_string)
+            if not member_results and state_check(member_string):
+                # tag followed by a parameter name, ex. [HMxxx ACTIVE for HM in HM_LIST]
+                member_string = state_check(member_string)
+                member_results = self.parser.parse(member_string)
+            attribute = self.solve_attribute(member_string, member_results or None)
+            if not isinstance(attribute, AttributeBase):
+                self.logger.error('No attribute solved for list member %s', member_string)
+                return None
+            attributes.append(attribute)
+        return GroupAttribute(attributes, list_name)
+
     def generate_attribute(self, parse_dict, attribute_type):
         '''
         Generates the required AttributeType from a raw string
@@ -348,20 +534,109 @@ class AttributeBuilder(object):
             self.logger.warning("Falling back to default tag to generate attribute from %s", parse_dict)
             tag = self.default_tag
 
-        return tag, self.client.get_module_info(tag)
+        return tag, self.lookup_module_info(tag)
+
+    def lookup_module_info(self, tag):
+        '''Returns module info of tag, querying the DVConfig server on first use of the tag only'''
+        if tag not in self.module_info:
+            self.client_requests += 1
+            with stage(self.profile, 'dvconfig', items=1):
+                self.module_info[tag] = self.client.get_module_info(tag)
+        return self.module_info[tag]
+
+    def fetch_module_info(self, tags, workers=1):
+        '''
+        Caches module info of every tag not cached yet. With more than one worker the requests are spread
+        over that many threads, each with its own client connection, as the server round trip dominates.
+        Tags a worker failed to fetch are queried again on the builder's own connection.
+        :param tags: iterable of module tags
+        :param workers: maximum number of concurrent connections
+        '''
+        missing = sorted(set(tags) - set(self.module_info))
+        workers = min(workers, len(missing))
+        if workers > 1:
+            queue = Queue.Queue()
+            for tag in missing:
+                queue.put(tag)
+            fetched = dict()  # {tag: module info}, filled by the workers
+
+            def work():
+                try:
+                    client = self.client_factory()
+                    client.connect()
+                except socket.error as err:
+                    self.logger.error('Could not connect worker client: %r', err)
+                    return
+                try:
+                    while True:
+                        try:
+                            tag = queue.get_nowait()
+                        except Queue.Empty:
+                            return
+                        with stage(self.profile, 'dvconfig', items=1):
+                            fetched[tag] = client.get_module_info(tag)
+                except Exception as err:
+                    self.logger.error('Worker failed to fetch module info: %r', err)
+                finally:
+                    client.disconnect()
+
+            threads = [threading.Thread(target=work, name='AttributeBuilder-%d' % i) for i in range(workers)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            self.client_requests += len(fetched)
+            self.module_info.update(fetched)
+
+        for tag in missing:
+            self.lookup_module_info(tag)
+
+    def prefetch_config_values(self, paths):
+        '''Reads the configuration values of all paths not cached yet in a single request'''
+        missing = sorted(set(path for path in paths if path not in self.config_values))
+        if not missing:
+            return
+        self.client_requests += 1
+        with stage(self.profile, 'dvconfig', items=len(missing)):
+            self.config_values.update(dict(self.client.get_config_values(missing)['path_values']))
+        # paths without a value are not queried again
+        self.config_values.update((path, None) for path in missing if path not in self.config_values)
 
     def get_target_value(self, tag, path_list):
         '''Obtains the target value from DeltaV configuration, if possible. Will return Nonetype on error'''
-        path_values = self.client.get_config_values(['/'.join([tag, attr_path]) for attr_path in path_list])['path_values']
-        return dict(path_values)
+        paths = ['/'.join([tag, attr_path]) for attr_path in path_list]
+        self.prefetch_config_values(paths)
+        return dict((path, self.config_values[path]) for path in paths)
 
     def get_alias(self, tag, alias):
         '''Resolves aliases or shared module for the parent module defined by tag'''
-        return self.client.get_alias(tag, alias)
+        with stage(self.profile, 'dvconfig', items=1):
+            return self.client.get_alias(tag, alias)
+
+    def resolve_aliases(self, unit, aliases):
+        '''
+        Resolves aliases of a unit, querying all aliases not cached yet in a single request
+        :param unit: unit tag owning the aliases
+        :param aliases: iterable of alias names
+        :return: {alias: resolved tag, or None if the alias is not defined for the unit}
+        '''
+        aliases = list(aliases)
+        cached = self.aliases.setdefault(unit, dict())
+        missing = sorted(set(alias for alias in aliases if alias not in cached))
+        if missing:
+            self.client_requests += 1
+            with stage(self.profile, 'dvconfig', items=len(missing)):
+                resolved = dict(self.client.get_aliases(unit, missing)['alias_values'])
+            cached.update((alias, resolved.get(alias)) for alias in missing)
+            unresolved = [alias for alias in missing if cached[alias] is None]
+            if unresolved:
+                self.logger.warning('Aliases not defined for %s: %s', unit, ', '.join(unresolved))
+        return dict((alias, cached[alias]) for alias in aliases)
 
     def get_namedset(self, namedset):
         '''Returns a dictionary of namedset {entry string: integer value}'''
-        return self.client.get_namedset(namedset)
+        with stage(self.profile, 'dvconfig', items=1):
+            return self.client.get_namedset(namedset)
 
     def check_tag_exists(self, tag):
         raise NotImplementedError
@@ -371,16 +646,17 @@ class AttributeBuilder(object):
         raise NotImplementedError
 
 
-def create_attribute_builder(server_ip='127.0.0.1', server_port=5489):
+def create_attribute_builder(server_ip='127.0.0.1', server_port=5489, workers=1):
     '''
     Returns a attribute builder pre-configured with parser and DVConfigClient
+    :param workers: number of concurrent server connections used when solving attributes in bulk
     '''
     from DVConfigClient import DVConfigClient
     from AttributeParser import AttributeParser
 
     parser = AttributeParser()
     config_client = DVConfigClient(address=server_ip, port=server_port)
-    attribute_builder = AttributeBuilder(parser, config_client)
+    attribute_builder = AttributeBuilder(parser, config_client, workers=workers)
 
     return attribute_builder
 
@@ -142,3 +142,25 @@ action = (action_word.setResultsName('action_word') +
          ((compound_exp ^ tag) + pp.Optional(value))) ^ \
                 action_phrase.setResultsName('action_phrase')
 
+
+# =========List definitions and comprehensions=========
+# expanded by the AttributeBuilder into one GroupAttribute checking every member of a list
+#   DEV_LIST = ['TK-15', #TANK_WEIGHT#]                  list definition, members quoted or not
+#   [HMxxx = 1 for HM in HM_LIST]                          member attribute for each member of a defined list
+#   [Open XV for XV in ['XV-101', 'XV-102']]               member attribute for each member of a literal list
+# the loop variable, optionally followed by x's (HMxxx) and quoted or not, is replaced by each quoted member tag
+list_name = pp.Word(pp.alphas+'_', pp.alphanums+'_')
+list_member = pp.Suppress(pp.Optional(tick)) + pp.Word(pp.alphanums+'-_$#/') + pp.Suppress(pp.Optional(tick))
+list_literal = pp.Suppress('[') + pp.Group(pp.delimitedList(list_member)).setResultsName('members') + pp.Suppress(']')
+
+list_definition = (list_name.setResultsName('list_name') + pp.Suppress(EQUALS) + list_literal)\
+    .setResultsName('list_definition')
+
+FOR = pp.CaselessKeyword('for')
+IN = pp.CaselessKeyword('in')
+comprehension = (pp.Suppress('[') + pp.SkipTo(FOR + list_name + IN).setResultsName('member_exp') + pp.Suppress(FOR) +
+                 list_name.setResultsName('variable') + pp.Suppress(IN) +
+                 (list_name.setResultsName('list_name') ^ list_literal) + pp.Suppress(']'))\
+    .setResultsName('comprehension')
+
+list_exp = comprehension ^ list_definition
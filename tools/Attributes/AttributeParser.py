@@ -35,12 +35,13 @@ Slowly ramp open the vent valve to ATM
 
 
 import tools.Utilities.Logger as Logger
+from tools.Utilities.Profiler import stage
 dlog = Logger.LogTools('AttributeParser.log', 'AttributeParser')
 dlog.Output2Stdout()
 dlog.rootlog.warning('Module initialized')
 
 import AttributeTypes as AT
-from AttributeGrammar import action, compound_exp
+from AttributeGrammar import action, compound_exp, list_exp
 from pyparsing import ParseException
 
 class AST(object):
@@ -103,6 +104,7 @@ class AttributeParser(object):
         self.logger = dlog.MakeChild('Parser')
 
         self.ast = AST()
+        self.profile = None  # Utilities.Profiler.BuildProfile timing parse, if profiled
 
     def parse(self, attribute_string):
         '''
@@ -110,9 +112,21 @@ class AttributeParser(object):
         :param attribute_string: string for a given state or transition attribute
         :return: AttributeType.Attribute_Base instance
         '''
+        with stage(self.profile, 'attribute_parse', size=len(attribute_string), items=1):
+            return self._parse(attribute_string)
+
+    def _parse(self, attribute_string):
         # remove line returns
         attribute_string = ''.join(attribute_string.split('\\n'))
 
+        # list definitions and comprehensions take the whole string
+        try:
+            parse_result = list_exp.parseString(attribute_string, parseAll=True)
+            self.logger.debug('\t %s', parse_result.dump())
+            return parse_result
+        except ParseException:
+            pass
+
         # Determine if keyword in first position
         self.logger.debug('Attempting to parse: \" %s \"', attribute_string)
         try:
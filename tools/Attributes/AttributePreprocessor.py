@@ -2,10 +2,89 @@
 Preprocessing module for transforming state diagram natural language device descriptions to
 DeltaV tags, aliases or bound modules.
 
+Unit aliases are written between hashes in attribute strings, ex. #RX_PRESS_EM#/SETPOINT = 10.
+Aliases are resolved against the unit module running the diagram, see AttributeBuilder.resolve_aliases,
+and substituted before the attribute strings are parsed. List comprehension members are substituted
+in the member expression of the comprehension, see expand_member and state_check.
+
+Example calling:
+==============================
+import AttributePreprocessor
+
+aliases = AttributePreprocessor.collect_aliases(raw_strings)
+alias_map = attribute_builder.resolve_aliases('R2', aliases)  # single request for all aliases of unit R2
+raw_strings = [AttributePreprocessor.substitute_aliases(s, alias_map) for s in raw_strings]
+==============================
 
 FUTURE EXPANSION 3/18/2016
 '''
 
 __author__ = 'ekopache'
 
+import re
+
+# unit alias placeholder, ex. #RX_PRESS_EM#
+ALIAS = re.compile(r'#([A-Za-z_][\w]*)#')
+# list definition, ex. DEV_LIST = ['TK-15', #TANK_WEIGHT#]
+LIST_DEFINITION = re.compile(r'^\s*(\w+)\s*=\s*\[([^\]]*)\]\s*$')
+# characters of a tag or OPC path, ex. HM101/ACTIVE.CV
+PATH_CHARS = r'[\w\-/.$]'
+# member expression naming a parameter of the member tag, ex. 'HM101' ACTIVE
+STATE_CHECK = re.compile(r"^'([^']+)'\s+([A-Za-z_]\w*)$")
+
+
+def find_aliases(raw_string):
+    '''Returns list of alias names referenced in raw_string, in order of first reference'''
+    aliases = list()
+    for alias in ALIAS.findall(raw_string):
+        if alias not in aliases:
+            aliases.append(alias)
+    return aliases
+
+
+def collect_aliases(raw_strings):
+    '''Returns sorted list of the alias names referenced in any of raw_strings'''
+    return sorted(set(alias for raw_string in raw_strings for alias in ALIAS.findall(raw_string)))
+
+
+def substitute_aliases(raw_string, alias_map):
+    '''
+    Replaces each alias placeholder in raw_string with the tag it resolves to
+    :param alias_map: {alias name: resolved tag}, aliases missing or resolved to None are left in place
+    :return: new string
+    '''
+    def replace(match):
+        resolved = alias_map.get(match.group(1))
+        return match.group(0) if resolved is None else resolved
+    return ALIAS.sub(replace, raw_string)
+
+
+def list_definition(raw_string):
+    '''Returns (list name, [member tags]) of a list definition, or None if raw_string is not one'''
+    match = LIST_DEFINITION.match(raw_string)
+    if not match:
+        return None
+    return match.group(1), [member.strip().strip("'") for member in match.group(2).split(',') if member.strip()]
+
+
+def expand_member(member_exp, variable, member):
+    '''
+    Substitutes one list member in the member expression of a list comprehension
+    ex. expand_member('HMxxx/ACTIVE = 1', 'HM', 'HM101') returns "'HM101/ACTIVE' = 1"
+    :param variable: loop variable, referenced in member_exp as is or followed by x's, quoted or not
+    :return: attribute string of the member, with the whole path containing the member quoted
+    '''
+    pattern = re.compile(r"'?(%s*?)\b%s(?:x+|X+)?\b(%s*)'?" % (PATH_CHARS, re.escape(variable), PATH_CHARS))
+    return pattern.sub(lambda match: "'%s%s%s'" % (match.group(1), member, match.group(2)), member_exp).strip()
+
 
+def state_check(member_string):
+    '''
+    Rewrites a tag followed by a parameter name as a check of that parameter being set
+    ex. state_check("'HM101' ACTIVE") returns "'HM101/ACTIVE' = TRUE"
+    :return: new string, or None if member_string is not a tag followed by a parameter name
+    '''
+    match = STATE_CHECK.match(member_string)
+    if not match:
+        return None
+    return "'%s/%s' = TRUE" % match.groups()
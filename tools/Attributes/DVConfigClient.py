@@ -8,6 +8,8 @@ import time
 
 class DVConfigClient(jsocket.JsonClient):
 
+    batch_aliases = True  # server answers get_aliases, cleared on the first server not answering it
+
     def __init__(self, address='127.0.0.1', port=5489):
         self.address = address
         self.port = port
@@ -49,7 +51,7 @@ class DVConfigClient(jsocket.JsonClient):
         Returns dictionary of information resolving alias
         :param tag:
         :param alias:
-        :return:
+        :return: dictionary {'alias_value': resolved tag or None, ...}
         '''
         rpc_req = {
             "method": "get_alias",
@@ -61,6 +63,36 @@ class DVConfigClient(jsocket.JsonClient):
         info = self.read_obj()
         return info
 
+    def get_aliases(self, tag, aliases):
+        '''
+        Resolves several aliases of the same module in a single request.
+        Servers without the get_aliases method are queried one alias at a time with get_alias.
+        :param tag: unit or module tag owning the aliases
+        :param aliases: list of alias names
+        :return: dictionary {'alias_values': [(alias, resolved tag or None), ...]}
+        '''
+        if type(aliases) is not list:
+            raise TypeError("Must pass a list of aliases to query. Received type: %s" % type(aliases))
+
+        if self.batch_aliases:
+            rpc_req = {
+                "method": "get_aliases",
+                "tag": tag,
+                "reference_ids": aliases,
+            }
+            self.send_obj(rpc_req)
+            info = self.read_obj()
+            if isinstance(info, dict) and 'alias_values' in info:
+                return info
+            # server error or unknown method, ask for each alias from now on
+            self.batch_aliases = False
+
+        alias_values = list()
+        for alias in aliases:
+            info = self.get_alias(tag, alias)
+            alias_values.append((alias, info.get('alias_value') if isinstance(info, dict) else None))
+        return {'alias_values': alias_values}
+
     def get_namedset(self, namedset_name):
         '''
         Returns a dictionary of a namedset's entry {string value: integer value} map
@@ -83,8 +115,7 @@ class DVConfigClient(jsocket.JsonClient):
         '''
 
         if type(list_of_paths) is not list:
-            print "Must pass a list of paths to query. Received type:", type(list_of_paths)
-            raise TypeError
+            raise TypeError("Must pass a list of paths to query. Received type: %s" % type(list_of_paths))
 
         rpc_req = {
             "method": "get_config_values",
@@ -1,6 +1,7 @@
 '''Module contains class definitions for attributes to be executed on the runtime system'''
 
 from AttributeBase import AttributeBase
+from RunContext import RunField
 import operator
 
 from tools.Utilities.Logger import LogTools
@@ -615,6 +616,76 @@ class AttributeDummy(AttributeBase):
         print 'Dummy force'
 
 
+class GroupAttribute(AttributeBase):
+    '''
+    Attributes expanded from a list comprehension, checked together as a single attribute.
+    The OPC paths read by the members are recorded on the first execution; every later execution
+    reads all of them in one batched read and evaluates the members against the values read.
+    Complete once every member is complete in the same poll.
+    '''
+
+    values = RunField('values', default=dict)  # {OPC path: read result} of the current execution
+    paths = RunField('paths', default=list)  # OPC paths read by the members, in order of first read
+    batch_readhook = RunField('batch_readhook', default=lambda: None)  # function(list of paths) -> read results
+
+    def __init__(self, members, list_name='', **kwargs):
+        '''
+        :param members: list of AttributeBase instances, one for each member of the list
+        :param list_name: name of the list the members were expanded from
+        '''
+        self.members = members
+        self.attr_path = ''
+        AttributeBase.__init__(self, tag=list_name, **kwargs)
+
+    def __repr__(self):
+        return self.__class__.__name__ + ': [' + ', '.join(repr(member) for member in self.members) + ']'
+
+    def set_read_hook(self, readhook):
+        self.readhook = readhook
+        for member in self.members:
+            member.set_read_hook(self.member_read)
+
+    def set_batch_read_hook(self, batch_readhook):
+        self.batch_readhook = batch_readhook
+
+    def set_write_hook(self, writehook):
+        for member in self.members:
+            member.set_write_hook(writehook)
+
+    def member_read(self, path):
+        '''Read hook of the members, answered from the batched read'''
+        if path not in self.values:
+            # first execution, or a path depending on another value read (ex. mode dependent PV paths)
+            self.values[path] = self.readhook(path)
+            if path not in self.paths:
+                self.paths.append(path)
+        return self.values[path]
+
+    def read_batch(self):
+        '''Reads every recorded path in one request, or one at a time without a batch read hook'''
+        if self.batch_readhook is not None and self.paths:
+            self.values = dict(zip(self.paths, self.batch_readhook(list(self.paths))))
+        else:
+            self.values = dict((path, self.readhook(path)) for path in self.paths)
+
+    def read(self):
+        self.read_batch()
+        return [member.read() for member in self.members]
+
+    def execute(self):
+        if not self.exe_start:
+            self.start_timer()
+        self.exe_cnt += 1
+
+        self.read_batch()
+        results = [member.execute() for member in self.members]
+        return self.set_complete(all(results))
+
+    def force(self):
+        for member in self.members:
+            member.force()
+
+
 class Calculate(AttributeBase):
     def __init__(self, lhs = AttributeDummy(), op = '', rhs = AttributeDummy()):
         self.lhs = lhs
@@ -0,0 +1,216 @@
+'''
+Module contains the execution state of test runs against a shared state diagram.
+
+The attributes of a built diagram are part of the model and are not changed by running tests. What an
+attribute records while executing - completion, execution count, timer, trend data, connection hooks - is
+run state, held in columns indexed by the run index of each attribute. Attributes read and write their run
+state through RunField descriptors.
+
+Run indexes are numbered 0..N-1 per model: a RunLayout indexes the attributes of one diagram when it is
+finalized (see StateModel.StateDiagram.index_attributes), and every column of the model is sized from it.
+Attributes executed before any model indexed them get a layout of their own. Run state is held by the
+RunContext active in the current thread, with columns per layout, or by the layout itself when no context
+is active, so it is released together with its model. Test cases can so run in parallel threads against
+one diagram, each thread in its own context.
+
+Example calling:
+==============================
+from Attributes.RunContext import RunContext
+
+def run(test_case):
+    with RunContext(test_case.name):  # attributes executed by this thread start from a clean state
+        TestAdmin.Test(test_case=test_case.diagram, diagram=diagram, connection=OPC_Connect()).start()
+
+threads = [threading.Thread(target=run, args=(case,)) for case in generator.generate_test_cases().values()]
+==============================
+'''
+
+__author__ = 'ekopache'
+
+import threading
+from array import array
+
+_UNSET = object()  # object column value of a field never set
+_local = threading.local()
+_lock = threading.Lock()  # guards layouts of attributes indexed on first use
+
+
+def get_column(columns, field, size, lock):
+    '''Returns the column of a RunField in columns, {field name: column}, grown to size'''
+    column = columns.get(field.name)
+    if column is None or len(column) < size:
+        with lock:
+            column = columns.get(field.name)
+            if column is None:
+                column = columns[field.name] = field.new_column(size)
+            elif len(column) < size:
+                column.extend(field.new_column(size - len(column)))
+    return column
+
+
+class RunLayout(object):
+    '''Run indexes of the attributes of one model, numbered 0..size-1'''
+
+    def __init__(self, attributes=()):
+        self.size = 0
+        self.columns = dict()  # {field name: column} of the run state outside of any RunContext
+        self.lock = threading.Lock()
+        self.add(attributes)
+
+    def __repr__(self):
+        return 'RunLayout: %d attributes' % self.size
+
+    def __getstate__(self):
+        '''Run state and indexes are not pickled, attributes are indexed again when loaded'''
+        return dict()
+
+    def __setstate__(self, state):
+        self.__init__()
+
+    def add(self, attributes):
+        '''Indexes attributes, and the attributes they execute, that are not yet indexed in this layout'''
+        stack = list(attributes)
+        with self.lock:
+            while stack:
+                attribute = stack.pop()
+                run_attributes = getattr(type(attribute), 'run_attributes', None)
+                if run_attributes is None or attribute.__dict__.get('run_slot', (None,))[0] is self:
+                    continue
+                attribute.__dict__['run_slot'] = (self, self.size)
+                self.size += 1
+                stack.extend(run_attributes(attribute))
+        return self
+
+    def column(self, field):
+        '''Returns the column of a RunField outside of any RunContext'''
+        return get_column(self.columns, field, self.size, self.lock)
+
+
+def run_slot(attribute):
+    '''Returns (RunLayout, run index) of attribute, indexed in a layout of its own if no model indexed it'''
+    slot = attribute.__dict__.get('run_slot')
+    if slot is None:
+        with _lock:
+            slot = attribute.__dict__.get('run_slot')
+            if slot is None:
+                layout = RunLayout()
+                layout.size = 1
+                slot = attribute.__dict__['run_slot'] = (layout, 0)
+    return slot
+
+
+def field_column(field, attribute):
+    '''Returns (column, run index) of a RunField of attribute, in the active RunContext'''
+    layout, index = run_slot(attribute)
+    context = current_context()
+    column = layout.column(field) if context is None else context.column(field, layout)
+    return column, index
+
+
+class RunField(object):
+    '''Data descriptor of an attribute field held by the active RunContext, in a list of objects'''
+
+    def __init__(self, name, default=None):
+        '''
+        :param name: name of the column in RunContext
+        :param default: function returning the value of the field in a new context,
+                        None to raise AttributeError until the field is set
+        '''
+        self.name = name
+        self.default = default
+
+    def new_column(self, size=0):
+        return [_UNSET] * size
+
+    def __get__(self, attribute, owner):
+        if attribute is None:
+            return self
+        column, index = field_column(self, attribute)
+        value = column[index]
+        if value is _UNSET:
+            if self.default is None:
+                raise AttributeError("'%s' object has no attribute '%s'" % (owner.__name__, self.name))
+            value = column[index] = self.default()
+        return value
+
+    def __set__(self, attribute, value):
+        column, index = field_column(self, attribute)
+        column[index] = value
+
+
+class ArrayField(RunField):
+    '''Run field of numbers or flags, held in a typed array'''
+
+    def __init__(self, name, typecode, default, none_value=None):
+        '''
+        :param typecode: array typecode of the column
+        :param default: value of the field in a new context
+        :param none_value: number standing for None in the column, None if the field is never None
+        '''
+        RunField.__init__(self, name)
+        self.typecode = typecode
+        self.none_value = none_value
+        self.fill = self.encode(default)
+
+    def encode(self, value):
+        if value is None:
+            return self.none_value
+        return int(value) if self.typecode == 'b' else value
+
+    def decode(self, value):
+        if self.none_value is not None and (value == self.none_value or value != value):  # NaN stands for None
+            return None
+        return bool(value) if self.typecode == 'b' else value
+
+    def new_column(self, size=0):
+        return array(self.typecode, [self.fill]) * size
+
+    def __get__(self, attribute, owner):
+        if attribute is None:
+            return self
+        column, index = field_column(self, attribute)
+        return self.decode(column[index])
+
+    def __set__(self, attribute, value):
+        column, index = field_column(self, attribute)
+        column[index] = self.encode(value)
+
+
+class RunContext(object):
+    '''Run state of the attributes executed in one test run'''
+
+    def __init__(self, name='run'):
+        self.name = name
+        self.columns = dict()  # {RunLayout: {field name: column of the field values, by run index}}
+        self.lock = threading.Lock()
+
+    def __repr__(self):
+        return 'RunContext: ' + str(self.name)
+
+    def column(self, field, layout):
+        '''Returns the column of a RunField for the attributes of layout, sized from the layout'''
+        columns = self.columns.get(layout)
+        if columns is None:
+            with self.lock:
+                columns = self.columns.setdefault(layout, dict())
+        return get_column(columns, field, layout.size, self.lock)
+
+    def reset(self):
+        '''Clears the run state of every attribute'''
+        with self.lock:
+            self.columns = dict()
+
+    def __enter__(self):
+        '''Activates the context in the current thread'''
+        stack = _local.__dict__.setdefault('stack', list())
+        stack.append(self)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        _local.stack.pop()
+
+
+def current_context():
+    '''Returns the RunContext active in the current thread, None if none is active'''
+    stack = getattr(_local, 'stack', None)
+    return stack[-1] if stack else None
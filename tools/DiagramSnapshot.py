@@ -0,0 +1,215 @@
+'''
+Module contains a compiled snapshot format for fully built state diagrams.
+
+A snapshot holds a StateDiagram with its states, superstate hierarchy, transitions and solved
+attributes, so that it can be restored without running the pre-processor, lexer, attribute parser
+or DVConfig queries again. Each snapshot starts with a header recording the snapshot format version,
+the content hash of the spec and its includes, and a hash of the build configuration. A snapshot
+is stale once any of them differs, and load_or_build rebuilds and saves it again.
+
+Loggers are stored by name and re-attached on load; read/write hooks and other callables are
+not stored and are None after loading.
+
+Example calling:
+==============================
+import DiagramSnapshot
+
+diagram = DiagramSnapshot.load_or_build(spec_path, attribute_builder=abuilder)
+
+DiagramSnapshot.save(diagram, 'diagram.snapshot', spec_path)
+diagram = DiagramSnapshot.load('diagram.snapshot', spec_path)  # None if stale
+==============================
+'''
+
+__author__ = 'ekopache'
+
+import os
+import sys
+import time
+import types
+import hashlib
+import logging
+import tempfile
+import cPickle as pickle
+
+import config
+import ModelBuilder
+import StateModel
+import PlantUML_Preprocessor
+from Attributes.AttributeBase import AttributeBase
+
+from Utilities.Logger import LogTools
+dlog = LogTools('DiagramSnapshot.log', 'DiagramSnapshot')
+dlog.rootlog.warning('Module initialized')
+
+# version of the snapshot format and of the model classes it holds, snapshots of other versions are stale
+SNAPSHOT_VERSION = 5
+
+# deeply nested state references are pickled recursively
+RECURSION_LIMIT = 20000
+
+
+def config_hash(attribute_builder=None, preprocess=True):
+    '''
+    Hash of the build configuration a diagram depends on besides its spec
+    :param attribute_builder: AttributeBuilder the diagram is built with, identified by its DVConfig server
+    :param preprocess: diagram is built from pre-processed spec
+    :return: hex digest string
+    '''
+    settings = [preprocess, preprocess and config.preprocessor,
+                config.lexer_backend, config.lexer_recover, config.lexer_stream]
+    if attribute_builder is not None:
+        settings.append((attribute_builder.client.address, attribute_builder.client.port))
+    return hashlib.sha1(repr(settings)).hexdigest()
+
+
+def snapshot_path(spec_path):
+    '''Returns default snapshot path of a spec, in config.snapshot_path'''
+    name = os.path.splitext(os.path.basename(spec_path))[0]
+    path_hash = hashlib.sha1(os.path.abspath(spec_path)).hexdigest()[:12]
+    return os.path.join(config.snapshot_path, '%s-%s.snapshot' % (name, path_hash))
+
+
+def _persistent_id(obj):
+    '''
+    Stores loggers by name and methods of attributes by name, ex. InterlockAttribute._default_test.
+    Other callables (connection read/write hooks, builder callbacks) are dropped.
+    '''
+    if isinstance(obj, logging.Logger):
+        return 'logger:' + obj.name
+    if isinstance(obj, types.MethodType) and isinstance(obj.im_self, AttributeBase):
+        return 'method', obj.im_self, obj.__name__
+    if isinstance(obj, (types.FunctionType, types.MethodType, types.BuiltinMethodType)):
+        return 'callable'
+    return None
+
+
+def _persistent_load(pid):
+    if isinstance(pid, tuple) and pid[0] == 'method':
+        return getattr(pid[1], pid[2])
+    if pid.startswith('logger:'):
+        return logging.getLogger(pid[len('logger:'):])
+    return None
+
+
+def resolve_all_attributes(diagram):
+    '''Solves every lazy attribute in diagram, including superstate transitions'''
+    diagrams = [diagram]
+    while diagrams:
+        current = diagrams.pop()
+        for owner in current.transitions + current.state_names.values():
+            owner.resolve_attributes()
+        diagrams.extend(state.substates for state in current.state_names.values() if state.has_substate_diagram())
+    diagram.index_attributes()
+
+
+def save(diagram, path, spec_path, attribute_builder=None, preprocess=True):
+    '''
+    Writes a snapshot of a fully built diagram, solving any lazy attributes first
+    :param diagram: StateModel.StateDiagram
+    :param path: snapshot file path
+    :param spec_path: spec the diagram was built from
+    :param attribute_builder: AttributeBuilder the diagram was built with, see config_hash
+    :param preprocess: diagram was built from pre-processed spec
+    '''
+    resolve_all_attributes(diagram)
+    header = {
+        'version': SNAPSHOT_VERSION,
+        'spec_path': os.path.abspath(spec_path),
+        'spec_hash': PlantUML_Preprocessor.spec_hash(spec_path),
+        'config_hash': config_hash(attribute_builder, preprocess),
+        'created': time.time(),
+    }
+
+    folder = os.path.dirname(os.path.abspath(path))
+    if not os.path.isdir(folder):
+        os.makedirs(folder)
+    fd, temp_path = tempfile.mkstemp(dir=folder, suffix='.tmp')
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pickler = pickle.Pickler(f, pickle.HIGHEST_PROTOCOL)
+            pickler.persistent_id = _persistent_id
+            pickler.dump(header)
+            pickler.dump(diagram)
+        os.rename(temp_path, path)  # readers never see a partial snapshot
+    except:
+        os.remove(temp_path)
+        raise
+    finally:
+        sys.setrecursionlimit(limit)
+
+
+def is_current(header, spec_path, attribute_builder=None, preprocess=True):
+    '''True if a snapshot header matches the snapshot version, current spec contents and build configuration'''
+    if not header or header.get('version') != SNAPSHOT_VERSION:
+        return False
+    try:
+        current_hash = PlantUML_Preprocessor.spec_hash(spec_path)
+    except IOError:
+        return False
+    return header.get('spec_hash') == current_hash and \
+        header.get('config_hash') == config_hash(attribute_builder, preprocess)
+
+
+def load(path, spec_path=None, attribute_builder=None, preprocess=True):
+    '''
+    Reads a snapshot written by save
+    :param spec_path: spec to check the snapshot against, None skips the staleness check (version is always checked)
+    :param attribute_builder: AttributeBuilder a rebuilt diagram would use, see config_hash
+    :return: StateModel.StateDiagram, or None if the snapshot is missing, unreadable or stale
+    '''
+    limit = sys.getrecursionlimit()
+    sys.setrecursionlimit(max(limit, RECURSION_LIMIT))
+    try:
+        with open(path, 'rb') as f:
+            unpickler = pickle.Unpickler(f)
+            unpickler.persistent_load = _persistent_load
+            header = unpickler.load()
+            if not isinstance(header, dict) or header.get('version') != SNAPSHOT_VERSION:
+                dlog.rootlog.info('Snapshot version mismatch in ' + path)
+                return None
+            if spec_path is not None and not is_current(header, spec_path, attribute_builder, preprocess):
+                dlog.rootlog.info('Stale snapshot ' + path)
+                return None
+            diagram = unpickler.load()
+    except IOError:
+        return None
+    except Exception as e:
+        dlog.rootlog.warning('Unreadable snapshot ' + path + ': ' + repr(e))
+        return None
+    finally:
+        sys.setrecursionlimit(limit)
+
+    if not isinstance(diagram, StateModel.StateDiagram):
+        return None
+    diagram.index_attributes()
+    return diagram
+
+
+def load_or_build(spec_path, path=None, attribute_builder=None, preprocess=True):
+    '''
+    Loads the snapshot of a spec, building the diagram and saving a new snapshot if it is missing or stale
+    :param path: snapshot file path, defaults to snapshot_path(spec_path)
+    :return: StateModel.StateDiagram
+    '''
+    if path is None:
+        path = snapshot_path(spec_path)
+    diagram = load(path, spec_path, attribute_builder, preprocess)
+    if diagram is None:
+        diagram = ModelBuilder.build_state_diagram(spec_path, attribute_builder=attribute_builder, preprocess=preprocess)
+        save(diagram, path, spec_path, attribute_builder, preprocess)
+    return diagram
+
+
+if __name__ == "__main__":
+    from timeit import default_timer
+
+    spec_path = sys.argv[1] if len(sys.argv) > 1 else os.path.join(config.specs_path, 'EM', 'S_EMC_PRESS_CND.puml')
+    for label in ['first run', 'second run']:
+        start = default_timer()
+        diagram = load_or_build(spec_path)
+        print '%s: %d states, %d transitions in %.1f ms' % (label, len(diagram.state_names),
+                                                          len(diagram.get_transitions()),
+                                                          (default_timer() - start) * 1000)
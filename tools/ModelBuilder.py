@@ -2,26 +2,63 @@
 
 A model builder's primary function is to generate python objects from a stream of token:value
 pairs. These pairs will generally be the product of a pygments lexer.
+
+Builders emit a ModelEvent as each part of the model is recognized. Consumers can either subscribe
+callbacks, or iterate the events of iter_events while the token stream is consumed:
+==============================
+builder = StateModelBuilder()
+builder.subscribe(STATE_ADDED, lambda event: index.add(event.target.name))
+for event in builder.iter_events(PlantUML_Lexer.get_tokens_from_file(fpath, stream=True)):
+    if event.name == ATTRIBUTE_ATTACHED:
+        prefetch(event.value)
+diagram = builder.model
+==============================
 '''
 
 __author__ = 'erik'
 # imports for base model
+import os
+import re
 import pygments.token as Token
 import collections
+import config
 # imports for StateModelBuilder
 import StateModel
 import Attributes.AttributeBuilder as AttributeBuilder
+import Attributes.AttributePreprocessor as AttributePreprocessor
+import RecipeParameters
 from PlantUML_Lexer import TITLE, STATE, SALIAS, SATTR, SSTART, SEND, TSOURCE, TDEST, TATTR
 
 from Utilities.Logger import LogTools
+from Utilities.Profiler import BuildProfile, stage
 dlog = LogTools('ModelBuilder.log', 'ModelBuilder')
 dlog.rootlog.warning('Module initialized')
 
+# keyword in front of the title of TITLE tokens, ex. 'title TK_15_EM' or 'title: TK_15_EM'
+TITLE_PREFIX = re.compile(r'(?i)^\s*title(?:\s*:\s*|\s+)')
 
-class ModelBuilder(object):
+# events emitted by StateModelBuilder
+STATE_ADDED = 'state_added'  # target: new StateModel.State, including states created by transitions
+TRANSITION_ADDED = 'transition_added'  # target: new StateModel.Transition
+SUPERSTATE_CLOSED = 'superstate_closed'  # target: StateModel.State whose substates are complete
+ATTRIBUTE_ATTACHED = 'attribute_attached'  # target: State or Transition, value: attribute added to it
+
+
+class ModelEvent(collections.namedtuple('ModelEvent', 'name target value')):
+    '''Part of a model recognized by a builder: event name, model object and optional value'''
+
+
+class UnresolvedAttribute(object):
+    '''Placeholder for an attribute string attached while parsing, replaced once attributes are solved in bulk'''
 
-    # dictionary of {token types: callback functions}
-    action_tokens = dict()
+    def __init__(self, raw_string):
+        self.raw_string = raw_string
+
+    def __repr__(self):
+        return 'UnresolvedAttribute: ' + repr(self.raw_string)
+
+
+class ModelBuilder(object):
 
     # Text and Error tokens ignored by default
     ignored_tokens = [Token.Text, Token.Error]
@@ -30,13 +67,37 @@ class ModelBuilder(object):
         self.model_class = model_class
         self.model = self.model_class()
 
+        # dictionary of {token types: callback functions}, bound to this instance by subclasses
+        self.action_tokens = dict()
+
         self.q = collections.deque()  # holds tokens,val pairs drawn from the token generator
         # note: deque chosen over list because it's (1) thread-safe, (2) faster in size changes
 
-    def parse(self, token_stream):
+        self.events = collections.deque()  # events emitted by actions, not yet delivered by iter_events
+        self.profile = None  # Utilities.Profiler.BuildProfile timing parse, if profiled
+        self.subscribers = dict()  # {event name or None for all events: [callback(event), ...]}
+
+    def subscribe(self, event_name, callback):
+        '''
+        Registers callback(event) to be called as soon as each event is emitted, while parsing
+        :param event_name: name of events to receive, None for every event
+        :param callback: function called with each ModelEvent
+        '''
+        self.subscribers.setdefault(event_name, list()).append(callback)
+
+    def emit(self, event_name, target, value=None):
+        '''Notifies subscribers of a new event and queues it for iter_events'''
+        event = ModelEvent(event_name, target, value)
+        for callback in self.subscribers.get(event_name, []) + self.subscribers.get(None, []):
+            callback(event)
+        self.events.append(event)
+
+    def iter_events(self, token_stream):
         '''Parses lexed data, executing callbck functions as defined in subclass token_dict
+        and yielding the events they emit as soon as each action has run.
+        self.model is complete once the generator is exhausted.
         :param: token_stream    token generator as generated by selected pygments lexer
-        :returns: self.model_class instance
+        :returns: generator of ModelEvent
         '''
         actions_pending = 0
 
@@ -47,7 +108,7 @@ class ModelBuilder(object):
             token = token_tup[0]
             if token in self.__class__.ignored_tokens:
                 continue
-            elif token in self.__class__.action_tokens:
+            elif token in self.action_tokens:
                 actions_pending += 1
 
             self.q.append(token_tup)
@@ -57,6 +118,8 @@ class ModelBuilder(object):
                     # execute function defined
                     self.action_tokens[self.q[0][0]]()
                     actions_pending -= 1
+                    while self.events:
+                        yield self.events.popleft()
                 else:
                     continue
 
@@ -66,9 +129,20 @@ class ModelBuilder(object):
             if self.q[0][0] in self.action_tokens:
                 self.action_tokens[self.q[0][0]]()
                 actions_pending -= 1
+                while self.events:
+                    yield self.events.popleft()
             else:
                 dlog.rootlog.error("Non actionable token " + self.q.popleft() + " found at end of deque.")
 
+    def parse(self, token_stream):
+        '''Parses lexed data, executing callbck functions as defined in subclass token_dict
+        :param: token_stream    token generator as generated by selected pygments lexer
+        :returns: self.model_class instance
+        '''
+        with stage(self.profile, 'model_parse') as call:
+            for event in self.iter_events(token_stream):
+                call.items += 1
+
         # deliver populated model
         return self.model
 
@@ -78,16 +152,13 @@ class StateModelBuilder(ModelBuilder):
     Generates State Models from a token stream.
     '''
 
-    # dictionary used as case/switch statement
-    action_tokens = {}
-
     def __init__(self, *args, **kwargs):
 
         ModelBuilder.__init__(self, StateModel.StateDiagram)
         self.logger = dlog.MakeChild('StateModelBuilder')
 
-        # dictionary constructor - list of key,value pairs
-        update_dict = dict([
+        # dictionary used as case/switch statement
+        self.action_tokens.update([
             (TITLE, self.set_default_tag),  # TITLE should always be the tag name of the module under test
             (STATE, self.assign_state),
             (SALIAS, self.lookup_state),
@@ -95,17 +166,24 @@ class StateModelBuilder(ModelBuilder):
             (TSOURCE, self.assign_trans),
             ])
 
-        StateModelBuilder.action_tokens.update(update_dict)
-
         self.superstate_stack = [None]  # stack of nested superstates
         self.state_aliases = {}  # dictionary of {state_alias: state_name}
+        self.last_state = None  # name of the most recently assigned state
         self.diagram = self.model  # bind model instance to new name for code clarity
+        self.diagram.on_state_added = lambda state: self.emit(STATE_ADDED, state)
 
         # set attribute builder only if assigned on instansiation, otherwise leave as NoneType
         self.attr_builder = kwargs.pop('attribute_builder', None)
         if self.attr_builder:
             self.set_attribute_builder(self.attr_builder)
 
+        # solve attributes in one pass once the token stream is consumed, instead of one at a time
+        self.bulk_attributes = kwargs.pop('bulk_attributes', False)
+        # attach AttributeBuilder.LazyAttribute placeholders, solved on first use. Takes precedence over bulk.
+        self.lazy_attributes = kwargs.pop('lazy_attributes', False)
+        self.unresolved = list()  # UnresolvedAttribute placeholders attached so far in bulk mode
+        self.profile = kwargs.pop('profile', None)
+
     def set_attribute_builder(self, attribute_builder):
         '''
         Sets an AttributeBuilder instance that creates attribute instances from raw strings
@@ -116,17 +194,45 @@ class StateModelBuilder(ModelBuilder):
             raise TypeError
         else:
             self.attr_builder = attribute_builder
+            self.attr_builder.set_lists(self.diagram.lists)
+
+    def iter_events(self, token_stream):
+        '''Parses lexed data like ModelBuilder.iter_events, solving attributes in bulk at the end in bulk mode.
+        attribute_attached events carry UnresolvedAttribute placeholders in bulk mode.
+        '''
+        for event in ModelBuilder.iter_events(self, token_stream):
+            yield event
+        if self.unresolved:
+            self.resolve_attributes()
+        self.diagram.index_attributes()
+
+    def resolve_attributes(self):
+        '''
+        Solves the raw strings of all UnresolvedAttribute placeholders with a single
+        AttributeBuilder.solve_attributes call, replacing each placeholder wherever it is attached
+        '''
+        placeholders, self.unresolved = self.unresolved, list()
+        self.attr_builder.set_lists(self.diagram.lists)
+        solved = self.attr_builder.solve_attributes([p.raw_string for p in placeholders])
+        replacements = dict((id(p), self.check_attribute_instance(p.raw_string, value))
+                            for p, value in zip(placeholders, solved))
+        self.logger.debug('Solved %d attributes, %d unique', len(placeholders), len(set(p.raw_string for p in placeholders)))
+
+        for owner in self.diagram.attribute_owners():
+            owner.attrs[:] = [replacements.get(id(attr), attr) for attr in owner.attrs]
 
     def set_default_tag(self):
         '''Sets the diagramid and attribute_builder.default_tag to TITLE'''
-        diagram_title = self.q.popleft()[1].lstrip('title ')
+        diagram_title = title_tag(self.q.popleft()[1])
         self.diagram.id = diagram_title
-        self.attr_builder.set_default_tag(diagram_title)
+        if self.attr_builder:
+            self.attr_builder.set_default_tag(diagram_title)
 
     def assign_state(self):
         '''All state names are unique and required for assignment.
         Will not double-add states to self.diagram.'''
         state_name = self.q.popleft()[1]
+        self.last_state = state_name
         if self.q[0][0] == SSTART:
             self.start_superstate(state_name)
         else:
@@ -135,8 +241,13 @@ class StateModelBuilder(ModelBuilder):
         if self.q[0][0] == SATTR:
             self.add_state_attr(state_name, self.q.popleft()[1])
 
-    def lookup_state(self, state_alias):
-        return self.diagram.states[state_alias]
+    def lookup_state(self):
+        '''Records a state alias against the state name following or preceding it in the token stream'''
+        state_alias = self.q.popleft()[1]
+        if len(self.q) > 0 and self.q[0][0] == STATE:
+            self.state_aliases[state_alias] = self.q[0][1]
+        elif self.last_state is not None:
+            self.state_aliases[state_alias] = self.last_state
 
     def add_state_attr(self, state_name, attribute_value):
         '''
@@ -144,7 +255,9 @@ class StateModelBuilder(ModelBuilder):
         leave as raw string/unicode type.
         In either case the attribute is added to the state's attribute list.
         '''
-        self.diagram.add_state_attr(state_name, self.create_attribute_instances(attribute_value))
+        attribute = self.create_attribute_instances(attribute_value)
+        self.diagram.add_state_attr(state_name, attribute)
+        self.emit(ATTRIBUTE_ATTACHED, self.diagram.get_state(state_name), attribute)
 
     def start_superstate(self, state_name):
         self.q.popleft()[1]  # consume delimiter "{"
@@ -153,7 +266,9 @@ class StateModelBuilder(ModelBuilder):
 
     def end_superstate(self):
         self.q.popleft()[1]  # consume delimiter "}"
-        self.superstate_stack.pop(-1)
+        state_name = self.superstate_stack.pop(-1)
+        if state_name is not None:
+            self.emit(SUPERSTATE_CLOSED, self.diagram.get_state(state_name))
 
     def assign_trans(self):
         '''Assigns a transition to the diagram and State.source, State.destination values'''
@@ -166,11 +281,14 @@ class StateModelBuilder(ModelBuilder):
             raise AttributeError
         # add transition to graph
         if len(self.q) > 0 and self.q[0][0] == TATTR:
-            transition_attribute = self.q.popleft()[1]
+            transition_attribute = self.create_attribute_instances(self.q.popleft()[1])
             self.diagram.add_transition(source, dest, parent_state=self.superstate_stack[-1],
-                                        attributes=self.create_attribute_instances(transition_attribute))
+                                        attributes=transition_attribute)
+            self.emit(TRANSITION_ADDED, self.diagram.transitions[-1])
+            self.emit(ATTRIBUTE_ATTACHED, self.diagram.transitions[-1], transition_attribute)
         else:
             self.diagram.add_transition(source, dest, parent_state=self.superstate_stack[-1])
+            self.emit(TRANSITION_ADDED, self.diagram.transitions[-1])
 
     def create_attribute_instances(self, raw_value):
         '''
@@ -179,32 +297,137 @@ class StateModelBuilder(ModelBuilder):
         :return:
         '''
 
-        if self.attr_builder and type(raw_value) in [str, unicode]:
-            attribute_value = self.attr_builder.solve_attribute(raw_value)
-            if isinstance(attribute_value, AttributeBuilder.AttributeBase):
-                self.logger.debug("Added attribute instance %s, as %s", attribute_value, type(attribute_value))
-            # return raw string if no attribute value match
-            # (will be empty list from attr_builder.solver_attribute)
-            elif not attribute_value:
-                self.logger.warning("No attribute instance created for %s", raw_value)
-                attribute_value = raw_value
+        attribute_value = raw_value
+        definition = AttributePreprocessor.list_definition(raw_value) if type(raw_value) in [str, unicode] else None
+        if definition:
+            # lists are known to the whole diagram as it is parsed, so comprehensions solved lazily or in bulk
+            # do not depend on the order attributes are solved in
+            self.diagram.lists[definition[0]] = definition[1]
+
+        declared = self.diagram.lists.get(RecipeParameters.PARAM_LIST)
+        if type(raw_value) in [str, unicode] and RecipeParameters.is_symbolic(raw_value, declared):
+            # bound to recipe parameter values after the build, see RecipeParameters.ParameterMatrix
+            self.logger.debug("Attribute %s left unsolved, references recipe parameters", raw_value)
+        elif self.attr_builder and type(raw_value) in [str, unicode]:
+            if self.lazy_attributes:
+                attribute_value = self.attr_builder.lazy_attribute(raw_value)
+            elif self.bulk_attributes:
+                attribute_value = UnresolvedAttribute(raw_value)
+                self.unresolved.append(attribute_value)
+            else:
+                attribute_value = self.check_attribute_instance(raw_value, self.attr_builder.solve_attribute(raw_value))
+
+        return attribute_value
 
+    def check_attribute_instance(self, raw_value, attribute_value):
+        '''Returns attribute_value solved from raw_value, or raw_value if no attribute was solved'''
+        if isinstance(attribute_value, AttributeBuilder.AttributeBase):
+            self.logger.debug("Added attribute instance %s, as %s", attribute_value, type(attribute_value))
+        # return raw string if no attribute value match
+        # (will be empty list from attr_builder.solver_attribute)
+        elif not attribute_value:
+            self.logger.warning("No attribute instance created for %s", raw_value)
+            attribute_value = raw_value
         return attribute_value
 
 
-def build_state_diagram(fpath, attribute_builder=None, preprocess=True):
+def title_tag(title_value):
+    '''Returns the tag named by the value of a TITLE token, ie. without the title keyword'''
+    return TITLE_PREFIX.sub('', title_value).strip()
+
+
+def collect_alias_tokens(token_stream):
+    '''
+    Reads a token stream once, collecting the aliases of its attribute tokens and its title
+    :return: (sorted list of alias names, tag of the first title or None)
+    '''
+    aliases, title = set(), None
+    for item in token_stream:
+        if item[0] in (SATTR, TATTR):
+            aliases.update(AttributePreprocessor.find_aliases(item[1]))
+        elif item[0] == TITLE and title is None:
+            title = title_tag(item[1])
+    return sorted(aliases), title
+
+
+def resolve_alias_tokens(token_stream, attribute_builder, unit=None, scan_stream=None):
+    '''
+    Substitutes the #ALIAS# placeholders of all attribute tokens before any attribute string is parsed.
+    Aliases are collected over the whole token stream and resolved with a single request per unit.
+    Collecting the aliases reads token_stream into memory first, unless a separate scan_stream of the same
+    input is given: scan_stream is then read for the aliases, and token_stream is substituted as it streams.
+    :param token_stream: token generator as generated by selected pygments lexer
+    :param attribute_builder: AttributeBuilder resolving and caching the aliases
+    :param unit: unit tag owning the aliases, defaults to the diagram title or attribute_builder.default_tag
+    :param scan_stream: second token generator of the same input, ex. for memory-mapped token streams
+    :return: list of tokens, or token generator if scan_stream is given
+    '''
+    if scan_stream is None:
+        token_stream = list(token_stream)
+        scan_stream = token_stream
+    aliases, title = collect_alias_tokens(scan_stream)
+    if not aliases:
+        return token_stream
+
+    if unit is None:
+        unit = title or attribute_builder.default_tag
+    if not unit:
+        dlog.rootlog.warning('No unit to resolve aliases ' + ', '.join(aliases))
+        return token_stream
+
+    alias_map = attribute_builder.resolve_aliases(unit, aliases)
+    tokens = ((item[0], AttributePreprocessor.substitute_aliases(item[1], alias_map)) + tuple(item[2:])
+              if item[0] in (SATTR, TATTR) else item for item in token_stream)
+    return tokens if token_stream is not scan_stream else list(tokens)
+
+
+def build_state_diagram(fpath, attribute_builder=None, preprocess=True, stream=None, bulk_attributes=False,
+                        lazy_attributes=False, profile=None, resolve_aliases=False):
     '''
     Returns a state diagram lexed from the given plantUML model
     :param fpath: path to state diagram *.puml file
     :param preprocess: run plantUML preprocessor on diagram
     :param attribute_builder: attribute builder instance for defining attribute logic
+    :param stream: lex through a memory map of the file, see PlantUML_Lexer.get_tokens_from_file
+    :param bulk_attributes: solve all attributes after parsing, querying the configuration of each tag once
+        (concurrently over attribute_builder.workers connections, see AttributeBuilder.fetch_module_info)
+    :param lazy_attributes: attach placeholders solved on first use, see AttributeBuilder.LazyAttribute
+    :param profile: Utilities.Profiler.BuildProfile receiving the time of each build stage,
+        True for a new profile. Attached to the diagram as diagram.profile.
+    :param resolve_aliases: substitute #ALIAS# placeholders of the diagram unit first, see resolve_alias_tokens
     :return: StateModel.StateDiagram
     '''
     from PlantUML_Lexer import get_tokens_from_file
 
-    tkns = get_tokens_from_file(fpath, preprocess=preprocess)
-    builder = StateModelBuilder(attribute_builder=attribute_builder)
-    diagram = builder.parse(tkns)
+    if profile is True:
+        profile = BuildProfile(os.path.basename(fpath))
+    if attribute_builder is not None:
+        previous_profile = attribute_builder.profile
+        attribute_builder.set_profile(profile)
+
+    diagnostics = list()
+    try:
+        with stage(profile, 'build_state_diagram'):
+            tkns = get_tokens_from_file(fpath, preprocess=preprocess, diagnostics=diagnostics, stream=stream,
+                                        profile=profile)
+            if resolve_aliases and attribute_builder is not None:
+                # streamed input is lexed a second time to collect the aliases, instead of being held in memory
+                streamed = stream if stream is not None else config.lexer_stream
+                scan = get_tokens_from_file(fpath, preprocess=preprocess, stream=True) if streamed else None
+                tkns = resolve_alias_tokens(tkns, attribute_builder, scan_stream=scan)
+            builder = StateModelBuilder(attribute_builder=attribute_builder, bulk_attributes=bulk_attributes,
+                                        lazy_attributes=lazy_attributes, profile=profile)
+            diagram = builder.parse(tkns)
+    finally:
+        if attribute_builder is not None:
+            attribute_builder.set_profile(previous_profile)
+    if profile is not None:
+        profile.finish()
+
+    diagram.profile = profile
+    diagram.diagnostics = diagnostics
+    for diagnostic in diagnostics:
+        dlog.rootlog.warning('Unrecognized input in ' + fpath + ', ' + str(diagnostic))
 
     dlog.rootlog.info("New diagram parsed from ", fpath)
     dlog.rootlog.info("Parsed " + str(len(diagram.state_names.values())) + "states")
@@ -0,0 +1,164 @@
+'''
+Module contains a fuzz and benchmark harness for the lexers in PlantUML_Lexer.
+
+Adversarial lines are built from a prefix (start of a state, transition, note... definition),
+a unit repeated n times (spaces, <<stereotypes>>, brackets, hash words...) and a suffix that
+usually keeps the line from matching, forcing each rule to backtrack as far as it can.
+A rule with excessive backtracking shows up as regex time growing faster than n.
+
+Example calling:
+==============================
+import PlantUML_Fuzz
+
+for offender in PlantUML_Fuzz.rule_growth(n=40):
+    print offender['ratio'], offender['pattern'], repr(offender['line'])
+for size, seconds in PlantUML_Fuzz.lexing_growth([25 * 1024, 50 * 1024, 100 * 1024]):
+    print size, seconds
+for size, attempts in PlantUML_Fuzz.lexing_attempts([25 * 1024, 50 * 1024, 100 * 1024]):
+    print size, attempts
+==============================
+'''
+
+__author__ = 'ekopache'
+
+import random
+import itertools
+from timeit import default_timer
+
+import PlantUML_Lexer
+
+PREFIXES = ['', 'state S1', 'state "A b" as S1', 'state S1 as "A b"', 'state S1 <<a>>', 'state S1 [[',
+            'state S1 [[x', 'S1', 'S1 <<a>>', 'S1 -->', 'S1 --> S2', 'S1 --', 'S1 -[bold]', '"S 1"', 'S1 : ',
+            'note left of S1', 'url of S1 is [[', 'skinparam', 'skinparam x', 'skinparam x<<a>>', 'title']
+UNITS = [' ', '\t', 'a', 'a.b', 'x|y', '-', '-->', ':', '"', '{', '[', '[[', ']]', '[[a]] ', '<<', '>>',
+         '<<a>>', ' <<a>> ', '#a', ' #a-b ', ' ## ', '##[bold]x', ' begin', '==']
+SUFFIXES = ['', 'x', ' {x', '\x01']
+
+
+def adversarial_line(prefix, unit, suffix, n):
+    return prefix + unit * n + suffix
+
+
+def adversarial_spec(size, seed=0, max_repeat=500):
+    '''
+    Generates a spec of adversarial lines mixed with ordinary state and transition definitions
+    :param size: minimum length of the spec text
+    :param seed: random seed, the same seed always gives the same spec
+    :param max_repeat: maximum number of unit repetitions in each adversarial line
+    :return: unicode spec text
+    '''
+    rand = random.Random(seed)
+    lines = [u'@startuml']
+    length = 0
+    while length < size:
+        if rand.random() < 0.5:
+            line = adversarial_line(rand.choice(PREFIXES), rand.choice(UNITS), rand.choice(SUFFIXES),
+                                    rand.randint(1, max_repeat))
+        else:
+            line = rand.choice(['S%d --> S%d : T%d', 'S%d : Set OAR = "%d" to %d', 'state S%d {', '}'])
+            line = line % ((rand.randint(0, 99),) * line.count('%d'))
+        lines.append(unicode(line))
+        length += len(line) + 1
+    lines.append(u'@enduml')
+    return u'\n'.join(lines) + u'\n'
+
+
+def rule_times(text, backend='pygments', repeat=1):
+    '''
+    Lexes text with rule profiling
+    :param repeat: number of times text is lexed, the best time of each rule is kept
+    :return: dictionary of {(state name, rule index): cumulative regex time in seconds}
+    '''
+    times = dict()
+    for i in range(repeat):
+        lexer = PlantUML_Lexer.get_lexer(backend, profile=PlantUML_Lexer.RuleProfile())
+        for item in lexer.get_tokens_unprocessed(text):
+            pass
+        for r in lexer.profile.report():
+            key = (r['state'], r['index'])
+            times[key] = min(times.get(key, r['time']), r['time'])
+    return times
+
+
+def _growth(short, long, threshold, min_time):
+    '''Returns {(state name, rule index): time ratio} of rules growing faster than threshold'''
+    ratios = dict()
+    for key, seconds in long.items():
+        ratio = seconds / max(short.get(key, 0.0), 1e-6)
+        if seconds > min_time and ratio > threshold:
+            ratios[key] = ratio
+    return ratios
+
+
+def rule_growth(n=40, factor=2, threshold=3.0, min_time=0.002, prefixes=PREFIXES, units=UNITS, suffixes=SUFFIXES):
+    '''
+    Finds rules whose regex time grows faster than the length of adversarial lines
+    :param n: number of unit repetitions in the short line of each pair
+    :param factor: length factor between the short and long line
+    :param threshold: time ratio above which a rule is reported, ~factor for linear rules
+    :param min_time: ignore rules taking less than min_time seconds on the long line (timer noise)
+    :return: list of dictionaries {state, index, pattern, line, ratio}, worst first
+    '''
+    offenders = list()
+    for prefix, unit, suffix in itertools.product(prefixes, units, suffixes):
+        short_text = u'@startuml\n%s\n@enduml\n' % adversarial_line(prefix, unit, suffix, n)
+        line = adversarial_line(prefix, unit, suffix, n * factor)
+        long_text = u'@startuml\n%s\n@enduml\n' % line
+        if not _growth(rule_times(short_text), rule_times(long_text), threshold, min_time):
+            continue
+        # confirm with best of several runs, single runs are subject to timer noise
+        ratios = _growth(rule_times(short_text, repeat=5), rule_times(long_text, repeat=5), threshold, min_time)
+        for (state, index), ratio in ratios.items():
+            pattern = PlantUML_Lexer.puml_state_lexer._tokens[state][index][0].__self__.pattern
+            offenders.append({'state': state, 'index': index, 'pattern': pattern, 'line': line, 'ratio': ratio})
+    return sorted(offenders, key=lambda o: o['ratio'], reverse=True)
+
+
+def lexing_growth(sizes, backend=None, repeat=3, seed=0):
+    '''
+    Times lexing of adversarial specs of increasing size
+    :param sizes: list of spec sizes in characters
+    :param backend: lexer backend, see PlantUML_Lexer.get_lexer
+    :return: list of (size, best time in seconds) tuples
+    '''
+    results = list()
+    for size in sizes:
+        text = adversarial_spec(size, seed)
+        best = None
+        for i in range(repeat):
+            start = default_timer()
+            for item in PlantUML_Lexer.get_lexer(backend).get_tokens_unprocessed(text):
+                pass
+            elapsed = default_timer() - start
+            best = elapsed if best is None else min(best, elapsed)
+        results.append((size, best))
+    return results
+
+
+def count_attempts(text, backend=None):
+    '''Returns number of regex attempts of lexing text, independent of the speed of the machine'''
+    lexer = PlantUML_Lexer.get_lexer(backend, profile=PlantUML_Lexer.RuleProfile())
+    for item in lexer.get_tokens_unprocessed(text):
+        pass
+    return sum(stat[0] for stat in lexer.profile.stats.values())
+
+
+def lexing_attempts(sizes, backend=None, seed=0):
+    '''
+    Counts regex attempts of lexing adversarial specs of increasing size, see lexing_growth
+    :return: list of (size, number of regex attempts) tuples
+    '''
+    return [(size, count_attempts(adversarial_spec(size, seed), backend)) for size in sizes]
+
+
+if __name__ == "__main__":
+
+    print 'Rules with super-linear regex time:'
+    for offender in rule_growth():
+        print '%-6s %3d %6.1fx  %-60r %s' % (offender['state'], offender['index'], offender['ratio'],
+                                              offender['line'][:60], offender['pattern'][:50])
+
+    print 'Adversarial spec lexing time:'
+    for backend in ['pygments', 'line']:
+        for size, seconds in lexing_growth([25 * 1024, 50 * 1024, 100 * 1024], backend):
+            print '%-8s %7d chars %8.1f ms' % (backend, size, seconds * 1000)
@@ -0,0 +1,473 @@
+'''
+Python module for pre-processing plantUML text without a round trip through the plantUML jar.
+
+Supported pre-processor directives:
+    !include <path>                 relative to the including file. As in plantUML, a file is included
+                                    only once, later !include lines of the same file are dropped
+    !include_once <path>            same as !include
+    !include_many <path>            included again at each !include_many line
+    !define NAME [value]            simple text substitution on word boundaries, the value is
+                                    expanded with the definitions made before it
+    !define NAME(arg, ...) body     function-like substitution, '##' concatenates tokens
+    !undef NAME
+    !definelong NAME(arg, ...)      multi-line macro, terminated by !enddefinelong
+    !ifdef NAME / !ifndef NAME / !else / !endif
+    !pragma ...                     passed through to the lexer
+    trailing backslash              line continuation
+
+Output is the text of the first @startuml/@enduml block with all directives resolved,
+the same text returned by 'java -jar plantuml.jar -encodeurl' followed by '-decodeurl'.
+'''
+__author__ = 'ekopache'
+
+import os
+import re
+import hashlib
+import subprocess
+
+import config
+from Utilities.ContentCache import ContentCache
+
+# shared ContentCache of pre-processed text, see get_cache()
+preprocess_cache = None
+
+# directive patterns, matched against stripped lines
+INCLUDE = re.compile(r'^!include(_once|_many)?[\s]+(.+?)[\s]*$')
+DEFINE_FUNC = re.compile(r'^!define[\s]+([A-Za-z_][\w]*)\(([^)]*)\)(?:[\s]+(.*))?$')
+DEFINE = re.compile(r'^!define[\s]+([A-Za-z_][\w]*)(?:[\s]+(.*))?$')
+DEFINELONG = re.compile(r'^!definelong[\s]+([A-Za-z_][\w]*)(?:\(([^)]*)\))?[\s]*$')
+ENDDEFINELONG = re.compile(r'^!enddefinelong[\s]*$')
+UNDEF = re.compile(r'^!undef[\s]+([A-Za-z_][\w]*)[\s]*$')
+IFDEF = re.compile(r'^!(ifdef|ifndef)[\s]+([A-Za-z_][\w]*)[\s]*$')
+ELSE = re.compile(r'^!else[\s]*$')
+ENDIF = re.compile(r'^!endif[\s]*$')
+STARTUML = re.compile(r'^[\s]*@startuml')
+ENDUML = re.compile(r'^[\s]*@enduml')
+
+# comment line left in place of an include skipped by PumlPreprocessor.skip_include
+SKIPPED_INCLUDE = "' !skipped include "
+
+def split_args(arg_string):
+    '''Splits a macro argument string on commas, ignoring empty argument lists'''
+    if not arg_string or not arg_string.strip():
+        return []
+    return [arg.strip() for arg in arg_string.split(',')]
+
+
+def substitute_args(text, params, args, concat=True):
+    '''Replaces each macro parameter in text with its argument, then joins '##' concatenations'''
+    for param, arg in zip(params, args):
+        text = re.sub(r'\b' + re.escape(param) + r'\b', lambda m, a=arg: a, text)
+    if concat:
+        text = text.replace('##', '')
+    return text
+
+
+def resolve_include(include_path, cur_dir, root_path=None):
+    '''
+    Resolves an !include path relative to the including file, then relative to the root file
+    :return: absolute path of the included file, or None if it does not exist
+    '''
+    include_path = include_path.strip('"')
+    file_path = os.path.abspath(os.path.join(cur_dir, include_path))
+    if not os.path.isfile(file_path) and root_path:
+        file_path = os.path.abspath(os.path.join(os.path.dirname(root_path), include_path))
+    if os.path.isfile(file_path):
+        return file_path
+    return None
+
+
+def find_includes(file_path, missing=None):
+    '''
+    Scans !include directives without pre-processing the file
+    :param file_path: path to plantUML file
+    :param missing: list receiving the absolute path (relative to the including file) of each include not found
+    :return: list of absolute paths of all transitively included files, in order of first inclusion
+    '''
+    root_path = os.path.abspath(file_path)
+    includes = list()
+    pending = [root_path]
+    while pending:
+        cur_path = pending.pop(0)
+        with open(cur_path) as f:
+            for line in f:
+                m = INCLUDE.match(line.strip())
+                if not m:
+                    continue
+                include_path = resolve_include(m.group(2), os.path.dirname(cur_path), root_path)
+                if include_path is None and missing is not None:
+                    missing_path = os.path.abspath(os.path.join(os.path.dirname(cur_path), m.group(2).strip('"')))
+                    if missing_path not in missing:
+                        missing.append(missing_path)
+                if include_path and include_path not in includes and include_path != root_path:
+                    includes.append(include_path)
+                    pending.append(include_path)
+    return includes
+
+
+def spec_hash(file_path, *extra):
+    '''
+    Content hash of a plantUML file and every file it transitively includes
+    :param file_path: path to plantUML file
+    :param extra: additional strings to add to the hash, ex. pre-processor mode
+    :return: hex digest string
+    '''
+    digest = hashlib.sha1()
+    for path in [os.path.abspath(file_path)] + find_includes(file_path):
+        with open(path, 'rb') as f:
+            digest.update(hashlib.sha1(f.read()).hexdigest())
+    for item in extra:
+        digest.update(str(item))
+    return digest.hexdigest()
+
+
+class Define(object):
+    '''Simple or function-like !define'''
+
+    def __init__(self, name, value='', params=None):
+        self.name = name
+        self.value = value or ''
+        self.params = params
+        if params is None:
+            self.regex = re.compile(r'\b' + re.escape(name) + r'\b')
+        else:
+            self.regex = re.compile(r'\b' + re.escape(name) + r'[\s]*\(([^()]*)\)')
+
+    def apply(self, line):
+        if self.params is None:
+            return self.regex.sub(lambda m: self.value, line)
+        else:
+            return self.regex.sub(lambda m: substitute_args(self.value, self.params, split_args(m.group(1))),
+                                  line)
+
+
+class DefineLong(object):
+    '''Multi-line !definelong macro, expanded when its call is the only content of a line'''
+
+    def __init__(self, name, params=None):
+        self.name = name
+        self.params = params
+        self.body = list()
+        if params is None:
+            self.regex = re.compile(r'^[\s]*' + re.escape(name) + r'[\s]*()$')
+        else:
+            self.regex = re.compile(r'^[\s]*' + re.escape(name) + r'[\s]*\((.*)\)[\s]*$')
+
+    def expand(self, line):
+        '''Returns expanded body lines if line calls this macro, otherwise None'''
+        m = self.regex.match(line)
+        if not m:
+            return None
+        args = split_args(m.group(1))
+        # '##' within nested directives belongs to the nested definition
+        return [substitute_args(body_line, self.params or [], args, concat=not body_line.strip().startswith('!'))
+                for body_line in self.body]
+
+
+class PumlPreprocessor(object):
+    '''
+    Resolves pre-processor directives of a plantUML file.
+    A new instance should be used for each root file, as definitions persist across calls.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        self.defines = list()  # ordered list of Define instances
+        self.long_defines = dict()  # {name: DefineLong}
+        self.included = list()  # absolute paths of every included file, in order of inclusion
+        self.root_path = None
+        # optional function(absolute path) returning True for includes to leave out, ex. unit definitions.
+        # The first inclusion of a skipped file is replaced by a SKIPPED_INCLUDE comment line.
+        self.skip_include = kwargs.pop('skip_include', None)
+
+    def process_file(self, file_path):
+        '''
+        Pre-processes the first @startuml/@enduml block of the file at file_path
+        :param file_path: path to plantUML file
+        :returns pre-processed text
+        '''
+        self.root_path = os.path.abspath(file_path)
+        with open(self.root_path) as f:
+            lines = f.read().splitlines()
+
+        block = self.extract_block(lines)
+        if block is None:
+            raise IOError("No @startuml block found in " + file_path)
+
+        return '\n'.join(self.process_lines(block, os.path.dirname(self.root_path))) + '\n'
+
+    @staticmethod
+    def extract_block(lines):
+        '''Returns lines from the first @startuml to the next @enduml inclusive, or None'''
+        for start, line in enumerate(lines):
+            if STARTUML.match(line):
+                break
+        else:
+            return None
+        for end in range(start + 1, len(lines)):
+            if ENDUML.match(lines[end]):
+                return lines[start:end + 1]
+        return lines[start:]
+
+    def process_lines(self, lines, cur_dir):
+        '''
+        Resolves directives in lines
+        :param lines: list of raw text lines
+        :param cur_dir: directory used to resolve relative !include paths
+        :return: list of pre-processed lines
+        '''
+        output = list()
+        condition_stack = list()  # stack of booleans for !ifdef nesting, True means emit lines
+        long_define = None  # DefineLong currently being captured
+
+        lines = iter(lines)
+        for line in lines:
+            line = line.rstrip('\r')
+            # join continued lines
+            while line.endswith('\\') and not line.endswith('\\\\'):
+                try:
+                    line = line[:-1] + next(lines).rstrip('\r')
+                except StopIteration:
+                    line = line[:-1]
+            stripped = line.strip()
+
+            # capture !definelong bodies verbatim
+            if long_define:
+                if ENDDEFINELONG.match(stripped):
+                    self.long_defines[long_define.name] = long_define
+                    long_define = None
+                else:
+                    long_define.body.append(line)
+                continue
+
+            # conditionals
+            m = IFDEF.match(stripped)
+            if m:
+                emit = all(condition_stack) and (self.is_defined(m.group(2)) == (m.group(1) == 'ifdef'))
+                condition_stack.append(emit)
+                continue
+            if ELSE.match(stripped) and condition_stack:
+                condition_stack[-1] = not condition_stack[-1] and all(condition_stack[:-1])
+                continue
+            if ENDIF.match(stripped) and condition_stack:
+                condition_stack.pop()
+                continue
+            if not all(condition_stack):
+                continue
+
+            # definitions
+            m = DEFINELONG.match(stripped)
+            if m:
+                params = split_args(m.group(2)) if m.group(2) is not None else None
+                long_define = DefineLong(m.group(1), params)
+                continue
+            m = DEFINE_FUNC.match(stripped)
+            if m:
+                self.add_define(Define(m.group(1), m.group(3), split_args(m.group(2))))
+                continue
+            m = DEFINE.match(stripped)
+            if m:
+                # values are expanded with the definitions in effect when defined
+                self.add_define(Define(m.group(1), self.apply_defines(m.group(2) or '')))
+                continue
+            m = UNDEF.match(stripped)
+            if m:
+                self.remove_define(m.group(1))
+                continue
+
+            # file inclusion
+            m = INCLUDE.match(stripped)
+            if m:
+                output.extend(self.include(m.group(2), cur_dir, many=m.group(1) == '_many'))
+                continue
+
+            # multi-line macro calls are re-processed to resolve directives within the macro body
+            expanded = self.expand_long(line)
+            if expanded is not None:
+                output.extend(self.process_lines(expanded, cur_dir))
+                continue
+
+            if stripped.startswith('!pragma'):
+                output.append(line)
+            else:
+                output.append(self.apply_defines(line))
+
+        return output
+
+    def include(self, include_path, cur_dir, many=False):
+        '''
+        Returns pre-processed lines of an included file, with @startuml/@enduml removed
+        :param many: include the file even if already included, as !include_many
+        '''
+        file_path = resolve_include(include_path, cur_dir, self.root_path)
+        if not file_path:
+            raise IOError("Cannot include " + include_path + " from " + cur_dir)
+
+        already_included = file_path in self.included
+        self.included.append(file_path)
+        if already_included and not many:
+            return []
+        if self.skip_include is not None and self.skip_include(file_path):
+            return [SKIPPED_INCLUDE + file_path]
+
+        with open(file_path) as f:
+            lines = [l for l in f.read().splitlines() if not (STARTUML.match(l) or ENDUML.match(l))]
+        return self.process_lines(lines, os.path.dirname(file_path))
+
+    def is_defined(self, name):
+        return name in self.long_defines or any(d.name == name for d in self.defines)
+
+    def add_define(self, define):
+        '''Adds or replaces a definition, keeping the original order of definition'''
+        for i, existing in enumerate(self.defines):
+            if existing.name == define.name:
+                self.defines[i] = define
+                return
+        self.defines.append(define)
+
+    def remove_define(self, name):
+        self.defines = [d for d in self.defines if d.name != name]
+        self.long_defines.pop(name, None)
+
+    def expand_long(self, line):
+        for long_define in self.long_defines.values():
+            expanded = long_define.expand(line)
+            if expanded is not None:
+                return expanded
+        return None
+
+    def apply_defines(self, line):
+        '''Applies definitions to line in a single pass, in order of definition'''
+        for define in self.defines:
+            line = define.apply(line)
+        return line
+
+
+def preprocess_file(file_path):
+    '''
+    Pre-processes a plantUML file in python
+    :param file_path: path to plantUML file for pre-processing
+    :returns pre-processed text
+    '''
+    return PumlPreprocessor().process_file(file_path)
+
+
+def get_cache():
+    '''Returns the shared cache of pre-processed text, created on first use in config.cache_path'''
+    global preprocess_cache
+    if preprocess_cache is None:
+        preprocess_cache = ContentCache(config.cache_path, config.cache_max_bytes, suffix='.puml')
+    return preprocess_cache
+
+
+def preprocess_cached(file_path, preprocess_function, cache=None):
+    '''
+    Returns pre-processed text from cache, keyed by the content of file_path and all of its includes.
+    On a miss, text is produced by preprocess_function(file_path) and stored.
+    :param file_path: path to plantUML file
+    :param preprocess_function: one of preprocess_file, preprocess_jar
+    :param cache: ContentCache instance, defaults to get_cache()
+    '''
+    if cache is None:
+        cache = get_cache()
+    key = spec_hash(file_path, preprocess_function.__name__)
+    text = cache.get(key)
+    if text is None:
+        text = preprocess_function(file_path)
+        cache.put(key, text)
+    return text
+
+
+def preprocess_cached_path(file_path, preprocess_function, cache=None):
+    '''
+    Same as preprocess_cached, but returns the path of the cache entry holding the pre-processed text,
+    so that it can be read incrementally.
+    :return: path of cache entry, or None if the text does not fit in the cache
+    '''
+    if cache is None:
+        cache = get_cache()
+    key = spec_hash(file_path, preprocess_function.__name__)
+    path = cache.get_path(key)
+    if path is None:
+        cache.put(key, preprocess_function(file_path))
+        if os.path.isfile(cache.entry_path(key)):
+            path = cache.entry_path(key)
+    return path
+
+
+def preprocess_jar(file_path):
+    """
+    Function to run plantUML pre-processor from the plantUML jar,
+    returning text file containing only plantUML text with
+    no pre-processor definitions
+    :param file_path: path to plantUML file for pre-processing
+    :returns pre-processed text file
+    """
+
+    print "Preprocessing: \n" + file_path
+
+    # generate plantUML diagram hash, f is used as file-like obj for system call stdout
+    p = subprocess.Popen(config.java_path + ' -jar ' + config.plantUML_jar + ' -encodeurl ' + file_path,
+                              shell=True, stdout=subprocess.PIPE)
+    encoded_str = p.communicate()[0]
+
+    print "Encoded puml string: \n" + encoded_str
+
+    # decompile text file from hash
+    p = subprocess.Popen(config.java_path + ' -jar ' + config.plantUML_jar + ' -decodeurl ' + encoded_str,
+                            shell=True, stdout=subprocess.PIPE)
+    # return decompiled text
+    decoded_str = p.communicate()[0]
+
+    if decoded_str:
+        return decoded_str
+    else:
+        print "No string returned from preprocessor - check file path"
+        raise IOError
+
+
+def normalize_text(text):
+    '''Normalizes line endings and trailing blank lines for comparison of pre-processor output'''
+    return '\n'.join(text.splitlines()).rstrip('\n')
+
+
+def diff_preprocessors(spec_dir=config.specs_path):
+    '''
+    Differential test mode: pre-processes every *.puml file under spec_dir with both the
+    python pre-processor and the plantUML jar.
+    :param spec_dir: root directory to search for specs
+    :return: dictionary of {file path: (native text, jar text)} for files with differing output
+    '''
+    mismatches = dict()
+    for root, dirs, files in os.walk(spec_dir):
+        for file_name in sorted(files):
+            if not file_name.endswith('.puml'):
+                continue
+            file_path = os.path.join(root, file_name)
+            try:
+                native_text = normalize_text(preprocess_file(file_path))
+            except IOError:
+                native_text = None
+            try:
+                jar_text = normalize_text(preprocess_jar(file_path))
+            except IOError:
+                jar_text = None
+            if native_text != jar_text:
+                mismatches[file_path] = (native_text, jar_text)
+    return mismatches
+
+
+if __name__ == "__main__":
+    import sys
+    import difflib
+
+    if '--diff' in sys.argv:
+        mismatches = diff_preprocessors()
+        for file_path, (native_text, jar_text) in sorted(mismatches.items()):
+            print "=====MISMATCH:", file_path
+            for diff_line in difflib.unified_diff((jar_text or '').splitlines(), (native_text or '').splitlines(),
+                                                  'jar', 'native', lineterm=''):
+                print diff_line
+        print "Mismatched files:", len(mismatches)
+    else:
+        for file_path in sys.argv[1:] or [os.path.join(config.specs_path, 'ekopache', 'PH_AL_A165.puml')]:
+            print preprocess_file(file_path)
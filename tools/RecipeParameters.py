@@ -0,0 +1,273 @@
+'''
+Module contains recipe parameter binding of state diagrams compiled with symbolic parameters.
+
+Attributes of a phase diagram may reference recipe parameters instead of fixed values,
+ex. 'FIC-165'/SP = R_A165_PAD_SP * 2, or declare the parameters of the phase with a parameter list,
+ex. PARAM_LIST = [R_BATCHSIZE, R_A165_PCT]. Attribute strings referencing parameters are not solved
+while building the diagram and are left as raw strings, see is_symbolic. Once a phase declares a parameter
+list, only the declared names are parameters and other R_ names are plain tags. Without a parameter list only
+bare R_ names are parameters: R_ names in tag paths, ex. '^/R_SMPL_AA_SPEC.CV', and in prompt text are not.
+
+A ParameterMatrix compiles the parameter expressions of a diagram and its test case paths once.
+Binding a table of parameter rows evaluates each expression over the whole table, once per distinct
+combination of the parameters it references, substitutes the values in the attribute strings and solves
+them into one ParameterSet per row. Parameter sets share the states, transitions, solved attributes
+without parameters and test case paths of the diagram, and hold only their bound attributes and test cases.
+The diagram itself is not changed by binding: a test run looks its attributes up in the parameter set.
+
+Example calling:
+==============================
+import RecipeParameters
+
+diagram = ModelBuilder.build_state_diagram('specs/PH_CHARGE.puml', attribute_builder=abuilder)
+matrix = RecipeParameters.ParameterMatrix(diagram, attribute_builder=abuilder)
+rows = [{'R_BATCHSIZE': size, 'R_A165_PAD_SP': 20} for size in [1000, 2000, 4000]]
+for parameter_set in matrix.bind(rows):
+    for test_case in parameter_set.test_cases.values():  # attributes of the run are bound to the row
+        TestAdmin.Test(test_case=test_case.diagram, diagram=diagram, connection=connection,
+                       binding=parameter_set).start()
+==============================
+'''
+
+from __future__ import division
+
+__author__ = 'ekopache'
+
+import re
+import collections
+
+from StateModel import AttributeBinding
+from TestSolver import TestCase, TestCaseGenerator
+import Attributes.AttributePreprocessor as AttributePreprocessor
+
+from Utilities.Logger import LogTools
+dlog = LogTools('RecipeParameters.log', 'RecipeParameters')
+dlog.rootlog.warning('Module initialized')
+
+# recipe parameter names outside of tag paths, ex. R_BATCHSIZE but not '^/R_SMPL_AA_SPEC.CV'
+PARAMETER = re.compile(r'''(?<![\w'"/^.#$-])R_\w+\b(?![.'"/])''')
+# prompt text, ex. OARYN - Is Batch size correct? (R_BATCH_SIZE)
+PROMPT = re.compile(r'^\s*(?:prompt|oar|ack|ask|message)|\?', re.IGNORECASE)
+# name of the list declaring the parameters of a phase
+PARAM_LIST = 'PARAM_LIST'
+
+_OPERAND = r'''(?:%s|(?<![\w'-])\d+(?:\.\d*)?(?![\w'-]))'''
+
+
+class ParameterError(Exception):
+    '''Parameter table does not bind the parameters of a diagram'''
+    pass
+
+
+def parameter_pattern(declared=None):
+    '''Returns regex of parameter names, matching only the declared names if declared is not None'''
+    if declared is None:
+        return PARAMETER
+    if not declared:
+        return re.compile(r'(?!)')
+    return re.compile(r'\b(?:%s)\b' % '|'.join(re.escape(name) for name in sorted(declared, key=len, reverse=True)))
+
+
+def expression_pattern(declared=None):
+    '''Returns regex of arithmetic of parameters and numbers, ex. R_A165_PAD_SP * 2 + 5'''
+    operand = _OPERAND % parameter_pattern(declared).pattern
+    return re.compile(operand + r'(?:[ \t]*[-+*/][ \t]*' + operand + r')*')
+
+
+def find_parameters(raw_string, declared=None):
+    '''Returns list of parameter names referenced in raw_string, in order of first reference'''
+    parameters = list()
+    for name in parameter_pattern(declared).findall(raw_string):
+        if name not in parameters:
+            parameters.append(name)
+    return parameters
+
+
+def format_value(value):
+    '''Returns value as written in attribute strings, integral values without decimals'''
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class ParameterExpression(object):
+    '''Arithmetic expression of recipe parameters, compiled once and evaluated over parameter tables'''
+
+    def __init__(self, text, declared=None):
+        self.text = text
+        self.parameters = find_parameters(text, declared)
+        self.code = compile(text, '<parameter expression>', 'eval')
+
+    def __repr__(self):
+        return 'ParameterExpression: ' + self.text
+
+    def evaluate(self, rows):
+        '''
+        Evaluates the expression over a table of parameter rows
+        :param rows: list of {parameter name: value}
+        :return: list of values, one per row. Each distinct combination of parameter values is evaluated once.
+        '''
+        missing = [name for name in self.parameters if any(name not in row for row in rows)]
+        if missing:
+            raise ParameterError('No value of ' + ', '.join(missing) + ' for ' + self.text)
+        evaluated = dict()  # {tuple of parameter values: value}
+        values = list()
+        for row in rows:
+            key = tuple(row[name] for name in self.parameters)
+            if key not in evaluated:
+                evaluated[key] = eval(self.code, {'__builtins__': {}}, dict(zip(self.parameters, key)))
+            values.append(evaluated[key])
+        return values
+
+
+class SymbolicAttribute(object):
+    '''Attribute string with its parameter expressions unbound'''
+
+    def __init__(self, raw_string, declared=None):
+        '''
+        :param declared: names of the parameters declared by PARAM_LIST, None to take bare R_ names as parameters
+        '''
+        self.raw_string = raw_string
+        parameters = parameter_pattern(declared)
+        # (start, end, ParameterExpression) of each expression referencing a parameter
+        self.expressions = [(match.start(), match.end(), ParameterExpression(match.group(), declared))
+                            for match in expression_pattern(declared).finditer(raw_string)
+                            if parameters.search(match.group())]
+        self.parameters = find_parameters(raw_string, declared)
+
+    def __repr__(self):
+        return 'SymbolicAttribute: ' + repr(self.raw_string)
+
+    def bind(self, rows):
+        '''Returns list of the attribute string bound to each row of rows'''
+        if not self.expressions:
+            return [self.raw_string] * len(rows)
+        columns = [expression.evaluate(rows) for start, end, expression in self.expressions]
+        bound = list()
+        for values in zip(*columns):
+            parts, last = list(), 0
+            for (start, end, expression), value in zip(self.expressions, values):
+                parts.extend([self.raw_string[last:start], format_value(value)])
+                last = end
+            parts.append(self.raw_string[last:])
+            bound.append(u''.join(parts))
+        return bound
+
+
+def declared_parameters(raw_string):
+    '''Returns list of the parameters declared by a PARAM_LIST definition, or None if raw_string is not one'''
+    definition = AttributePreprocessor.list_definition(raw_string)
+    if not definition or definition[0] != PARAM_LIST:
+        return None
+    return definition[1]
+
+
+def is_symbolic(raw_string, declared=None):
+    '''
+    Returns True if raw_string references parameters to be bound, ie. is not solvable before binding
+    :param declared: names of the parameters declared by PARAM_LIST,
+                     None to take bare R_ names outside of prompt text as parameters
+    '''
+    if declared_parameters(raw_string) is not None:
+        return False
+    if declared is None and PROMPT.search(raw_string):
+        return False
+    return bool(parameter_pattern(declared).search(raw_string))
+
+
+class ParameterSet(AttributeBinding):
+    '''Test suite of a diagram bound to one row of recipe parameters'''
+
+    def __init__(self, name, row, bindings, test_cases):
+        '''
+        :param row: {parameter name: value}
+        :param bindings: list of (attribute owner, index in owner.attrs, bound attribute)
+        :param test_cases: {case name: TestCase}, paths shared with the other parameter sets
+        '''
+        AttributeBinding.__init__(self, bindings)
+        self.name = name
+        self.row = row
+        self.test_cases = test_cases
+
+
+class ParameterMatrix(object):
+    '''State diagram and test case paths compiled once, bound to tables of recipe parameters'''
+
+    def __init__(self, diagram, attribute_builder=None, generator=None):
+        '''
+        :param diagram: StateModel.StateDiagram built with its parameter attributes left as raw strings
+        :param attribute_builder: AttributeBuilder solving the bound attribute strings, None to bind raw strings
+        :param generator: TestSolver.TestCaseGenerator of diagram, defaults to a new generator
+        '''
+        self.diagram = diagram
+        self.attribute_builder = attribute_builder
+        self.logger = dlog.MakeChild('ParameterMatrix', str(diagram.id))
+
+        self.declared = list()  # parameters declared by PARAM_LIST
+        has_list = PARAM_LIST in diagram.lists
+        unsolved = list()  # (attribute owner, index in owner.attrs, raw string) of attributes left as strings
+        for owner in diagram.attribute_owners():
+            for index, attr in enumerate(owner.attrs):
+                raw_string = getattr(attr, 'raw_string', attr)
+                if not isinstance(raw_string, basestring):
+                    continue
+                declared = declared_parameters(raw_string)
+                if declared is not None:
+                    has_list = True
+                    self.declared.extend(name for name in declared if name not in self.declared)
+                elif isinstance(attr, basestring):
+                    unsolved.append((owner, index, raw_string))
+        self.declared.extend(name for name in diagram.lists.get(PARAM_LIST, []) if name not in self.declared)
+        # strings naming R_ tags that are not declared parameters are bound unchanged, and solved with the rows
+        declared = self.declared if has_list else None
+        # (attribute owner, index in owner.attrs, SymbolicAttribute)
+        self.symbolic = [(owner, index, SymbolicAttribute(raw_string, declared))
+                         for owner, index, raw_string in unsolved if is_symbolic(raw_string, declared)]
+
+        self.generator = generator or TestCaseGenerator(diagram)
+        self.paths = None  # {case name: path diagram}, generated on first bind
+        self.logger.info('Compiled %d parameter attributes referencing %s', len(self.symbolic),
+                         ', '.join(self.parameters()))
+
+    def parameters(self):
+        '''Returns sorted names of the parameters declared or referenced by the diagram'''
+        return sorted(set(self.declared) | set(name for _, _, attr in self.symbolic for name in attr.parameters))
+
+    def test_paths(self):
+        '''Returns {case name: path diagram} of the diagram, generated once'''
+        if self.paths is None:
+            self.paths = dict((name, case.diagram) for name, case in self.generator.generate_test_cases().items())
+        return self.paths
+
+    def bind(self, rows, names=None):
+        '''
+        Binds the diagram to each row of a parameter table
+        :param rows: list of {parameter name: value}, every parameter of the diagram is required
+        :param names: list of parameter set names, defaults to row_1, row_2...
+        :return: list of ParameterSet, one per row
+        '''
+        rows = list(rows)
+        missing = sorted(set(name for name in self.declared for row in rows if name not in row))
+        if missing:
+            raise ParameterError('No value of declared parameters ' + ', '.join(missing))
+        names = names or ['row_%d' % (i + 1) for i in range(len(rows))]
+
+        # each attribute is bound over the whole table, then the whole table is solved in a single batch,
+        # parsing each distinct bound string once and fetching the configuration of its tags once
+        columns = [attr.bind(rows) for _, _, attr in self.symbolic]
+        bound = [column[i] for i in range(len(rows)) for column in columns]
+        if self.attribute_builder is not None and bound:
+            bound = [value if value else raw_string for value, raw_string in
+                     zip(self.attribute_builder.solve_attributes(bound), bound)]
+        paths = self.test_paths()
+        parameter_sets = list()
+        for i, (name, row) in enumerate(zip(names, rows)):
+            row_bound = bound[i * len(columns):(i + 1) * len(columns)]
+            bindings = [(owner, index, attribute) for (owner, index, _), attribute in zip(self.symbolic, row_bound)]
+            test_cases = collections.OrderedDict(
+                (case_name, TestCase(name=name + '_' + case_name, diagram=paths[case_name]))
+                for case_name in sorted(paths))
+            parameter_sets.append(ParameterSet(name, row, bindings, test_cases))
+        self.logger.info('Bound %d rows, %d distinct attribute strings', len(rows),
+                         len(set(value for column in columns for value in column)))
+        return parameter_sets
@@ -0,0 +1,391 @@
+'''
+Module contains the include-dependency graph of a spec corpus and incremental corpus rebuilds.
+
+Each spec depends on every file it transitively !includes, and each unit EM definition under a
+Definitions/<class name>/ folder depends on the class spec <class name>.puml next to that folder.
+The graph is persisted with the content hash of every file, so that a rebuild only lexes, builds
+and solves the specs whose own content or dependencies changed since the previous run.
+
+Whole corpora are built in parallel by build_corpus, one spec per task in a process pool.
+
+Example calling:
+==============================
+import SpecCorpus, config
+
+results = SpecCorpus.rebuild(config.specs_path)
+for spec_path, result in sorted(results.items()):
+    print spec_path, result.error or len(result.test_cases)
+
+corpus = SpecCorpus.build_corpus(os.path.join(config.specs_path, 'EM'), processes=4)
+for summary in corpus.results:
+    print summary.spec_path, summary.error or len(summary.test_cases), summary.times['total']
+print corpus.wall_time
+==============================
+'''
+
+__author__ = 'ekopache'
+
+import os
+import json
+import hashlib
+import multiprocessing
+from timeit import default_timer
+import networkx
+from networkx import DiGraph
+
+import config
+import ModelBuilder
+import TestSolver
+import PlantUML_Preprocessor
+
+from Utilities.Logger import LogTools
+dlog = LogTools('SpecCorpus.log', 'SpecCorpus')
+dlog.rootlog.warning('Module initialized')
+
+# version of the persisted graph format, graphs of other versions are discarded
+GRAPH_VERSION = 1
+
+
+def find_specs(root_path):
+    '''Returns sorted list of absolute paths of all *.puml files under root_path'''
+    return sorted(os.path.abspath(os.path.join(root, f)) for root, dirs, files in os.walk(root_path)
+                  for f in files if f.endswith('.puml'))
+
+
+def file_hash(file_path):
+    '''Returns content hash of a file, or None if the file does not exist'''
+    try:
+        with open(file_path, 'rb') as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except IOError:
+        return None
+
+
+def class_spec_path(spec_path):
+    '''
+    Returns path of the class spec mirrored by a unit EM definition, ex.
+    EM/Definitions/S_EMC_CHARGE/R10-WTRCHG-EM.puml -> EM/S_EMC_CHARGE.puml
+    :return: absolute path, or None if spec_path is not in a Definitions/<class name>/ folder
+    '''
+    class_dir = os.path.dirname(os.path.abspath(spec_path))
+    definitions_dir = os.path.dirname(class_dir)
+    if os.path.basename(definitions_dir) != 'Definitions':
+        return None
+    return os.path.join(os.path.dirname(definitions_dir), os.path.basename(class_dir) + '.puml')
+
+
+class SpecDependencyGraph(DiGraph):
+    '''
+    Directed graph of spec files, with an edge spec -> dependency for each file a spec depends on.
+    Nodes are file paths relative to root_path. Node attribute 'hash' holds the content hash of the
+    file as of its last scan (None for missing files), edge attribute 'kind' is 'include' or 'definition'.
+    '''
+
+    def __init__(self, root_path=config.specs_path, *args, **kwargs):
+        DiGraph.__init__(self, *args, **kwargs)
+        self.root_path = os.path.abspath(root_path)
+        self.logger = dlog.MakeChild('SpecDependencyGraph', self.root_path)
+
+    def rel_path(self, file_path):
+        return os.path.relpath(os.path.abspath(file_path), self.root_path)
+
+    def abs_path(self, node):
+        return os.path.abspath(os.path.join(self.root_path, node))
+
+    def scan(self, node):
+        '''Re-reads content hash and dependencies of a single file'''
+        file_path = self.abs_path(node)
+        self.add_node(node, hash=file_hash(file_path))
+        self.remove_edges_from(self.out_edges(node))
+        if self.node[node]['hash'] is None:
+            return
+
+        missing = list()
+        for include_path in PlantUML_Preprocessor.find_includes(file_path, missing) + missing:
+            self.add_dependency(node, self.rel_path(include_path), 'include')
+        class_path = class_spec_path(file_path)
+        if class_path and os.path.isfile(class_path):
+            self.add_dependency(node, self.rel_path(class_path), 'definition')
+
+    def add_dependency(self, node, dependency, kind):
+        if dependency not in self:
+            # hash is filled in when the dependency itself is scanned
+            self.add_node(dependency, hash=None)
+        self.add_edge(node, dependency, kind=kind)
+
+    def dependents(self, nodes):
+        '''Returns set of the given nodes and every node that depends on any of them'''
+        result = set(nodes)
+        for node in nodes:
+            if node in self:
+                result.update(networkx.ancestors(self, node))
+        return result
+
+    def update(self):
+        '''
+        Rescans the corpus, updating hashes and dependencies of changed files and their dependents
+        :return: set of changed nodes: new, modified and removed files
+        '''
+        current = dict((self.rel_path(file_path), None) for file_path in find_specs(self.root_path))
+        # dependencies outside root_path and missing includes are tracked as well
+        current.update((node, None) for node in self.nodes())
+        for node in current:
+            current[node] = file_hash(self.abs_path(node))
+
+        changed = set(node for node, content_hash in current.items()
+                      if node not in self or self.node[node].get('hash') != content_hash)
+        # dependents are rescanned too, files they include transitively may have changed
+        for node in self.dependents(changed):
+            self.scan(node)
+        # forget missing files that nothing depends on
+        self.remove_nodes_from([node for node in self.nodes()
+                                if self.node[node]['hash'] is None and not self.predecessors(node)])
+
+        self.logger.info('%d of %d files changed', len(changed), len(current))
+        return changed
+
+    def invalidate(self, node):
+        '''Forgets the content hash of a file, so that the next update reports it as changed'''
+        self.node[node]['hash'] = None
+
+    def specs(self):
+        '''Returns sorted list of nodes of existing *.puml files under root_path'''
+        return sorted(node for node in self.nodes() if node.endswith('.puml') and
+                      not node.startswith(os.pardir) and self.node[node]['hash'] is not None)
+
+    def save(self, graph_path):
+        '''Writes graph to a JSON file'''
+        data = {
+            'version': GRAPH_VERSION,
+            'root_path': self.root_path,
+            'files': dict((node, {'hash': self.node[node]['hash'],
+                                  'depends': dict((dep, self.edge[node][dep]['kind']) for dep in self.successors(node))})
+                          for node in self.nodes()),
+        }
+        if not os.path.isdir(os.path.dirname(os.path.abspath(graph_path))):
+            os.makedirs(os.path.dirname(os.path.abspath(graph_path)))
+        with open(graph_path, 'w') as f:
+            json.dump(data, f, indent=1, sort_keys=True)
+
+    @classmethod
+    def load(cls, graph_path, root_path=config.specs_path):
+        '''
+        Reads a graph written by save
+        :return: SpecDependencyGraph instance, empty if graph_path is missing, unreadable or for another root_path
+        '''
+        graph = cls(root_path)
+        try:
+            with open(graph_path) as f:
+                data = json.load(f)
+        except (IOError, ValueError):
+            return graph
+        if data.get('version') != GRAPH_VERSION or data.get('root_path') != graph.root_path:
+            graph.logger.warning('Discarding dependency graph %s', graph_path)
+            return graph
+
+        for node, entry in data['files'].items():
+            graph.add_node(str(node), hash=entry['hash'] and str(entry['hash']))
+        for node, entry in data['files'].items():
+            for dep, kind in entry['depends'].items():
+                graph.add_edge(str(node), str(dep), kind=str(kind))
+        return graph
+
+
+class BuildResult(object):
+    '''Outcome of building a single spec'''
+
+    def __init__(self, spec_path, diagram=None, test_cases=None, error=None):
+        self.spec_path = spec_path
+        self.diagram = diagram  # StateModel.StateDiagram
+        self.test_cases = test_cases  # {test case name: TestSolver.TestCase}
+        self.error = error  # exception raised by any build step, None on success
+        self.times = dict()  # {build step: seconds}, steps are 'build' (lex + build diagram) and 'solve'
+
+
+class BuildSummary(object):
+    '''Picklable summary of a BuildResult, as returned by build_corpus worker processes'''
+
+    def __init__(self, result):
+        self.spec_path = result.spec_path
+        self.states = len(result.diagram.state_names) if result.diagram is not None else 0
+        self.transitions = len(result.diagram.get_transitions()) if result.diagram is not None else 0
+        self.test_cases = sorted(result.test_cases) if result.test_cases is not None else list()
+        self.error = repr(result.error) if result.error is not None else None
+        self.times = dict(result.times, total=sum(result.times.values()))
+
+
+def build_spec(spec_path, attribute_builder=None, preprocess=True):
+    '''
+    Lexes and builds the state diagram of a spec, then generates its test cases
+    :param spec_path: path to plantUML file
+    :param attribute_builder: AttributeBuilder instance, or None to leave attributes as raw strings
+    :return: BuildResult
+    '''
+    result = BuildResult(spec_path)
+    try:
+        start = default_timer()
+        result.diagram = ModelBuilder.build_state_diagram(spec_path, attribute_builder=attribute_builder,
+                                                          preprocess=preprocess)
+        result.times['build'] = default_timer() - start
+        start = default_timer()
+        result.test_cases = TestSolver.TestCaseGenerator(result.diagram).generate_test_cases()
+        result.times['solve'] = default_timer() - start
+    except Exception as e:
+        dlog.rootlog.error('Failed to build ' + spec_path + ': ' + repr(e))
+        result.error = e
+    return result
+
+
+def rebuild(root_path=config.specs_path, graph_path=config.spec_graph_path, attribute_builder=None,
+            build_function=build_spec, force=False):
+    '''
+    Rebuilds the specs of a corpus affected by changes since the previous rebuild
+    :param root_path: corpus folder
+    :param graph_path: file persisting the dependency graph between runs, None to rebuild everything
+    :param attribute_builder: passed on to build_function
+    :param build_function: function(spec_path, attribute_builder) called for each spec to rebuild.
+        Specs whose result has an error attribute other than None are rebuilt again on the next run.
+    :param force: rebuild all specs regardless of changes
+    :return: dictionary of {absolute spec path: build_function return value}
+    '''
+    if graph_path:
+        graph = SpecDependencyGraph.load(graph_path, root_path)
+    else:
+        graph = SpecDependencyGraph(root_path)
+    changed = graph.update()
+
+    if force:
+        targets = graph.specs()
+    else:
+        affected = graph.dependents(changed)
+        targets = [node for node in graph.specs() if node in affected]
+
+    results = dict()
+    for node in targets:
+        spec_path = graph.abs_path(node)
+        dlog.rootlog.info('Rebuilding ' + spec_path)
+        results[spec_path] = build_function(spec_path, attribute_builder)
+
+    # persist only once all builds ran, so an interrupted rebuild is repeated next time
+    if graph_path:
+        # failed specs are saved without hash, so they are retried even if not edited
+        for node in targets:
+            if getattr(results[graph.abs_path(node)], 'error', None) is not None:
+                graph.invalidate(node)
+        graph.save(graph_path)
+    return results
+
+
+class CorpusBuild(object):
+    '''Outcome of build_corpus'''
+
+    def __init__(self, results, wall_time, processes):
+        self.results = results  # list of BuildSummary, sorted by spec path
+        self.wall_time = wall_time  # seconds for the whole corpus
+        self.processes = processes  # number of worker processes, 1 when built in-process
+
+    def errors(self):
+        '''Returns dictionary of {spec path: error} of specs that failed to build'''
+        return dict((summary.spec_path, summary.error) for summary in self.results if summary.error is not None)
+
+    def cpu_time(self):
+        '''Returns sum of per-spec build times'''
+        return sum(summary.times['total'] for summary in self.results)
+
+
+# attribute builder and options of a build_corpus worker process, set once per process by _init_worker
+_worker_attribute_builder = None
+_worker_preprocess = True
+
+
+def connect_attribute_builder(server):
+    '''Returns AttributeBuilder connected to server (ip, port), None if server is None'''
+    if server is None:
+        return None
+    from Attributes import AttributeBuilder
+    return AttributeBuilder.create_attribute_builder(server_ip=server[0], server_port=server[1])
+
+
+def _init_worker(server, preprocess):
+    global _worker_attribute_builder, _worker_preprocess
+    _worker_preprocess = preprocess
+    _worker_attribute_builder = connect_attribute_builder(server)
+
+
+def _build_worker(spec_path):
+    return BuildSummary(build_spec(spec_path, _worker_attribute_builder, _worker_preprocess))
+
+
+def build_corpus(specs=config.specs_path, processes=None, server=None, preprocess=True):
+    '''
+    Builds the state diagram and test cases of every spec in a corpus in a process pool
+    :param specs: corpus folder, or list of spec paths
+    :param processes: number of worker processes, defaults to the number of cores. 1 builds in this process.
+    :param server: (ip, port) of the DVConfig server, each worker connects its own attribute builder.
+        None builds without attribute builder, leaving attributes as raw strings.
+    :return: CorpusBuild, results are in spec path order regardless of which worker finishes first
+    '''
+    if isinstance(specs, basestring):
+        spec_paths = find_specs(specs)
+    else:
+        spec_paths = sorted(os.path.abspath(spec_path) for spec_path in specs)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = max(1, min(processes, len(spec_paths)))
+
+    start = default_timer()
+    if processes == 1:
+        attribute_builder = connect_attribute_builder(server)
+        results = [BuildSummary(build_spec(spec_path, attribute_builder, preprocess)) for spec_path in spec_paths]
+    else:
+        pool = multiprocessing.Pool(processes, initializer=_init_worker, initargs=(server, preprocess))
+        try:
+            # one spec per task, so long builds do not hold up a whole chunk of specs
+            results = pool.map(_build_worker, spec_paths, chunksize=1)
+        finally:
+            pool.close()
+            pool.join()
+    wall_time = default_timer() - start
+
+    dlog.rootlog.info('Built %d specs with %d processes in %.2f s', len(results), processes, wall_time)
+    return CorpusBuild(results, wall_time, processes)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Incremental or parallel build of a spec corpus')
+    arg_parser.add_argument('spec_dir', nargs='?', default=config.specs_path)
+    arg_parser.add_argument('--force', action='store_true', help='rebuild every spec regardless of changes')
+    arg_parser.add_argument('--build', action='store_true', help='build the whole corpus in a process pool')
+    arg_parser.add_argument('-j', '--processes', type=int, default=None, help='worker processes for --build')
+    arg_parser.add_argument('--server', default=None, help='DVConfig server ip:port, attributes stay raw if omitted')
+    args = arg_parser.parse_args()
+    spec_dir = os.path.abspath(args.spec_dir)
+
+    if args.build:
+        server = None
+        if args.server:
+            server_ip, server_port = args.server.rsplit(':', 1)
+            server = (server_ip, int(server_port))
+        corpus = build_corpus(spec_dir, processes=args.processes, server=server)
+        for summary in corpus.results:
+            name = os.path.relpath(summary.spec_path, spec_dir)
+            if summary.error is not None:
+                print '%-60s ERROR %s' % (name, summary.error)
+            else:
+                print '%-60s %4d states %4d transitions %4d test cases %8.1f ms' % (
+                    name, summary.states, summary.transitions, len(summary.test_cases), summary.times['total'] * 1000)
+        print 'Built %d specs (%d errors) with %d processes: wall %.2f s, per-spec total %.2f s' % (
+            len(corpus.results), len(corpus.errors()), corpus.processes, corpus.wall_time, corpus.cpu_time())
+    else:
+        results = rebuild(spec_dir, force=args.force)
+        for spec_path, result in sorted(results.items()):
+            name = os.path.relpath(spec_path, spec_dir)
+            if result.error is not None:
+                print '%-60s ERROR %r' % (name, result.error)
+            else:
+                print '%-60s %4d states %4d transitions %4d test cases' % (
+                    name, len(result.diagram.state_names), len(result.diagram.get_transitions()),
+                    len(result.test_cases))
+        print 'Rebuilt', len(results), 'specs'
@@ -0,0 +1,264 @@
+'''
+Module contains a watch mode that keeps the specs of a corpus built while they are edited.
+
+The dependency graph, attribute builder (and its DVConfig connection), state diagrams and test cases
+of every watched spec stay in memory between changes. Files are polled by modification time and size;
+when a file changes only the specs depending on it are rebuilt. Attribute strings are solved, and test cases
+generated again, only if the states, transitions or attribute strings of the rebuilt diagram differ from
+the previous build; otherwise the previous diagram and its test cases are kept.
+The differences of each rebuilt spec are printed as states, transitions and test cases added or removed.
+
+Example calling:
+==============================
+import SpecWatcher, config
+
+watcher = SpecWatcher.SpecWatcher(config.specs_path)
+watcher.run(interval=0.5)  # until interrupted
+
+# or poll from an existing loop
+for diff in watcher.poll():
+    print diff
+==============================
+'''
+
+__author__ = 'ekopache'
+
+import os
+import sys
+import time
+from timeit import default_timer
+
+import config
+import ModelBuilder
+import TestSolver
+import SpecCorpus
+import DiagramSnapshot
+
+from Utilities.Logger import LogTools
+dlog = LogTools('SpecWatcher.log', 'SpecWatcher')
+dlog.rootlog.warning('Module initialized')
+
+
+def state_signatures(diagram):
+    '''Returns {state name: tuple of attribute reprs} of every state in diagram, including substates'''
+    if diagram is None:
+        return dict()
+    return dict((name, tuple(repr(attr) for attr in state.attrs)) for name, state in diagram.state_names.items())
+
+
+def transition_signatures(diagram):
+    '''Returns set of (source names, destination names, attribute reprs) tuples of every transition in diagram'''
+    if diagram is None:
+        return set()
+    return set((u', '.join(s.name for s in trans.source), u', '.join(s.name for s in trans.dest),
+                tuple(repr(attr) for attr in trans.attrs)) for trans in diagram.get_transitions())
+
+
+def case_signatures(test_cases):
+    '''Returns {test case name: sorted tuple of state names in the test case path}'''
+    if test_cases is None:
+        return dict()
+    return dict((name, tuple(sorted(state.name for state in case.diagram.nodes())))
+                for name, case in test_cases.items())
+
+
+class SpecDiff(object):
+    '''Differences in states, transitions and test cases between two builds of a spec'''
+
+    def __init__(self, spec_path, old=None, new=None):
+        '''
+        :param old: previous SpecCorpus.BuildResult, None if the spec was not built before
+        :param new: new SpecCorpus.BuildResult, None if the spec was removed
+        '''
+        self.spec_path = spec_path
+        self.old = old
+        self.new = new
+
+        old_states = state_signatures(old and old.diagram)
+        new_states = state_signatures(new and new.diagram)
+        self.added_states = sorted(set(new_states) - set(old_states))
+        self.removed_states = sorted(set(old_states) - set(new_states))
+        self.changed_states = sorted(name for name in set(old_states) & set(new_states)
+                                     if old_states[name] != new_states[name])
+
+        old_transitions = transition_signatures(old and old.diagram)
+        new_transitions = transition_signatures(new and new.diagram)
+        self.added_transitions = sorted(new_transitions - old_transitions)
+        self.removed_transitions = sorted(old_transitions - new_transitions)
+
+        old_cases = case_signatures(old and old.test_cases)
+        new_cases = case_signatures(new and new.test_cases)
+        self.added_cases = sorted(set(new_cases) - set(old_cases))
+        self.removed_cases = sorted(set(old_cases) - set(new_cases))
+        self.changed_cases = sorted(name for name in set(old_cases) & set(new_cases)
+                                    if old_cases[name] != new_cases[name])
+
+        self.error = new.error if new is not None else None
+
+    def is_empty(self):
+        '''True if the new build is equivalent to the previous one'''
+        return not (self.added_states or self.removed_states or self.changed_states or
+                    self.added_transitions or self.removed_transitions or
+                    self.added_cases or self.removed_cases or self.changed_cases or
+                    self.error is not None or (self.old is None) != (self.new is None))
+
+    def __str__(self):
+        if self.new is None:
+            header = 'removed'
+        elif self.error is not None:
+            header = 'ERROR %r' % self.error
+        else:
+            header = '%d states, %d transitions, %d test cases' % (
+                len(self.new.diagram.state_names), len(self.new.diagram.get_transitions()), len(self.new.test_cases))
+            if self.old is None:
+                header = 'built, ' + header
+        lines = ['%s: %s' % (self.spec_path, header)]
+        if self.old is None or self.new is None:
+            return '\n'.join(lines)
+
+        for sign, label, items in [('+', 'state', self.added_states), ('-', 'state', self.removed_states),
+                                   ('~', 'state', self.changed_states)]:
+            lines.extend(u'  %s %s %s' % (sign, label, name) for name in items)
+        for sign, items in [('+', self.added_transitions), ('-', self.removed_transitions)]:
+            lines.extend(u'  %s transition %s --> %s %s' % (sign, source, dest, u' '.join(attrs))
+                         for source, dest, attrs in items)
+        for sign, items in [('+', self.added_cases), ('-', self.removed_cases), ('~', self.changed_cases)]:
+            lines.extend(u'  %s test case %s' % (sign, name) for name in items)
+        return u'\n'.join(lines).encode('utf-8')
+
+
+class SpecWatcher(object):
+    '''Keeps the specs of a corpus built in memory, rebuilding those affected by each file change'''
+
+    def __init__(self, root_path=config.specs_path, spec_paths=None, attribute_builder=None, preprocess=True):
+        '''
+        :param root_path: corpus folder, dependencies are tracked for every spec under it
+        :param spec_paths: list of specs to keep built, defaults to every spec under root_path
+        :param attribute_builder: AttributeBuilder instance kept for all builds, None leaves attributes as raw strings
+        '''
+        self.logger = dlog.MakeChild('SpecWatcher', os.path.basename(root_path))
+        self.graph = SpecCorpus.SpecDependencyGraph(root_path)
+        self.spec_paths = None if spec_paths is None else set(os.path.abspath(p) for p in spec_paths)
+        self.attribute_builder = attribute_builder
+        self.preprocess = preprocess
+        self.results = dict()  # {absolute spec path: SpecCorpus.BuildResult}
+        # {absolute spec path: (state signatures, transition signatures)} of the last build, before solving
+        self.signatures = dict()
+        self._stats = dict()  # {absolute file path: (modification time, size)} at the previous poll
+
+    def file_stats(self):
+        '''Returns {absolute file path: (modification time, size)} of every spec and tracked dependency'''
+        paths = set(SpecCorpus.find_specs(self.graph.root_path))
+        paths.update(self.graph.abs_path(node) for node in self.graph.nodes())
+        stats = dict()
+        for path in paths:
+            try:
+                st = os.stat(path)
+                stats[path] = (st.st_mtime, st.st_size)
+            except OSError:
+                stats[path] = None
+        return stats
+
+    def is_watched(self, spec_path):
+        return self.spec_paths is None or spec_path in self.spec_paths
+
+    def build(self, spec_path, previous=None):
+        '''
+        Builds the state diagram of a spec with its attribute strings unsolved. If the diagram does not differ
+        from the previous build, the previous diagram and test cases are kept; otherwise its attributes are
+        solved and its test cases generated.
+        :param previous: BuildResult of the previous build of the spec, if any
+        :return: SpecCorpus.BuildResult
+        '''
+        result = SpecCorpus.BuildResult(spec_path)
+        try:
+            start = default_timer()
+            diagram = ModelBuilder.build_state_diagram(spec_path, attribute_builder=self.attribute_builder,
+                                                       preprocess=self.preprocess, lazy_attributes=True)
+            signatures = state_signatures(diagram), transition_signatures(diagram)
+            if previous is not None and previous.test_cases is not None and \
+                    self.signatures.get(spec_path) == signatures:
+                result.diagram, result.test_cases = previous.diagram, previous.test_cases
+                result.times = dict(previous.times)
+                return result
+            DiagramSnapshot.resolve_all_attributes(diagram)
+            result.diagram = diagram
+            result.times['build'] = default_timer() - start
+            start = default_timer()
+            result.test_cases = TestSolver.TestCaseGenerator(result.diagram).generate_test_cases()
+            result.times['solve'] = default_timer() - start
+            self.signatures[spec_path] = signatures
+        except Exception as e:
+            self.logger.error('Failed to build %s: %r', spec_path, e)
+            result.error = e
+            self.signatures.pop(spec_path, None)
+        return result
+
+    def poll(self):
+        '''
+        Checks for changed files, rebuilding the affected specs
+        :return: list of SpecDiff for each rebuilt or removed spec whose build changed
+        '''
+        stats = self.file_stats()
+        if stats == self._stats:
+            return list()
+        self._stats = stats
+
+        changed = self.graph.update()
+        affected = self.graph.dependents(changed)
+        specs = set(self.graph.abs_path(node) for node in self.graph.specs())
+
+        diffs = list()
+        for spec_path in sorted(set(self.results) - specs):
+            diffs.append(SpecDiff(spec_path, self.results.pop(spec_path), None))
+            self.signatures.pop(spec_path, None)
+        for node in self.graph.specs():
+            spec_path = self.graph.abs_path(node)
+            if node not in affected or not self.is_watched(spec_path):
+                continue
+            previous = self.results.get(spec_path)
+            self.results[spec_path] = self.build(spec_path, previous)
+            diff = SpecDiff(spec_path, previous, self.results[spec_path])
+            if not diff.is_empty():
+                diffs.append(diff)
+        # files of the new dependencies are tracked from now on
+        self._stats.update((path, stat) for path, stat in self.file_stats().items() if path not in self._stats)
+        return diffs
+
+    def run(self, interval=0.5, output=sys.stdout):
+        '''
+        Polls for changes every interval seconds until interrupted, writing the differences to output
+        '''
+        self.logger.info('Watching %s', self.graph.root_path)
+        try:
+            while True:
+                start = default_timer()
+                diffs = self.poll()
+                for diff in diffs:
+                    print >> output, str(diff)
+                if diffs:
+                    print >> output, 'Rebuilt %d specs in %.2f s' % (len(diffs), default_timer() - start)
+                    output.flush()
+                time.sleep(interval)
+        except KeyboardInterrupt:
+            pass
+
+
+if __name__ == "__main__":
+    import argparse
+
+    arg_parser = argparse.ArgumentParser(description='Rebuild diagrams and test cases of specs as they are saved')
+    arg_parser.add_argument('specs', nargs='*', help='specs to keep built, defaults to every spec in --root')
+    arg_parser.add_argument('--root', default=config.specs_path, help='corpus folder for dependency tracking')
+    arg_parser.add_argument('--interval', type=float, default=0.5, help='seconds between polls')
+    arg_parser.add_argument('--server', default=None, help='DVConfig server ip:port, attributes stay raw if omitted')
+    args = arg_parser.parse_args()
+
+    abuilder = None
+    if args.server:
+        from Attributes import AttributeBuilder
+        server_ip, server_port = args.server.rsplit(':', 1)
+        abuilder = AttributeBuilder.create_attribute_builder(server_ip=server_ip, server_port=int(server_port))
+
+    watcher = SpecWatcher(os.path.abspath(args.root), spec_paths=args.specs or None, attribute_builder=abuilder)
+    watcher.run(args.interval)
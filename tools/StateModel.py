@@ -8,12 +8,38 @@ Model will also be used an input for test generation.
 '''
 
 from networkx import DiGraph
+from graph_utils.CompactGraph import CompactGraph
+from Attributes.RunContext import RunLayout
 
 from Utilities.Logger import LogTools
 dlog = LogTools('StateModel.log', 'StateModel')
 dlog.rootlog.warning('Module initialized')
 
 
+def resolve_attributes(attrs):
+    '''Replaces lazy attribute placeholders (see AttributeBuilder.LazyAttribute) in list attrs by their instances'''
+    for i, attr in enumerate(attrs):
+        if hasattr(type(attr), 'resolve'):
+            attrs[i] = attr.resolve()
+    return attrs
+
+
+def unique(items):
+    '''Returns list of items without repetitions, in order of first occurrence'''
+    seen = set()
+    return [item for item in items if not (item in seen or seen.add(item))]
+
+
+# revision of all state models, incremented when a state or transition is added to any diagram
+model_revision = 0
+
+
+def model_changed():
+    '''Invalidates the results cached by every diagram, see StateDiagram.flatten_graph'''
+    global model_revision
+    model_revision += 1
+
+
 class StateDiagram(DiGraph):
     '''
     Representation of plantUML state diagram.
@@ -26,6 +52,18 @@ class StateDiagram(DiGraph):
         self.top_level = list()  # list of all the top-level states
         self.state_names = {}  # map of states by name to graph node
         self.transitions = list() # dictionary of all transitions in the diagram
+        self.lists = dict()  # {list name: [member tags]} of the list definitions in the diagram attributes
+        # transitions indexed by source state, destination state and (source, destination), see index_transitions
+        self.transitions_by_source = dict()
+        self.transitions_by_dest = dict()
+        self.transitions_by_pair = dict()
+        self.indexed_transitions = 0  # number of transitions of self.transitions indexed so far
+        self.flat_graph = None  # result of flatten_graph, valid while model_revision is self.flat_revision
+        self.flat_revision = None
+        self.compact = None  # result of compact_graph, valid with self.flat_graph
+        self.diagnostics = list()  # PlantUML_Lexer.LexDiagnostic for each run of the spec that failed to lex
+        self.on_state_added = None  # optional callback(state) for each new state added to this diagram
+        self.run_layout = None  # RunLayout of the attributes of the diagram, see index_attributes
 
         self.id = kwargs.pop('id', 'diagram instance')
 
@@ -34,6 +72,13 @@ class StateDiagram(DiGraph):
         # Initialize parent class
         DiGraph.__init__(self, *args, **kwargs)
 
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        # revisions are counted per process
+        state['flat_graph'], state['flat_revision'], state['compact'] = None, None, None
+        state['run_layout'] = None  # attributes are indexed again when loaded
+        return state
+
     def get_state(self, state_id, supress_error=False):
         if isinstance(state_id, State):
             return state_id
@@ -56,16 +101,42 @@ class StateDiagram(DiGraph):
     def get_transitions(self, source=None, dest=None):
         '''returns transitions in the diagram
             optionally filtered by source, destination states
-            :return: list of transitions matching filter criteria
+            :return: list of transitions matching filter criteria, in the order they were added
         '''
-        trans_list = self.transitions
-        if source:  # filter by source
+        if not source and not dest:
+            return self.transitions
+        if source:
             source = self.get_state(source)
-            trans_list = [x for x in trans_list if source in x.source]
-        if dest:  # conjunctive filter by destination
+        if dest:
             dest = self.get_state(dest)
-            trans_list = [x for x in trans_list if dest in x.dest]
-        return trans_list
+        self.index_transitions()
+        if source and dest:  # conjunctive filter
+            trans_list = self.transitions_by_pair.get((source, dest), [])
+        elif source:
+            trans_list = self.transitions_by_source.get(source, [])
+        else:
+            trans_list = self.transitions_by_dest.get(dest, [])
+        return list(trans_list)
+
+    def index_transitions(self):
+        '''
+        Indexes the transitions appended to self.transitions since the last call by source, destination and
+        (source, destination) states. Sources and destinations added to a transition after it was indexed
+        are not indexed.
+        '''
+        if self.indexed_transitions > len(self.transitions):  # transitions removed, index again
+            self.transitions_by_source, self.transitions_by_dest, self.transitions_by_pair = dict(), dict(), dict()
+            self.indexed_transitions = 0
+        for transition in self.transitions[self.indexed_transitions:]:
+            sources = unique(transition.source)
+            dests = unique(transition.dest)
+            for source in sources:
+                self.transitions_by_source.setdefault(source, []).append(transition)
+                for dest in dests:
+                    self.transitions_by_pair.setdefault((source, dest), []).append(transition)
+            for dest in dests:
+                self.transitions_by_dest.setdefault(dest, []).append(transition)
+        self.indexed_transitions = len(self.transitions)
 
     def print_edges(self):
         '''prints edges with friendly names'''
@@ -95,12 +166,15 @@ class StateDiagram(DiGraph):
         else:
             new_state = State(state_name, parent_state, attributes=attrs)
             self.state_names[state_name] = new_state
+            model_changed()
             # Add substate to parent if in diagram
             if parent_state:
                 self.get_state(parent_state).add_substate(new_state)
             else:
                 self.add_node(new_state)
                 self.top_level.append(new_state)
+            if self.on_state_added is not None:
+                self.on_state_added(new_state)
 
         if attrs:
             new_state.add_attribute(attrs)
@@ -137,6 +211,8 @@ class StateDiagram(DiGraph):
         # make new transition object and add to diagram.transitions
         new_transition = Transition(source, dest)
         self.transitions.append(new_transition)
+        self.index_transitions()
+        model_changed()
 
         # add attributes if applicable
         if attributes:
@@ -167,27 +243,72 @@ class StateDiagram(DiGraph):
 
     def flatten_graph(self):
         '''
-        Flattens recursive structure of State.substates to a single graph by eliminating all superstates
+        Flattens recursive structure of State.substates to a single graph by eliminating all superstates.
+        Transitions into a superstate lead to each of its leaf states without sources, transitions out of it
+        leave each of its leaf states without destinations, at any nesting depth.
+        The result is cached until a state or transition is added to the model, do not modify it.
         :return: directed graph of flattened structure
         '''
-        flat_graph = self.subgraph(self.nodes())  # retains only nodes and edges in top-level graph - not a copy!!
-        for state in flat_graph.nodes():
-            # check for subgraph
-            if state.num_substates > 0:
-                # recursively flatten subgraphs
-                subgraph = state.substates.flatten_graph()
-                # add resulting subgraph to newly flattened graph
-                flat_graph.add_edges_from(subgraph.edges())
-                # connect starting edges to superstate.source, ending edges to superstate.destination
-                for sub_state in subgraph.nodes():
-                    if sub_state.is_start_state():
-                        [flat_graph.add_edge(src, sub_state) for src in state.source]
-                    if sub_state.is_end_state():
-                        [flat_graph.add_edge(sub_state, dest) for dest in state.destination]
-                # remove superstate
-                flat_graph.remove_node(state)
+        if self.flat_graph is not None and self.flat_revision == model_revision:
+            return self.flat_graph
+
+        flat_graph = self.subgraph([])  # new subgraph with no nodes
+        superstates = list()  # superstates at every level, each before its own superstates
+        seen = set()  # a superstate may be listed among its own substates
+        levels = [self]
+        while levels:
+            level = levels.pop()
+            for state in level.nodes():
+                if state.num_substates > 0:
+                    if state not in seen:
+                        seen.add(state)
+                        superstates.append(state)
+                        levels.append(state.substates)
+                else:
+                    flat_graph.add_node(state)
+            # transitions between leaf states, transitions of superstates are connected below
+            flat_graph.add_edges_from((source, dest, data) for source, dest, data in level.edges(data=True)
+                                      if source.num_substates == 0 and dest.num_substates == 0)
+
+        # leaf states without sources (entries) and without destinations (exits) of each superstate,
+        # innermost superstates first
+        entries, exits = dict(), dict()
+        for superstate in reversed(superstates):
+            entries[superstate], exits[superstate] = list(), list()
+            for state in superstate.substates.nodes():
+                if state.num_substates > 0:
+                    if state is not superstate:
+                        entries[superstate].extend(entries.get(state, []))
+                        exits[superstate].extend(exits.get(state, []))
+                else:
+                    if state.is_start_state():
+                        entries[superstate].append(state)
+                    if state.is_end_state():
+                        exits[superstate].append(state)
+
+        # connect sources of each superstate to its entries, its exits to its destinations
+        for superstate in superstates:
+            for source in unique(superstate.source):
+                flat_graph.add_edges_from((exit, entry) for exit in exits.get(source, [source])
+                                          for entry in entries[superstate])
+            for dest in unique(superstate.destination):
+                flat_graph.add_edges_from((exit, entry) for exit in exits[superstate]
+                                          for entry in entries.get(dest, [dest]))
+
+        self.flat_graph, self.flat_revision, self.compact = flat_graph, model_revision, None
         return flat_graph
 
+    def compact_graph(self):
+        '''
+        Returns the flattened diagram numbered for path solving, see graph_utils.CompactGraph.
+        Cached with the result of flatten_graph.
+        :return: CompactGraph of flatten_graph(), its edge transitions are the transitions between leaf states
+        '''
+        flat_graph = self.flatten_graph()
+        if self.compact is None:
+            self.compact = CompactGraph.from_graph(flat_graph)
+        return self.compact
+
     def get_labeled_graph(self):
         '''returns a graph with nodes identified by state names'''
         labeled_graph = self.subgraph([])  # new subgraph with no nodes
@@ -204,11 +325,54 @@ class StateDiagram(DiGraph):
         '''
         attr_dict = dict()
         for state in self.state_names.values():
-            attr_dict[state.name] = state.attrs
+            attr_dict[state.name] = state.resolve_attributes()
         return attr_dict
 
+    def attribute_owners(self):
+        '''
+        Returns list of the states and transitions holding attributes, at every level of the diagram.
+        Transitions in superstates are held by both the diagram and the superstate, as separate instances.
+        '''
+        owners = list(self.state_names.values())
+        diagrams = [self]
+        while diagrams:
+            diagram = diagrams.pop()
+            owners.extend(diagram.transitions)
+            diagrams.extend(state.substates for state in diagram.state_names.values() if state.has_substate_diagram())
+        return owners
+
+    def index_attributes(self):
+        '''
+        Numbers the run state of the attributes of the diagram 0..N-1 in its RunLayout, once its attributes are
+        solved. Attributes added since the last call are numbered after the others, lazy attributes once solved.
+        :return: RunLayout
+        '''
+        if self.run_layout is None:
+            self.run_layout = RunLayout()
+        self.run_layout.add(attr for owner in self.attribute_owners() for attr in owner.attrs)
+        return self.run_layout
+
+
+class SlottedModel(object):
+    '''Base of slotted model classes, pickled with any protocol'''
+    __slots__ = ()
 
-class State(object):
+    def __getstate__(self):
+        return dict((name, getattr(self, name)) for cls in type(self).__mro__
+                    for name in getattr(cls, '__slots__', ()) if hasattr(self, name))
+
+    def __setstate__(self, state):
+        for name, value in state.items():
+            setattr(self, name, value)
+
+
+class State(SlottedModel):
+    '''
+    State of a diagram. Diagrams hold thousands of states, mostly without substates, so states are slotted
+    and the diagram of their substates is only created when first used.
+    '''
+
+    __slots__ = ('name', 'attrs', '_substates', 'num_substates', 'source', 'destination', 'parent', 'active')
 
     def __init__(self, name, parent_state=None, **kwargs):
         '''
@@ -219,8 +383,7 @@ class State(object):
 
         self.name = name
         self.attrs = list()
-        self.attributes = self.attrs  # overload
-        self.substates = StateDiagram()
+        self._substates = None  # StateDiagram of the substates, see substates
         self.num_substates = 0
         self.source = list()
         self.destination = list()
@@ -231,9 +394,28 @@ class State(object):
             dlog.rootlog.error("State parents must also be states - cannot bind parent to %", self.name)
             raise TypeError
 
+    @property
+    def attributes(self):  # overload
+        return self.attrs
+
+    @property
+    def substates(self):
+        '''StateDiagram of the substates of this state, created on first access'''
+        if self._substates is None:
+            self._substates = StateDiagram()
+        return self._substates
+
+    def has_substate_diagram(self):
+        '''Returns True if the substates diagram was created, ie. substates or their transitions may exist'''
+        return self._substates is not None
+
     def add_attribute(self, attribute):
         self.attrs.append(attribute)
 
+    def resolve_attributes(self):
+        '''Solves lazy attributes of this state, returns self.attrs'''
+        return resolve_attributes(self.attrs)
+
     def add_substate(self, substate):
         if not isinstance(substate, State):
             raise TypeError
@@ -241,9 +423,10 @@ class State(object):
             self.substates.add_node(substate)
             self.substates.top_level.append(substate)
             self.num_substates += 1
+            model_changed()
 
     def get_substate_names(self):
-        return [x.name for x in self.substates]
+        return [x.name for x in self._substates] if self._substates is not None else []
 
     def is_start_state(self, global_scope=False):
         '''
@@ -298,14 +481,16 @@ class State(object):
         pp([(attr, attr.__dict__) for attr in self.attrs])
 
 
-class Transition(object):
+class Transition(SlottedModel):
+
+    __slots__ = ('attrs', 'source', 'dest')
+
     def __init__(self, source, dest, attrs=None):
         '''
         Constructor
         :return: new Transition with source and destination
         '''
         self.attrs = list()  #List of transition attributes
-        self.attributes = self.attrs  # overload
         self.source = list() # list of states
         self.dest = list() # list of states with transitions originating in this state
 
@@ -315,12 +500,23 @@ class Transition(object):
         if attrs:
             [self.add_attribute(attr) for attr in attrs]
 
+    @property
+    def attributes(self):  # overload
+        return self.attrs
+
     def add_attribute(self, attribute):
+        if isinstance(attribute, basestring):  # raw attribute string, not a list of attributes
+            self.attrs.append(attribute)
+            return
         try:
             self.attrs.extend(attribute)
         except:  # attribute is not iterable, expecting a list
             self.attrs.append(attribute)
 
+    def resolve_attributes(self):
+        '''Solves lazy attributes of this transition, returns self.attrs'''
+        return resolve_attributes(self.attrs)
+
     def add_source(self, TranSource):
         if not isinstance(TranSource, State):
             raise TypeError
@@ -333,3 +529,85 @@ class Transition(object):
         else:
             self.dest.append(TranDest)
 
+
+
+class AttributeBinding(object):
+    '''Attributes of states and transitions of a shared diagram, replaced for the test runs of one binding'''
+
+    def __init__(self, bindings):
+        '''
+        :param bindings: list of (attribute owner, index in owner.attrs, bound attribute)
+        '''
+        self.bindings = bindings
+        self.bound = dict()  # {id of attribute owner: {index in owner.attrs: bound attribute}}
+        for owner, index, attribute in bindings:
+            self.bound.setdefault(id(owner), dict())[index] = attribute
+        self.run_layout = RunLayout(attribute for _, _, attribute in bindings)
+
+    def attributes(self, owner):
+        '''Returns the attributes of a state or transition under this binding, owner.attrs is left unchanged'''
+        bound = self.bound.get(id(owner))
+        if not bound:
+            return owner.attrs
+        return [bound.get(index, attr) for index, attr in enumerate(owner.attrs)]
+
+
+
+if __name__ == "__main__":
+    # memory benchmark: per-state overhead of a synthetic diagram of 10k states in 100 superstates
+    import gc
+    import sys
+    import types
+    import logging
+
+    def deep_size(root):
+        '''Bytes of the objects reachable from root, excluding classes, modules and loggers shared by all diagrams'''
+        seen, size, stack = set(), 0, [root]
+        while stack:
+            obj = stack.pop()
+            if id(obj) in seen or isinstance(obj, (type, types.ModuleType, types.FunctionType, logging.Logger)):
+                continue
+            seen.add(id(obj))
+            size += sys.getsizeof(obj)
+            stack.extend(gc.get_referents(obj))
+        return size
+
+    class BaselineState(State):
+        '''State as it was before slots: fields in an instance dictionary, substate diagram built eagerly'''
+        def __init__(self, *args, **kwargs):
+            super(BaselineState, self).__init__(*args, **kwargs)
+            self.__dict__.update((name, getattr(self, name)) for name in ('name', 'attrs', 'num_substates', 'source',
+                                                                          'destination', 'parent'))
+            self.__dict__.update(attributes=self.attrs, substates=self.substates)
+
+    class BaselineTransition(Transition):
+        '''Transition as it was before slots, fields in an instance dictionary'''
+        def __init__(self, *args, **kwargs):
+            super(BaselineTransition, self).__init__(*args, **kwargs)
+            self.__dict__.update(attrs=self.attrs, attributes=self.attrs, source=self.source, dest=self.dest)
+
+    def per_state_size(state_class, transition_class, num_states=10000, num_superstates=100):
+        '''Builds a synthetic diagram of num_states states in num_superstates superstates, returns bytes per state'''
+        model_classes = State, Transition
+        globals().update(State=state_class, Transition=transition_class)  # classes created by StateDiagram
+        try:
+            diagram = StateDiagram()
+            empty = deep_size(diagram)
+            previous = u'[*]'
+            for i in range(num_superstates):
+                superstate = u'Phase%d' % i
+                diagram.add_transition(previous, superstate)
+                children = [u'%s_Step%d' % (superstate, j) for j in range(num_states // num_superstates - 1)]
+                diagram.add_transition(u'[*]', children[0], parent_state=superstate)
+                for source, dest in zip(children, children[1:]):
+                    diagram.add_transition(source, dest, parent_state=superstate)
+                previous = superstate
+        finally:
+            globals().update(State=model_classes[0], Transition=model_classes[1])
+        states = len(diagram.state_names)
+        print '%s: %d states, %d transitions' % (state_class.__name__, states, len(diagram.transitions))
+        return (deep_size(diagram) - empty) / float(states)
+
+    print 'per state, with its transitions and graph structure:'
+    print 'before (unslotted, eager substates): %.0f bytes' % per_state_size(BaselineState, BaselineTransition)
+    print 'after (slotted, lazy substates): %.0f bytes' % per_state_size(State, Transition)
@@ -3,6 +3,7 @@ __author__ = 'vpeng'
 from serverside.OPCclient import OPC_Connect
 import time
 
+from Attributes.RunContext import RunContext
 
 from Utilities.Logger import LogTools
 dlog = LogTools('TestAdmin.log', 'TestAdmin')
@@ -14,21 +15,39 @@ def remove_duplicates(values):
 
 
 class TestAdmin():
-    def __init__(self, test_case, diagram, connection, poll_interval=0.5, timeout=600):
+    def __init__(self, test_case, diagram, connection, poll_interval=0.5, timeout=600, binding=None):
         self.diagram = diagram
         self.test_case = test_case
         self.connection = connection
+        # StateModel.AttributeBinding of the run, ex. a RecipeParameters.ParameterSet or UnitTemplate.UnitInstance,
+        # None to execute the attributes of the diagram
+        self.binding = binding
         self.logger = dlog.MakeChild('TestAdmin')
         self.poll_interval = poll_interval  # interval between calls to execute states or transitions
         self.global_timeout = timeout  # global timeout if all states not achieved
 
+    def attributes(self, owner):
+        '''Returns the attributes of a state or transition executed by this run'''
+        if self.binding is None:
+            return owner.attrs
+        return self.binding.attributes(owner)
+
+    def set_hooks(self, attr):
+        '''Sets the connection read/write hooks of attr, and the batched read hook of grouped attributes'''
+        attr.set_read_hook(self.connection.read)
+        attr.set_write_hook(self.connection.write)
+        if hasattr(attr, 'set_batch_read_hook') and hasattr(self.connection, 'read_many'):
+            attr.set_batch_read_hook(self.connection.read_many)
+
     def recur(self, in_state):
         state = self.test_case.get_state(state_id=in_state)
-        num_attributes = len(state.attrs)
+        state.resolve_attributes()
+        attrs = self.attributes(state)
+        num_attributes = len(attrs)
         complete_count = 0
 
         # set read/write hooks for all attributes
-        [(attr.set_read_hook(self.connection.read), attr.set_write_hook(self.connection.write)) for attr in state.attrs]
+        [self.set_hooks(attr) for attr in attrs]
 
         self.logger.debug("Testing state::: %r, %r attribute(s) found", state.name, num_attributes)
         self.last_state_complete_cnt = None
@@ -41,7 +60,7 @@ class TestAdmin():
             # (1) execute test loop if all attributes are not complete
             # each attribute is executed during every polling period -- in case the value changes!!
             # TODO - find out how long attr.execute() method takes for each attribute type (see timeit)
-            for attr in state.attrs:
+            for attr in attrs:
                 type_error_mark = []
                 if attr._complete != True:
                     try:
@@ -83,7 +102,10 @@ class TestAdmin():
         destination = self.test_case.get_state(state_id=destination)
 
         transitions = self.diagram.get_transitions(source=source.name, dest=destination.name)
-        num_attributes = len(transitions[0].attrs)
+        for transition in transitions:
+            transition.resolve_attributes()
+        destination.resolve_attributes()
+        num_attributes = len(self.attributes(transitions[0]))
 
         complete_count = 0
         self.logger.debug("Testing transition between source state %r and destination state %r",
@@ -99,9 +121,8 @@ class TestAdmin():
             #while complete_count != num_attributes:
 
             for transition in transitions:
-                for tran_attr in transition.attrs:
-                    tran_attr.set_read_hook(self.connection.read)
-                    tran_attr.set_write_hook(self.connection.write)
+                for tran_attr in self.attributes(transition):
+                    self.set_hooks(tran_attr)
                     type_error_mark = []
                     if tran_attr._complete != True:
                         try:
@@ -123,7 +144,7 @@ class TestAdmin():
 
             if complete_count == num_attributes:
                 #Activate all State Attributes in Destination State
-                for dest_attr in destination.attrs:
+                for dest_attr in self.attributes(destination):
                     dest_attr.activate()
                 return True
             elif (time.time() - mark_timeout) > self.global_timeout:
@@ -137,11 +158,18 @@ class TestAdmin():
 
 class Test(TestAdmin):
 
-    def __init__(self, test_case, diagram, connection):
+    def __init__(self, test_case, diagram, connection, context=None, binding=None):
+        '''
+        :param context: RunContext holding the attribute run state of this test, defaults to a new context.
+                        Tests of one diagram in separate contexts can run in parallel threads.
+        :param binding: StateModel.AttributeBinding of the attributes executed, ex. the RecipeParameters.ParameterSet
+                        of the recipe parameter row tested. The diagram is not changed by the binding.
+        '''
         self.test_case = test_case
         self.diagram = diagram
         self.connection = connection
-        TestAdmin.__init__(self, test_case, diagram, connection)
+        self.context = context or RunContext(getattr(test_case, 'name', 'run'))
+        TestAdmin.__init__(self, test_case, diagram, connection, binding=binding)
         #TODO: need to make the state_id constant.
 
         for state in test_case.state_names:
@@ -151,9 +179,14 @@ class Test(TestAdmin):
         # self.start_state = diagram.get_state(state_id = 'START')
 
     def start(self):
+        with self.context:
+            self.run()
+
+    def run(self):
         print "+++++++++++++++++++++++++++++++++++Test Start ++++++++++++++++++++++++++++++++++"
         in_state = self.start_state
-        while in_state and TestAdmin(self.test_case, self.diagram,  self.connection).recur(in_state):
+        while in_state and TestAdmin(self.test_case, self.diagram,  self.connection,
+                                     binding=self.binding).recur(in_state):
             # FIXME: remove duplicated sources/destinations in TestSolver/ModelBuilder
             next_states = remove_duplicates(in_state.destination) # A List of Possible Destination
             if next_states: # not empty
@@ -163,7 +196,8 @@ class Test(TestAdmin):
                 while transition_pass != True:
                     for next_state in next_states:
                         print "next_state:", next_state.name
-                        transition_pass = TestAdmin(self.test_case, self.diagram, self.connection).transit(source = in_state, destination = next_state)
+                        transition_pass = TestAdmin(self.test_case, self.diagram, self.connection,
+                                                    binding=self.binding).transit(source = in_state, destination = next_state)
                         in_state = next_state
             else:
                 print "==============================Test Complete========================="
@@ -172,7 +206,7 @@ class Test(TestAdmin):
 
 if __name__ == "__main__":
 
-    from ModelBuilder import build_state_diagram
+    from DiagramSnapshot import load_or_build
     import config, os, time
     from Attributes import AttributeBuilder
     from pprint import pprint as pp
@@ -186,8 +220,8 @@ if __name__ == "__main__":
     # abuilder = AttributeBuilder.create_attribute_builder(server_ip='127.0.0.1', server_port=5489)
     abuilder = AttributeBuilder.create_attribute_builder(server_ip='10.0.1.200', server_port=5489)
 
-    # ==Build diagram, preprocessor optional==:
-    diagram = build_state_diagram(input_path, attribute_builder=abuilder, preprocess=True)
+    # ==Build diagram, preprocessor optional==, or load it from its snapshot if the spec is unchanged:
+    diagram = load_or_build(input_path, attribute_builder=abuilder, preprocess=True)
 
     print "Parsed", len(diagram.state_names.values()), "states"
     print "Parsed", len(diagram.get_transitions()), "transitions"
@@ -74,7 +74,7 @@ class TestCaseGenerator(object):
         # flatten state model diagram
         flat_graph = self.diagram.flatten_graph()
         # generate linear state model for each path through graph from each possible starting state to each ending state
-        self.solver.set_graph(flat_graph)
+        self.solver.set_graph(flat_graph, compact=self.diagram.compact_graph())
         test_number = 1
         # iterate over all possible start/end combinations
         for start_state in flat_graph.get_start_states(global_scope=True):
@@ -95,7 +95,7 @@ class TestCaseGenerator(object):
         :return:
         '''
         flat_graph = self.diagram.flatten_graph()
-        self.solver.set_graph(flat_graph)
+        self.solver.set_graph(flat_graph, compact=self.diagram.compact_graph())
         return self.solver.calculate_complexity()
 
     def get_failed_cases(self):
@@ -142,7 +142,7 @@ class TestCaseGenerator(object):
 if __name__ == "__main__":
     import os
     import config
-    import ModelBuilder
+    import DiagramSnapshot
     from Attributes import AttributeBuilder
 
     config.sys_utils.set_pp_on()
@@ -153,8 +153,8 @@ if __name__ == "__main__":
     # create attribute builder instance for solving attributes
     #abuilder = AttributeBuilder.create_attribute_builder(server_ip='127.0.0.1', server_port=5489)
     abuilder = AttributeBuilder.create_attribute_builder(server_ip='10.0.1.200', server_port=5489)
-    # build StateDiagram instance
-    diagram = ModelBuilder.build_state_diagram(file_path, attribute_builder=abuilder, preprocess=True)
+    # build StateDiagram instance, or load it from its snapshot if the spec is unchanged
+    diagram = DiagramSnapshot.load_or_build(file_path, attribute_builder=abuilder, preprocess=True)
 
     # generate test cases from model
     test_gen = TestCaseGenerator(diagram)
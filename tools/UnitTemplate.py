@@ -0,0 +1,284 @@
+'''
+Module contains template instantiation of per-unit EM diagrams from their class spec.
+
+Class specs in specs/EM (ex. S_EMC_CHARGE.puml) include one of the unit definitions in
+Definitions/<class>/, files holding only the !define aliases and parameter paths of a unit.
+A UnitTemplate pre-processes, lexes and builds the class spec once with its unit definition includes left
+out, keeping the attribute strings with unit aliases unresolved. Instantiating a unit pre-processes only its
+definition file and substitutes its aliases in the attribute strings of the class diagram. Only the strings
+referencing an alias of the unit are solved for the unit; the other attributes are solved once, in the class
+diagram. A unit definition titling the unit changes the default tag of its attributes, so all attributes of
+such a unit are solved for the unit.
+
+A UnitInstance binds the unit attributes to the shared class diagram, which is not changed by instantiating
+units: its states, transitions, attributes without aliases and test case paths are shared by all units,
+and test runs look the attributes of a unit up through the UnitInstance.
+
+Unit definitions must not use !definelong, redefine names defined by the class spec or substitute aliases
+outside of attributes, and class specs must not depend on unit definitions through !ifdef/!ifndef;
+build those units with ModelBuilder.build_state_diagram instead.
+
+Example calling:
+==============================
+import UnitTemplate
+
+template = UnitTemplate.UnitTemplate('specs/EM/S_EMC_CHARGE.puml', attribute_builder=abuilder)
+unit = template.instantiate('specs/EM/Definitions/S_EMC_CHARGE/R6-WTRCHG-EM.puml')
+for test_case in TestSolver.TestCaseGenerator(template.diagram).generate_test_cases().values():
+    TestAdmin.Test(test_case=test_case.diagram, diagram=template.diagram, connection=connection, binding=unit).start()
+
+# every unit of the class
+units = UnitTemplate.instantiate_units('specs/EM/S_EMC_CHARGE.puml')
+==============================
+'''
+
+__author__ = 'ekopache'
+
+import os
+
+import config
+import ModelBuilder
+import PlantUML_Lexer
+import PlantUML_Preprocessor
+import RecipeParameters
+from PlantUML_Lexer import TITLE, SATTR, TATTR
+from StateModel import AttributeBinding
+
+from Utilities.Logger import LogTools
+dlog = LogTools('UnitTemplate.log', 'UnitTemplate')
+dlog.rootlog.warning('Module initialized')
+
+
+class TemplateError(Exception):
+    '''Class spec or unit definition cannot be instantiated from a template'''
+    pass
+
+
+def definitions_path(class_spec):
+    '''Returns Definitions folder of the units of a class spec'''
+    return os.path.join(os.path.dirname(os.path.abspath(class_spec)), 'Definitions')
+
+
+def unit_definitions(class_spec):
+    '''Returns sorted absolute paths of the unit definitions of a class spec, in Definitions/<class name>/'''
+    unit_dir = os.path.join(definitions_path(class_spec), os.path.splitext(os.path.basename(class_spec))[0])
+    if not os.path.isdir(unit_dir):
+        return list()
+    return sorted(os.path.join(unit_dir, name) for name in os.listdir(unit_dir) if name.endswith('.puml'))
+
+
+def model_tokens(text, lexer):
+    '''Returns list of (token type, value, line) of text, without tokens ignored by the model builder'''
+    ignored = ModelBuilder.StateModelBuilder.ignored_tokens
+    return [item for item in PlantUML_Lexer.numbered_tokens(lexer, text) if item[0] not in ignored]
+
+
+class UnitInstance(AttributeBinding):
+    '''Unit of a class spec, binding the attributes referencing its aliases to the shared class diagram'''
+
+    def __init__(self, name, diagram, bindings, title=None):
+        '''
+        :param name: file name of the unit definition
+        :param diagram: StateModel.StateDiagram of the class spec
+        :param bindings: list of (attribute owner, index in owner.attrs, unit attribute)
+        :param title: tag of the unit titled by its definition, None if untitled
+        '''
+        AttributeBinding.__init__(self, bindings)
+        self.name = name
+        self.diagram = diagram
+        self.title = title
+
+    def __repr__(self):
+        return 'UnitInstance: ' + self.name
+
+
+class UnitTemplate(object):
+    '''Class spec pre-processed, lexed and built once, with the definitions of its units left out'''
+
+    def __init__(self, class_spec, backend=None, attribute_builder=None):
+        '''
+        :param class_spec: path to class spec *.puml file
+        :param backend: lexer backend, see PlantUML_Lexer.get_lexer
+        :param attribute_builder: AttributeBuilder solving the attributes of the units, None to keep raw strings
+        '''
+        self.class_spec = os.path.abspath(class_spec)
+        self.lexer = PlantUML_Lexer.get_lexer(backend)
+        self.attribute_builder = attribute_builder
+        self.logger = dlog.MakeChild('UnitTemplate', os.path.basename(class_spec))
+
+        with open(self.class_spec) as f:
+            if any(PlantUML_Preprocessor.IFDEF.match(line.strip()) for line in f):
+                raise TemplateError('Conditionals of ' + class_spec + ' may depend on unit definitions')
+
+        unit_prefix = definitions_path(self.class_spec) + os.sep
+        self.defines = None  # class spec definitions in effect at the first unit definition include
+
+        def skip_include(file_path):
+            if not file_path.startswith(unit_prefix):
+                return False
+            if self.defines is None:
+                self.defines = list(preprocessor.defines)
+            return True
+
+        preprocessor = PlantUML_Preprocessor.PumlPreprocessor(skip_include=skip_include)
+        lines = preprocessor.process_file(self.class_spec).splitlines()
+        self.class_defines = set(define.name for define in preprocessor.defines) | set(preprocessor.long_defines)
+
+        markers = [i for i, line in enumerate(lines) if line.startswith(PlantUML_Preprocessor.SKIPPED_INCLUDE)]
+        # unit tokens are spliced before the first token following the first unit definition include,
+        # unit definitions included outside the diagram are defined for the whole diagram
+        splice_line = markers[0] if markers else 0
+        if not markers:
+            self.defines = list()
+        for i in reversed(markers):
+            del lines[i]
+        self.tokens = model_tokens('\n'.join(lines) + '\n', self.lexer)
+        self.splice = next((i for i, item in enumerate(self.tokens) if item[2] > splice_line), len(self.tokens))
+
+        # attributes are left as raw strings by the build, and solved for the first unit not aliasing them
+        self.diagram = ModelBuilder.StateModelBuilder().parse(iter(self.tokens))
+        self.diagram.diagnostics = list()
+        # (attribute owner, index in owner.attrs, template string) of the attribute strings of the class diagram
+        self.strings = [(owner, index, attr) for owner in self.diagram.attribute_owners()
+                        for index, attr in enumerate(owner.attrs) if isinstance(attr, basestring)]
+        self.solved = set()  # indexes in self.strings of the attributes solved in the class diagram
+        declared = self.diagram.lists.get(RecipeParameters.PARAM_LIST)
+        self.symbolic = set(i for i, (_, _, string) in enumerate(self.strings)
+                            if RecipeParameters.is_symbolic(string, declared))
+        # default tag of the attributes solved in the class diagram
+        title = next((value for token, value, line in self.tokens if token == TITLE), None)
+        if title is not None:
+            self.default_tag = ModelBuilder.title_tag(title)
+        else:
+            self.default_tag = attribute_builder.default_tag if attribute_builder is not None else ''
+
+    def unit_substitution(self, unit_definition):
+        '''
+        Pre-processes a unit definition
+        :param unit_definition: path to unit definition *.puml file
+        :return: (list of the model tokens of the definition, function substituting its aliases in a template value)
+        '''
+        preprocessor = PlantUML_Preprocessor.PumlPreprocessor()
+        preprocessor.defines = list(self.defines)
+        unit_text = preprocessor.process_file(unit_definition)
+        if preprocessor.long_defines:
+            raise TemplateError('!definelong in ' + unit_definition)
+
+        inherited = set(id(define) for define in self.defines)
+        unit_defines = [define for define in preprocessor.defines if id(define) not in inherited]
+        redefined = set(define.name for define in unit_defines) & self.class_defines
+        if redefined:
+            raise TemplateError(unit_definition + ' redefines ' + ', '.join(sorted(redefined)))
+
+        substituted = dict()  # {template value: unit value}, most values repeat within a spec
+
+        def substitute(value):
+            if value not in substituted:
+                unit_value = value
+                for define in unit_defines:
+                    unit_value = define.apply(unit_value)
+                # values without aliases are shared with the template
+                substituted[value] = value if unit_value == value else unit_value
+            return substituted[value]
+
+        return model_tokens(unit_text, self.lexer), substitute
+
+    def unit_tokens(self, unit_definition):
+        '''
+        Pre-processes a unit definition, substituting its aliases in the template tokens
+        :param unit_definition: path to unit definition *.puml file
+        :return: list of (token type, value, line) of the class spec instantiated for the unit
+        '''
+        unit_tokens, substitute = self.unit_substitution(unit_definition)
+        tokens = self.tokens[:self.splice]
+        tokens.extend(unit_tokens)
+        tokens.extend((token, substitute(value), line) for token, value, line in self.tokens[self.splice:])
+        return tokens
+
+    def instantiate(self, unit_definition):
+        '''
+        Binds the attributes of a unit to the class diagram
+        :param unit_definition: path to unit definition *.puml file
+        :return: UnitInstance
+        '''
+        unit_tokens, substitute = self.unit_substitution(unit_definition)
+        titles = [ModelBuilder.title_tag(value) for token, value, line in unit_tokens if token == TITLE]
+        if len(titles) < len(unit_tokens) or any(substitute(value) != value for token, value, line
+                                                 in self.tokens[self.splice:] if token not in (SATTR, TATTR)):
+            raise TemplateError(unit_definition + ' changes states or transitions of ' + self.class_spec)
+        title = titles[-1] if titles else None
+
+        unit_strings = [substitute(string) for _, _, string in self.strings]
+        if title is not None and title != self.default_tag:
+            # any attribute may fall back to the tag of the unit
+            aliased, shared = range(len(self.strings)), list()
+        else:
+            aliased = [i for i, (_, _, string) in enumerate(self.strings) if unit_strings[i] != string]
+            shared = [i for i, (_, _, string) in enumerate(self.strings)
+                      if i not in self.solved and unit_strings[i] == string]
+        attributes = self.solve([unit_strings[i] for i in aliased + shared], aliased + shared, substitute,
+                                title or self.default_tag)
+
+        for i, attribute in zip(shared, attributes[len(aliased):]):
+            owner, index, _ = self.strings[i]
+            owner.attrs[index] = attribute
+        self.solved.update(shared)
+        self.diagram.index_attributes()
+        bindings = [self.strings[i][:2] + (attribute,) for i, attribute in zip(aliased, attributes)]
+        self.logger.info('Instantiated %s: %d unit attributes, %d attributes solved in the class diagram',
+                         os.path.basename(unit_definition), len(aliased), len(shared))
+        return UnitInstance(os.path.basename(unit_definition), self.diagram, bindings, title)
+
+    def solve(self, raw_strings, positions, substitute, default_tag):
+        '''
+        Solves attribute strings of the class diagram in a single batch
+        :param positions: indexes in self.strings of raw_strings
+        :param substitute: function substituting the aliases of the unit solved for
+        :param default_tag: default tag of the attributes of the unit
+        :return: list of attributes, raw strings if not solved or referencing recipe parameters
+        '''
+        if self.attribute_builder is None or not raw_strings:
+            return raw_strings
+        builder = self.attribute_builder
+        builder.set_lists(dict((name, [substitute(member) for member in members])
+                               for name, members in self.diagram.lists.items()))
+        solvable = [i for i, position in enumerate(positions) if position not in self.symbolic]
+        attributes = list(raw_strings)
+        previous_tag, builder.default_tag = builder.default_tag, default_tag
+        try:
+            solved = builder.solve_attributes([raw_strings[i] for i in solvable])
+        finally:
+            builder.default_tag = previous_tag
+        for i, attribute in zip(solvable, solved):
+            if attribute:
+                attributes[i] = attribute
+        return attributes
+
+
+def instantiate_units(class_spec, units=None, attribute_builder=None, **kwargs):
+    '''
+    Instantiates the units of a class spec from a single template
+    :param units: list of unit definition paths, defaults to unit_definitions(class_spec)
+    :param kwargs: passed to UnitTemplate
+    :return: {absolute unit definition path: UnitInstance}, sharing the class diagram
+    '''
+    template = UnitTemplate(class_spec, attribute_builder=attribute_builder, **kwargs)
+    if units is None:
+        units = unit_definitions(class_spec)
+    return dict((os.path.abspath(unit), template.instantiate(unit)) for unit in units)
+
+
+if __name__ == "__main__":
+    from timeit import default_timer
+
+    class_spec = os.path.join(config.specs_path, 'EM', 'S_EMC_CHARGE.puml')
+    units = unit_definitions(class_spec)
+
+    start = default_timer()
+    template = UnitTemplate(class_spec)
+    instances = [template.instantiate(unit) for unit in units]
+    print 'template: %d units in %.1f ms' % (len(instances), (default_timer() - start) * 1000)
+    print '  class diagram: %d states, %d transitions' % (len(template.diagram.state_names),
+                                                         len(template.diagram.get_transitions()))
+    for instance in instances:
+        print '  %s: %d unit attributes' % (instance.name, len(instance.bindings))
@@ -0,0 +1,140 @@
+'''
+Module contains a size-bounded, content-addressed disk cache.
+
+Entries are stored as files named by a hash key supplied by the caller. The modification time
+of each entry file is refreshed on every hit, so the least recently used entries are evicted
+first once the total size of the cache exceeds max_bytes.
+
+Example calling:
+==============================
+cache = ContentCache(config.cache_path, config.cache_max_bytes)
+text = cache.get(key)
+if text is None:
+    text = expensive_function()
+    cache.put(key, text)
+print cache.stats()
+==============================
+'''
+
+__author__ = 'ekopache'
+
+import os
+import tempfile
+
+
+class ContentCache(object):
+
+    def __init__(self, cache_path, max_bytes, suffix='.cache'):
+        self.cache_path = cache_path
+        self.max_bytes = max_bytes
+        self.suffix = suffix
+
+        # counters for monitoring cache efficiency
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+        if not os.path.isdir(self.cache_path):
+            os.makedirs(self.cache_path)
+
+    def entry_path(self, key):
+        return os.path.join(self.cache_path, key + self.suffix)
+
+    def get(self, key):
+        '''
+        Returns cached value for key, or None if no entry exists
+        :param key: hash string identifying the entry
+        '''
+        path = self.entry_path(key)
+        try:
+            with open(path, 'rb') as f:
+                value = f.read()
+        except IOError:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.touch(path)
+        return value
+
+    def get_path(self, key):
+        '''
+        Returns path of the entry file for key without reading it, or None if no entry exists
+        :param key: hash string identifying the entry
+        '''
+        path = self.entry_path(key)
+        if not os.path.isfile(path):
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.touch(path)
+        return path
+
+    def touch(self, path):
+        '''Marks entry file as recently used'''
+        try:
+            os.utime(path, None)
+        except OSError:
+            pass
+
+    def put(self, key, value):
+        '''
+        Stores value under key, then evicts least recently used entries above self.max_bytes
+        :param key: hash string identifying the entry
+        :param value: string to store
+        '''
+        # write to a temporary file first so concurrent readers never see partial entries
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_path, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            f.write(value)
+        path = self.entry_path(key)
+        if os.name == 'nt' and os.path.exists(path):
+            os.remove(path)
+        os.rename(tmp_path, path)
+
+        self.evict()
+
+    def entries(self):
+        '''Returns list of (last access time, size, path) tuples for all entries, oldest first'''
+        entries = list()
+        for file_name in os.listdir(self.cache_path):
+            if not file_name.endswith(self.suffix):
+                continue
+            path = os.path.join(self.cache_path, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return sorted(entries)
+
+    def evict(self):
+        '''Removes least recently used entries until the cache fits within self.max_bytes'''
+        entries = self.entries()
+        total = sum(size for mtime, size, path in entries)
+        for mtime, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            self.evictions += 1
+
+    def clear(self):
+        '''Removes all entries from the cache'''
+        for mtime, size, path in self.entries():
+            os.remove(path)
+
+    def stats(self):
+        '''Returns dictionary of cache counters and current size'''
+        entries = self.entries()
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'entries': len(entries),
+            'bytes': sum(size for mtime, size, path in entries),
+        }
@@ -0,0 +1,242 @@
+'''
+Module contains an opt-in timing profile of the stages of a diagram build.
+
+Components of the build pipeline time their work in named stages when they are handed a BuildProfile,
+and do nothing besides a None check otherwise. Each stage records its number of calls, wall time
+including nested stages, self time excluding them, and the bytes and items (tokens, attribute strings,
+server requests) it processed. Stages may be timed from several threads.
+
+Stages timed by the build pipeline:
+    build_state_diagram whole build, its self time is the overhead outside the other stages
+    preprocess          plantUML pre-processor, python or jar, bytes of pre-processed text
+    lex                 time spent producing tokens while they are consumed, items are tokens
+    model_parse         ModelBuilder.parse excluding lexing and attribute solving, items are model events
+    attribute_parse     AttributeParser.parse, items are attribute strings
+    attribute_solve     AttributeBuilder.solve_attribute excluding parsing and server requests
+    dvconfig            requests to the DVConfig server, items are tags or paths requested
+
+The report is a dictionary ready for JSON. The profile can also be saved in the Chrome trace event
+format, viewable in chrome://tracing or ui.perfetto.dev. Stages timed item by item with iterate
+are in the report only.
+
+Example calling:
+==============================
+from Utilities.Profiler import BuildProfile, stage
+
+profile = BuildProfile('S_EMC_CHARGE')
+with stage(profile, 'preprocess') as call:
+    text = preprocess(spec_path)
+    call.size = len(text)
+for token in profile.iterate('lex', tokens, size=len(text)):
+    ...
+print profile.summary()
+profile.save_json('build.json')
+profile.save_chrome_trace('build.trace.json')
+
+# components without a profile
+with stage(None, 'lex'):
+    ...
+==============================
+'''
+
+__author__ = 'ekopache'
+
+import os
+import json
+import threading
+import collections
+from timeit import default_timer
+
+
+class StageStats(object):
+    '''Accumulated timings of one stage'''
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.0  # seconds, including nested stages
+        self.self_time = 0.0  # seconds, excluding nested stages
+        self.bytes = 0
+        self.items = 0
+
+    def as_dict(self):
+        return collections.OrderedDict([('calls', self.calls), ('wall', self.wall), ('self', self.self_time),
+                                        ('bytes', self.bytes), ('items', self.items)])
+
+
+class StageCall(object):
+    '''Single timed call of a stage, size and items may be set while it runs'''
+
+    def __init__(self, name, size=0, items=0):
+        self.name = name
+        self.size = size
+        self.items = items
+        self.nested = 0.0  # seconds spent in stages nested in this call
+
+
+class _NullStage(object):
+    '''Context of stages timed without a profile'''
+
+    def __enter__(self):
+        return StageCall(None)
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_STAGE = _NullStage()
+
+
+def stage(profile, name, size=0, items=0):
+    '''
+    Returns a context timing one call of a stage
+    :param profile: BuildProfile, or None to time nothing
+    :param size: bytes processed by the call, may also be set on the StageCall returned by the context
+    :param items: items processed by the call
+    '''
+    if profile is None:
+        return NULL_STAGE
+    return _Stage(profile, name, size, items)
+
+
+class _Stage(object):
+
+    def __init__(self, profile, name, size, items):
+        self.profile = profile
+        self.call = StageCall(name, size, items)
+        self.start = None
+
+    def __enter__(self):
+        self.profile.call_stack().append(self.call)
+        self.start = default_timer()
+        return self.call
+
+    def __exit__(self, *exc_info):
+        self.profile.finish_call(self.call, self.start, default_timer() - self.start, trace=True)
+        return False
+
+
+class BuildProfile(object):
+    '''Per-stage timings of one or more diagram builds'''
+
+    def __init__(self, name=''):
+        self.name = name
+        self.stages = collections.OrderedDict()  # {stage name: StageStats}, in order of first call
+        self.events = list()  # (name, start, duration, thread id, size, items) of traced calls
+        self.start = default_timer()
+        self.end = None
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock'], state['_local']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def call_stack(self):
+        '''Returns the stack of StageCall running in the current thread'''
+        try:
+            return self._local.stack
+        except AttributeError:
+            self._local.stack = list()
+            return self._local.stack
+
+    def finish_call(self, call, start, elapsed, trace):
+        '''Pops call from the stack of the current thread, recording its time'''
+        stack = self.call_stack()
+        stack.pop()
+        if stack:
+            stack[-1].nested += elapsed
+        self.record(call.name, start, elapsed, elapsed - call.nested, call.size, call.items, 1, trace)
+
+    def record(self, name, start, elapsed, self_time, size=0, items=0, calls=1, trace=False):
+        with self._lock:
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats()
+            stats.calls += calls
+            stats.wall += elapsed
+            stats.self_time += self_time
+            stats.bytes += size
+            stats.items += items
+            if trace:
+                self.events.append((name, start, elapsed, threading.current_thread().ident, size, items))
+
+    def iterate(self, name, iterable, size=0):
+        '''
+        Yields the items of iterable, timing the production of each item in stage name.
+        Recorded as a single call once the iterable is exhausted or the generator is closed.
+        :param size: bytes processed by the whole iteration
+        '''
+        iterator = iter(iterable)
+        wall, self_time, count = 0.0, 0.0, 0
+        start = default_timer()
+        try:
+            while True:
+                stack = self.call_stack()
+                call = StageCall(name)
+                stack.append(call)
+                item_start = default_timer()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    elapsed = default_timer() - item_start
+                    stack.pop()
+                    if stack:
+                        stack[-1].nested += elapsed
+                    wall += elapsed
+                    self_time += elapsed - call.nested
+                count += 1
+                yield item
+        finally:
+            self.record(name, start, wall, self_time, size, count)
+
+    def finish(self):
+        '''Marks the end of the profiled builds'''
+        self.end = default_timer()
+
+    def wall_time(self):
+        return (self.end or default_timer()) - self.start
+
+    def report(self):
+        '''Returns {'name', 'wall', 'stages': {stage name: {'calls', 'wall', 'self', 'bytes', 'items'}}}'''
+        with self._lock:
+            stages = collections.OrderedDict((name, stats.as_dict()) for name, stats in self.stages.items())
+        return collections.OrderedDict([('name', self.name), ('wall', self.wall_time()), ('stages', stages)])
+
+    def summary(self):
+        '''Returns the report as a text table, stages sorted by self time'''
+        report = self.report()
+        lines = ['%s: %.1f ms' % (report['name'] or 'build', report['wall'] * 1000),
+                 '  %-16s %7s %10s %10s %10s %8s' % ('stage', 'calls', 'wall ms', 'self ms', 'bytes', 'items')]
+        for name, stats in sorted(report['stages'].items(), key=lambda item: -item[1]['self']):
+            lines.append('  %-16s %7d %10.2f %10.2f %10d %8d' % (name, stats['calls'], stats['wall'] * 1000,
+                                                                 stats['self'] * 1000, stats['bytes'], stats['items']))
+        return '\n'.join(lines)
+
+    def chrome_trace(self):
+        '''Returns the traced calls as a Chrome trace event dictionary, times in microseconds'''
+        pid = os.getpid()
+        with self._lock:
+            events = list(self.events)
+        return {
+            'displayTimeUnit': 'ms',
+            'traceEvents': [{'name': name, 'cat': 'build', 'ph': 'X', 'pid': pid, 'tid': tid,
+                             'ts': (start - self.start) * 1e6, 'dur': elapsed * 1e6,
+                             'args': {'bytes': size, 'items': items}}
+                            for name, start, elapsed, tid, size, items in events],
+        }
+
+    def save_json(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.report(), f, indent=2)
+
+    def save_chrome_trace(self, path):
+        with open(path, 'w') as f:
+            json.dump(self.chrome_trace(), f)
@@ -32,6 +32,30 @@ plantUML_jar = os.path.join('/', 'home', 'erik', '.PyCharm50',
                             'config', 'plugins', 'plantuml4idea',
                             'lib', 'plantuml.jar')
 
+# plantUML pre-processor: 'native' for PlantUML_Preprocessor, 'jar' to run plantUML_jar
+preprocessor = 'native'
+
+# lexer backend: 'line' for PlantUML_Lexer.puml_line_lexer, 'pygments' for the reference puml_state_lexer
+lexer_backend = 'line'
+
+# on unmatched input the lexer skips to the next position a rule matches at, emitting one Error token
+# per unmatched run instead of one per character
+lexer_recover = False
+
+# lex specs through a read-only memory map of the (pre-processed) file instead of reading the
+# whole text into memory, see PlantUML_Lexer.stream_tokens
+lexer_stream = False
+
+# cache of pre-processed plantUML text, keyed by content hash of each spec and its includes
+preprocess_cache = True
+cache_path = os.path.join(tools_path, 'Cache')
+cache_max_bytes = 50 * 1024 * 1024
+
+# include-dependency graph of the spec corpus, persisted between incremental rebuilds
+spec_graph_path = os.path.join(cache_path, 'spec_dependencies.json')
+# compiled diagram snapshots, see DiagramSnapshot
+snapshot_path = os.path.join(cache_path, 'Snapshots')
+
 class sys_utils:
 
     '''Aggregated system utilities for convenience'''
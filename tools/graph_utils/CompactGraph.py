@@ -0,0 +1,188 @@
+'''
+Module contains a compact, integer-indexed form of directed graphs for path solving.
+
+Nodes are numbered 0..N-1 in the order of the original graph, and the adjacency of node i is
+targets[offsets[i]:offsets[i + 1]] (compressed sparse row). Side tables map node ids back to the original
+nodes, and edge positions back to the transition stored on the edge, if any. Path algorithms on the compact
+form walk flat integer arrays instead of hashing nodes into the dict-of-dicts adjacency of networkx.
+
+The compact form is a snapshot, later changes to the original graph are not reflected.
+
+Example calling:
+==============================
+from graph_utils.CompactGraph import CompactGraph
+
+compact = CompactGraph.from_graph(diagram.flatten_graph())
+start, end = compact.node_id(start_state), compact.node_id(end_state)
+if compact.has_path(start, end):
+    paths = [compact.nodes_of(path) for path in compact.simple_paths(start, end)]
+==============================
+'''
+
+__author__ = 'ekopache'
+
+from array import array
+
+
+class CompactGraph(object):
+    '''Immutable CSR adjacency of a directed graph, with the reverse adjacency for backward searches'''
+
+    __slots__ = ('nodes', 'index', 'offsets', 'targets', 'edge_transitions', 'reverse_offsets', 'sources')
+
+    def __init__(self, nodes, offsets, targets, edge_transitions):
+        '''
+        :param nodes: tuple of original nodes, by node id
+        :param offsets: array of N + 1 offsets into targets
+        :param targets: array of the target node id of each edge
+        :param edge_transitions: tuple of the transition of each edge, None for edges without one
+        '''
+        object.__setattr__(self, 'nodes', nodes)
+        object.__setattr__(self, 'index', dict((node, i) for i, node in enumerate(nodes)))  # {node: node id}
+        object.__setattr__(self, 'offsets', offsets)
+        object.__setattr__(self, 'targets', targets)
+        object.__setattr__(self, 'edge_transitions', edge_transitions)
+        # reverse adjacency, sources[reverse_offsets[i]:reverse_offsets[i + 1]] are the predecessors of node i
+        counts = array('l', [0]) * (len(nodes) + 1)
+        for target in targets:
+            counts[target + 1] += 1
+        for i in xrange(len(nodes)):
+            counts[i + 1] += counts[i]
+        sources, filled = array('l', [0]) * len(targets), array('l', counts)
+        for source in xrange(len(nodes)):
+            for target in targets[offsets[source]:offsets[source + 1]]:
+                sources[filled[target]] = source
+                filled[target] += 1
+        object.__setattr__(self, 'reverse_offsets', counts)
+        object.__setattr__(self, 'sources', sources)
+
+    @classmethod
+    def from_graph(cls, graph, transition_key='trans'):
+        '''
+        Numbers the nodes and edges of a networkx DiGraph, keeping its adjacency order
+        :param transition_key: edge data key of the transition on each edge
+        :return: new CompactGraph
+        '''
+        nodes = tuple(graph.nodes())
+        index = dict((node, i) for i, node in enumerate(nodes))
+        offsets, targets, transitions = array('l', [0]), array('l'), list()
+        adjacency = graph.adj
+        for node in nodes:
+            for target, data in adjacency[node].items():
+                targets.append(index[target])
+                transitions.append(data.get(transition_key))
+            offsets.append(len(targets))
+        return cls(nodes, offsets, targets, tuple(transitions))
+
+    def __reduce__(self):
+        return self.__class__, (self.nodes, self.offsets, self.targets, self.edge_transitions)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('CompactGraph is immutable')
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def number_of_nodes(self):
+        return len(self.nodes)
+
+    def number_of_edges(self):
+        return len(self.targets)
+
+    def node_id(self, node):
+        '''Returns id of an original node, raises KeyError if not in the graph'''
+        return self.index[node]
+
+    def nodes_of(self, node_ids):
+        '''Returns list of the original nodes of node_ids'''
+        return [self.nodes[i] for i in node_ids]
+
+    def successors(self, node_id):
+        return self.targets[self.offsets[node_id]:self.offsets[node_id + 1]]
+
+    def predecessors(self, node_id):
+        return self.sources[self.reverse_offsets[node_id]:self.reverse_offsets[node_id + 1]]
+
+    def edges(self):
+        '''Yields (source id, target id, transition) of each edge'''
+        for source in xrange(len(self.nodes)):
+            for position in xrange(self.offsets[source], self.offsets[source + 1]):
+                yield source, self.targets[position], self.edge_transitions[position]
+
+    def has_path(self, source, target):
+        '''Returns True if target is reachable from source, searching forward from source and backward from target'''
+        if source == target:
+            return True
+        # 1 marks nodes reached forward, 2 nodes reached backward
+        reached = bytearray(len(self.nodes))
+        reached[source], reached[target] = 1, 2
+        searches = [([source], self.offsets, self.targets, 1, 2), ([target], self.reverse_offsets, self.sources, 2, 1)]
+        while searches[0][0] and searches[1][0]:
+            # expand the smaller frontier
+            searches.sort(key=lambda search: len(search[0]))
+            frontier, offsets, adjacent, mark, other = searches[0]
+            next_frontier = list()
+            for node in frontier:
+                for child in adjacent[offsets[node]:offsets[node + 1]]:
+                    if reached[child] == other:
+                        return True
+                    if not reached[child]:
+                        reached[child] = mark
+                        next_frontier.append(child)
+            searches[0] = (next_frontier, offsets, adjacent, mark, other)
+        return False
+
+    def simple_paths(self, source, target, cutoff=None):
+        '''
+        Yields each simple path from source to target as a list of node ids, depth first in adjacency order,
+        in the same order as networkx.all_simple_paths on the original graph
+        :param cutoff: maximum number of edges of a path, defaults to N - 1
+        '''
+        if cutoff is None:
+            cutoff = len(self.nodes) - 1
+        if cutoff < 1:
+            return
+        offsets, targets = self.offsets, self.targets
+        on_path = bytearray(len(self.nodes))
+        on_path[source] = 1
+        visited = [source]
+        stack = [offsets[source]]  # next edge position of each node of the path
+        while stack:
+            node = visited[-1]
+            position = stack[-1]
+            if position == offsets[node + 1]:
+                stack.pop()
+                on_path[visited.pop()] = 0
+                continue
+            stack[-1] = position + 1
+            child = targets[position]
+            if len(visited) < cutoff:
+                if child == target:
+                    yield visited + [target]
+                elif not on_path[child]:
+                    on_path[child] = 1
+                    visited.append(child)
+                    stack.append(offsets[child])
+            else:  # path at cutoff length, only an edge to target completes it
+                if target in targets[position:offsets[node + 1]]:
+                    yield visited + [target]
+                stack.pop()
+                on_path[visited.pop()] = 0
+
+    def weakly_connected_components(self):
+        '''Returns number of weakly connected components'''
+        offsets, targets, reverse_offsets, sources = self.offsets, self.targets, self.reverse_offsets, self.sources
+        reached = bytearray(len(self.nodes))
+        components = 0
+        for start in xrange(len(self.nodes)):
+            if reached[start]:
+                continue
+            components += 1
+            reached[start] = 1
+            frontier = [start]
+            for node in frontier:
+                for child in targets[offsets[node]:offsets[node + 1]] + sources[reverse_offsets[node]:
+                                                                                reverse_offsets[node + 1]]:
+                    if not reached[child]:
+                        reached[child] = 1
+                        frontier.append(child)
+        return components
@@ -1,6 +1,7 @@
 __author__ = 'erik'
 
 import networkx as nx
+from CompactGraph import CompactGraph
 
 class GraphSolver(object):
     '''
@@ -12,25 +13,39 @@ class GraphSolver(object):
     def __init__(self, original_graph):
         if isinstance(original_graph, nx.DiGraph):
             self.graph = original_graph
+            self.compact = None  # CompactGraph of self.graph, built on first use
         else:
             print "ERROR: Must pass directed graph instance as first argument"
             raise TypeError
 
-    def set_graph(self, new_graph):
+    def set_graph(self, new_graph, compact=None):
+        '''
+        :param compact: CompactGraph of new_graph if already built, ex. StateDiagram.compact_graph()
+        '''
         if not isinstance(new_graph, nx.DiGraph):
             raise TypeError
         else:
             self.graph = new_graph
+            self.compact = compact
+
+    def compact_graph(self):
+        '''Returns the CompactGraph path algorithms run on'''
+        if self.compact is None:
+            self.compact = CompactGraph.from_graph(self.graph)
+        return self.compact
 
     def check_path(self, start_node, end_node):
         '''Returns boolean value if path available between given nodes'''
-        return nx.has_path(self.graph, start_node, end_node)
+        compact = self.compact_graph()
+        return compact.has_path(compact.node_id(start_node), compact.node_id(end_node))
 
     def generate_path_lists(self, start_node, end_node):
         '''method returns a list of all simple paths
                 between start_node and end_node'''
         if start_node in self.graph and end_node in self.graph:
-            return list(nx.all_simple_paths(self.graph, start_node, end_node))
+            compact = self.compact_graph()
+            return [compact.nodes_of(path) for path in
+                    compact.simple_paths(compact.node_id(start_node), compact.node_id(end_node))]
         else:
             print "ERROR: Specified nodes: start", start_node.name, "end, ", end_node.name, "not found in graph."
             raise NameError
@@ -77,8 +92,8 @@ class GraphSolver(object):
 
         Note: v(G) is the size of the basis set of the graph - i.e. maximum number of linearly independent paths in G
         '''
-        return self.graph.number_of_edges() - self.graph.number_of_nodes() + \
-                                                nx.number_weakly_connected_components(self.graph)
+        compact = self.compact_graph()
+        return compact.number_of_edges() - compact.number_of_nodes() + compact.weakly_connected_components()
 
     def draw_graph(self, output='solver_graph.svg'):
         '''Draws the solver's current graph via pygraphviz using dot layout'''
@@ -31,6 +31,10 @@ class OPCconnect(object):
     def read(self, PV):
         return self.client.read(str(PV))
 
+    def read_many(self, PVs):
+        '''Reads several paths in one request, returning a (value, status, timestamp) tuple for each path'''
+        return [result[1:] for result in self.client.read([str(PV) for PV in PVs])]
+
     def write(self, PV, SP):
         if type(SP) in [str, unicode]:
             SP = str(SP)
@@ -57,6 +61,9 @@ class OPCdummy(object):
             dummy_val = self.path_dict[path]
         return (dummy_val, 'Dummy', time.ctime(time.time()))
 
+    def read_many(self, paths):
+        return [self.read(path) for path in paths]
+
     def write(self, path, value):
         print "Dummy write: ", path, ' as ', value
         self.path_dict[path] = value
@@ -2,3 +2,117 @@
 Test definitions for AttributeTypes.py
 '''
 
+
+__author__ = 'ekopache'
+
+import pickle
+import threading
+
+import pytest
+
+from tools.Attributes.AttributeTypes import DiscreteAttribute, GroupAttribute
+from tools.Attributes.RunContext import RunContext, RunLayout, current_context, run_slot
+
+
+class FakeConnection(object):
+    '''OPC connection answering from a dictionary of path values, counting requests'''
+
+    def __init__(self, values):
+        self.values = values
+        self.requests = list()
+
+    def read(self, path):
+        self.requests.append(path)
+        return self.values[path], 'Good', 0
+
+    def read_many(self, paths):
+        self.requests.append(tuple(paths))
+        return [(self.values[path], 'Good', 0) for path in paths]
+
+
+def test_group_attribute_batched_read():
+    members = [DiscreteAttribute('HM10%d' % i, 'ACTIVE', target_value=1) for i in range(1, 4)]
+    group = GroupAttribute(members, 'HM_LIST')
+    connection = FakeConnection(dict(('HM10%d/ACTIVE.CV' % i, 1) for i in range(1, 4)))
+    connection.values['HM102/ACTIVE.CV'] = 0
+    group.set_read_hook(connection.read)
+    group.set_batch_read_hook(connection.read_many)
+
+    # paths are recorded on the first execution, then read in one request
+    assert group.execute() is False
+    assert connection.requests == ['HM101/ACTIVE.CV', 'HM102/ACTIVE.CV', 'HM103/ACTIVE.CV']
+    connection.values['HM102/ACTIVE.CV'] = 1
+    assert group.execute() is True
+    assert connection.requests[3:] == [('HM101/ACTIVE.CV', 'HM102/ACTIVE.CV', 'HM103/ACTIVE.CV')]
+    assert group.read() == [1, 1, 1]
+
+
+def test_run_contexts_share_attributes():
+    attr = DiscreteAttribute('HM101', 'ACTIVE', target_value=1)
+    attr.set_read_hook(FakeConnection({'HM101/ACTIVE.CV': 1}).read)
+    assert attr.execute() is True and attr._complete is True and attr.exe_start is not None
+
+    # a new context starts from a clean run state, without the hooks of other runs
+    with RunContext('fresh') as context:
+        assert current_context() is context
+        assert (attr._complete, attr.exe_cnt, attr.exe_start, attr.data, attr.active) == (None, 0, None, [], False)
+        with pytest.raises(AttributeError):
+            attr.readhook
+    assert current_context() is None and attr._complete is True
+
+    # tests of one attribute run in parallel threads, each in its own context
+    results = dict()
+
+    def run(name, value):
+        with RunContext(name):
+            attr.set_read_hook(FakeConnection({'HM101/ACTIVE.CV': value}).read)
+            results[name] = [attr.execute() for _ in range(100)], attr._complete
+
+    threads = [threading.Thread(target=run, args=(name, value)) for name, value in [('on', 1), ('off', 0)]]
+    [thread.start() for thread in threads]
+    [thread.join() for thread in threads]
+    assert results == {'on': ([True] * 100, True), 'off': ([False] * 100, False)}
+
+    # run state is not pickled with the model
+    loaded = pickle.loads(pickle.dumps(attr))
+    assert 'run_slot' not in loaded.__dict__ and loaded._complete is None
+    assert run_slot(loaded)[0] is not run_slot(attr)[0]
+
+
+def test_run_layout_of_model():
+    members = [DiscreteAttribute('HM10%d' % i, 'ACTIVE', target_value=1) for i in range(1, 4)]
+    group = GroupAttribute(members, 'HM_LIST')
+    assert 'run_slot' not in group.__dict__  # constructing attributes writes no run state
+
+    # attributes of a model, and the attributes they execute, are numbered from 0
+    layout = RunLayout([group])
+    assert layout.size == 4 and sorted(run_slot(attr)[1] for attr in [group] + members) == [0, 1, 2, 3]
+    assert all(run_slot(attr)[0] is layout for attr in members)
+
+    members[0].activate()
+    with RunContext('run') as context:
+        members[1].activate()
+        assert [member.active for member in members] == [False, True, False]
+        assert all(len(column) == 4 for column in context.columns[layout].values())
+    assert [member.active for member in members] == [True, False, False]
+    assert sum(layout.columns['active']) == 1 and layout.columns['active'][run_slot(members[0])[1]] == 1
+
+
+def test_group_paths_per_context():
+    members = [DiscreteAttribute('HM10%d' % i, 'ACTIVE', target_value=1) for i in range(1, 3)]
+    group = GroupAttribute(members, 'HM_LIST')
+    RunLayout([group])
+
+    # paths recorded by one run are not shared with the model or with other runs
+    connections = dict()
+    for name in ['first', 'second']:
+        with RunContext(name):
+            connections[name] = FakeConnection({'HM101/ACTIVE.CV': 1, 'HM102/ACTIVE.CV': 1})
+            group.set_read_hook(connections[name].read)
+            group.set_batch_read_hook(connections[name].read_many)
+            assert group.paths == []
+            assert group.execute() is True and group.execute() is True
+            assert group.paths == ['HM101/ACTIVE.CV', 'HM102/ACTIVE.CV']
+    assert connections['first'].requests == connections['second'].requests == [
+        'HM101/ACTIVE.CV', 'HM102/ACTIVE.CV', ('HM101/ACTIVE.CV', 'HM102/ACTIVE.CV')]
+    assert group.paths == []
@@ -0,0 +1,77 @@
+'''
+Test definitions for DiagramSnapshot.py
+'''
+
+__author__ = 'ekopache'
+
+import pytest
+
+from tools import DiagramSnapshot, ModelBuilder, TestSolver
+from tools.Attributes import AttributeBuilder
+from tools.Attributes.AttributeParser import AttributeParser
+from tools.Attributes.AttributeTypes import InterlockAttribute
+from test_ModelBuilder import FakeConfigClient, VALVE_SPEC, attribute_positions, run_indexes
+
+
+@pytest.fixture
+def spec(tmpdir):
+    tmpdir.join('Valves.puml').write('@startuml\nClosed : Close \'CV-2\'\n@enduml\n')
+    spec = tmpdir.join('spec.puml')
+    spec.write(VALVE_SPEC.replace(u'@enduml', u'!include Valves.puml\nDrain --> Closed\n@enduml'))
+    return str(spec)
+
+
+def test_snapshot_round_trip(spec, tmpdir):
+    abuilder = AttributeBuilder.AttributeBuilder(AttributeParser(), FakeConfigClient(['CV-1', 'CV-2']))
+    diagram = ModelBuilder.build_state_diagram(spec, attribute_builder=abuilder, lazy_attributes=True)
+    path = str(tmpdir.join('snapshots', 'spec.snapshot'))
+    DiagramSnapshot.save(diagram, path, spec, abuilder)
+
+    loaded = DiagramSnapshot.load(path, spec, abuilder)
+    assert sorted(loaded.state_names) == sorted(diagram.state_names)
+    assert attribute_positions(loaded) == attribute_positions(diagram)
+    assert loaded.get_state(u'Open').parent is loaded.get_state(u'Fill')
+    assert loaded.get_state(u'Drain').attrs[0].logger.name == diagram.get_state(u'Drain').attrs[0].logger.name
+    assert run_indexes(loaded) == run_indexes(diagram) == range(loaded.run_layout.size)
+    assert loaded.run_layout is not diagram.run_layout
+
+    cases = TestSolver.TestCaseGenerator(loaded).generate_test_cases()
+    assert sorted(cases) == sorted(TestSolver.TestCaseGenerator(diagram).generate_test_cases())
+
+
+def test_stale_snapshots_rebuilt(spec, tmpdir, monkeypatch):
+    path = str(tmpdir.join('spec.snapshot'))
+    built, build_state_diagram = list(), ModelBuilder.build_state_diagram
+    monkeypatch.setattr(ModelBuilder, 'build_state_diagram',
+                        lambda *args, **kwargs: built.append(args) or build_state_diagram(*args, **kwargs))
+
+    DiagramSnapshot.load_or_build(spec, path)
+    DiagramSnapshot.load_or_build(spec, path)
+    assert len(built) == 1
+
+    # includes, build configuration and snapshot version all invalidate the snapshot
+    tmpdir.join('Valves.puml').write('@startuml\nClosed : Close \'CV-3\'\n@enduml\n')
+    assert DiagramSnapshot.load(path, spec) is None
+    DiagramSnapshot.load_or_build(spec, path)
+    assert len(built) == 2
+    assert DiagramSnapshot.load(path, spec, preprocess=False) is None
+    for setting, value in [('lexer_recover', True), ('lexer_backend', 'pygments'), ('lexer_stream', True)]:
+        with monkeypatch.context() as patch:
+            patch.setattr(DiagramSnapshot.config, setting, value)
+            assert DiagramSnapshot.load(path, spec) is None
+    assert DiagramSnapshot.load(path, spec) is not None
+    monkeypatch.setattr(DiagramSnapshot, 'SNAPSHOT_VERSION', DiagramSnapshot.SNAPSHOT_VERSION + 1)
+    assert DiagramSnapshot.load(path) is None
+
+
+def test_snapshot_keeps_attribute_methods(spec, tmpdir):
+    diagram = ModelBuilder.build_state_diagram(spec)
+    interlock = InterlockAttribute('CV-1', test_param='reset')
+    interlock.callback = FakeConfigClient(['CV-1']).get_module_info  # not part of the model, dropped
+    diagram.get_state(u'Drain').attrs.append(interlock)
+    path = str(tmpdir.join('spec.snapshot'))
+    DiagramSnapshot.save(diagram, path, spec)
+
+    loaded = DiagramSnapshot.load(path, spec).get_state(u'Drain').attrs[-1]
+    assert loaded._default_test.__name__ == 'test_reset' and loaded._default_test.im_self is loaded
+    assert loaded.callback is None
@@ -0,0 +1,441 @@
+'''
+Test definitions for ModelBuilder.py
+'''
+
+__author__ = 'ekopache'
+
+import pytest
+
+from tools import ModelBuilder, PlantUML_Lexer
+from tools.Attributes import AttributeBuilder
+from tools.Attributes.AttributeParser import AttributeParser
+from tools.Attributes import AttributePreprocessor
+from tools.Attributes.DVConfigClient import DVConfigClient
+from tools.Attributes.RunContext import run_slot
+
+SPEC = u'''@startuml
+[*] --> Fill
+state Fill {
+  [*] --> Open
+  Open : Open VLV
+  Open --> [*]
+}
+Fill --> Done : Level > 50
+@enduml
+'''
+
+
+def tokens(text):
+    return PlantUML_Lexer.lex(text, PlantUML_Lexer.get_lexer())
+
+
+def run_indexes(diagram):
+    '''Returns sorted run indexes of the attributes of diagram and of the attributes they execute'''
+    attributes = [attr for owner in diagram.attribute_owners() for attr in owner.attrs]
+    seen = dict()
+    while attributes:
+        attr = attributes.pop()
+        if id(attr) not in seen and hasattr(type(attr), 'run_attributes'):
+            layout, seen[id(attr)] = run_slot(attr)
+            assert layout is diagram.run_layout
+            attributes.extend(attr.run_attributes())
+    return sorted(seen.values())
+
+
+def describe(event):
+    value = event.value if event.value is None else unicode(event.value)
+    if event.name == ModelBuilder.TRANSITION_ADDED:
+        return event.name, (event.target.source[0].name, event.target.dest[0].name), value
+    return event.name, getattr(event.target, 'name', None), value
+
+
+def test_events_in_spec_order():
+    builder = ModelBuilder.StateModelBuilder()
+    events = [describe(event) for event in builder.iter_events(tokens(SPEC))]
+    assert events == [
+        ('state_added', u'START', None),
+        ('state_added', u'Fill', None),
+        ('transition_added', (u'START', u'Fill'), None),
+        ('state_added', u'START Fill', None),
+        ('state_added', u'Open', None),
+        ('transition_added', (u'START Fill', u'Open'), None),
+        ('attribute_attached', u'Open', u'Open VLV'),
+        ('state_added', u'END Fill', None),
+        ('transition_added', (u'Open', u'END Fill'), None),
+        ('superstate_closed', u'Fill', None),
+        ('state_added', u'Done', None),
+        ('transition_added', (u'Fill', u'Done'), None),
+        ('attribute_attached', None, u'Level > 50'),
+    ]
+    assert sorted(builder.model.state_names) == sorted(name for event, name, value in events if event == 'state_added')
+
+
+def test_events_overlap_parsing():
+    consumed = list()
+
+    def token_stream():
+        for item in tokens(SPEC):
+            consumed.append(item)
+            yield item
+
+    builder = ModelBuilder.StateModelBuilder()
+    first = next(builder.iter_events(token_stream()))
+    assert first.name == ModelBuilder.STATE_ADDED
+    assert len(consumed) < len(list(tokens(SPEC)))
+
+
+def test_subscribers_and_parse():
+    builder = ModelBuilder.StateModelBuilder()
+    closed, received = list(), list()
+    builder.subscribe(ModelBuilder.SUPERSTATE_CLOSED, lambda event: closed.append(event.target.name))
+    builder.subscribe(None, received.append)
+    diagram = builder.parse(tokens(SPEC))
+
+    assert closed == [u'Fill']
+    assert len(received) == 13 and not builder.events
+    assert len(diagram.get_transitions()) == 4
+
+    # builders are independent of each other
+    other = ModelBuilder.StateModelBuilder().parse(tokens(u'@startuml\nA --> B\n@enduml\n'))
+    assert sorted(other.state_names) == [u'A', u'B']
+    assert sorted(diagram.state_names) == [u'Done', u'END Fill', u'Fill', u'Open', u'START', u'START Fill']
+
+
+class FakeConfigClient(DVConfigClient):
+    '''DVConfigClient answering from a dictionary of discrete valve modules, counting requests'''
+
+    def __init__(self, tags, aliases=None):
+        self._address, self._port = 'localhost', 0
+        self.tags = tags
+        self.aliases = aliases or dict()  # {unit tag: {alias: tag}}
+        self.requests = list()
+
+    def connect(self):
+        pass
+
+    def get_module_info(self, tag):
+        self.requests.append(('get_module_info', tag))
+        return {'attribute_paths': ['//%s/PV_D' % tag, '//%s/OPEN' % tag] if tag in self.tags else []}
+
+    def get_aliases(self, tag, aliases):
+        self.requests.append(('get_aliases', tag, tuple(aliases)))
+        return {'alias_values': [(alias, self.aliases.get(tag, {}).get(alias)) for alias in aliases]}
+
+    def get_config_values(self, list_of_paths):
+        self.requests.append(('get_config_values', tuple(list_of_paths)))
+        return {'path_values': [(path, 1 if path.endswith('OPEN') else 0) for path in list_of_paths]}
+
+
+VALVE_SPEC = u'''@startuml
+[*] --> Fill
+state Fill {
+  [*] --> Open
+  Open : Open 'CV-1'
+  Open --> Closed : Close 'CV-2'
+  Closed : Close 'CV-1'
+}
+Fill --> Drain
+Drain : Close 'CV-1'
+Drain : Open 'CV-2'
+@enduml
+'''
+
+
+def attribute_positions(diagram):
+    states = dict((name, [(a.tag, a.target_value) for a in state.attrs]) for name, state in diagram.state_names.items()
+                  if state.attrs)
+    transitions = [[(a.tag, a.target_value) for a in t.attrs] for t in diagram.get_transitions() if t.attrs]
+    return states, transitions
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_bulk_attributes(bulk):
+    client = FakeConfigClient(['CV-1', 'CV-2'])
+    builder = ModelBuilder.StateModelBuilder(attribute_builder=AttributeBuilder.AttributeBuilder(AttributeParser(), client),
+                                             bulk_attributes=bulk)
+    diagram = builder.parse(tokens(VALVE_SPEC))
+
+    states, transitions = attribute_positions(diagram)
+    assert states == {u'Open': [(u'CV-1', 1)], u'Closed': [(u'CV-1', 0)], u'Drain': [(u'CV-1', 0), (u'CV-2', 1)]}
+    assert transitions == [[(u'CV-2', 0)]]
+    # transitions in superstates hold the same solved attribute as the top level transition
+    nested, = [t.attrs for t in diagram.get_state(u'Fill').substates.transitions if t.attrs]
+    assert nested == [t.attrs for t in diagram.get_transitions() if t.attrs][0]
+
+    # each tag is looked up once, target values of all tags in one request in bulk mode
+    assert sorted(r for r in client.requests if r[0] == 'get_module_info') == [('get_module_info', u'CV-1'),
+                                                                               ('get_module_info', u'CV-2')]
+    config_requests = [r for r in client.requests if r[0] == 'get_config_values']
+    assert len(config_requests) == (1 if bulk else 2)
+
+    # occurrences of the same string have their own instances
+    attrs = [a for state in diagram.state_names.values() for a in state.attrs]
+    assert len(set(id(a) for a in attrs)) == len(attrs) == 4
+
+
+def test_solve_attributes_parses_each_string_once():
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), FakeConfigClient(['CV-1', 'CV-2']))
+    parsed = list()
+    parse = attribute_builder.parser.parse
+    attribute_builder.parser.parse = lambda raw_string: parsed.append(raw_string) or parse(raw_string)
+    raw_strings = [u"Close 'CV-1'", u"Open 'CV-2'", u"Close 'CV-1'", u"Close 'CV-1'"]
+    attrs = attribute_builder.solve_attributes(raw_strings)
+    assert sorted(parsed) == [u"Close 'CV-1'", u"Open 'CV-2'"]
+    assert [(a.tag, a.target_value) for a in attrs] == [(u'CV-1', 0), (u'CV-2', 1), (u'CV-1', 0), (u'CV-1', 0)]
+    assert len(set(id(a) for a in attrs)) == 4
+
+
+def test_lazy_attributes():
+    client = FakeConfigClient(['CV-1', 'CV-2'])
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), client)
+    diagram = ModelBuilder.StateModelBuilder(attribute_builder=attribute_builder, lazy_attributes=True).parse(
+        tokens(VALVE_SPEC))
+
+    # building costs parsing only
+    assert client.requests == []
+    drain = diagram.get_state(u'Drain')
+    assert [type(a) for a in drain.attrs] == [AttributeBuilder.LazyAttribute] * 2
+
+    # resolved on first use, placeholders are replaced by the solved instances
+    assert [(a.tag, a.target_value) for a in diagram.collect_attributes()[u'Drain']] == [(u'CV-1', 0), (u'CV-2', 1)]
+    assert all(isinstance(a, AttributeBuilder.AttributeBase) for a in drain.attrs)
+    assert len(client.requests) == 4
+
+    transition, = [t for t in diagram.get_transitions() if t.attrs]
+    assert transition.attrs[0].target_value == 0  # attribute access resolves the placeholder too
+    assert isinstance(transition.resolve_attributes()[0], AttributeBuilder.AttributeBase)
+
+
+def test_lazy_attribute_resolved_once():
+    import threading, time
+
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), FakeConfigClient(['CV-1']))
+    solved = list()
+
+    def solve_attribute(raw_string):
+        time.sleep(0.01)  # widen the window for concurrent resolution
+        solved.append(raw_string)
+        return AttributeBuilder.AttributeBuilder.solve_attribute(attribute_builder, raw_string)
+
+    attribute_builder.solve_attribute = solve_attribute
+    lazy = attribute_builder.lazy_attribute(u"Open 'CV-1'")
+    results = list()
+    threads = [threading.Thread(target=lambda: results.append(lazy.resolve())) for i in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert solved == [u"Open 'CV-1'"]
+    assert len(results) == 8 and all(result is results[0] for result in results)
+
+
+def test_concurrent_module_info():
+    import threading, time
+
+    tags = ['CV-%d' % i for i in range(1, 9)]
+    spec = u'@startuml\n[*] --> A\n' + u''.join(u"A : Open '%s'\n" % tag for tag in tags) + u'@enduml\n'
+    clients, active, peak = list(), [0], [0]
+    lock = threading.Lock()
+
+    class SlowConfigClient(FakeConfigClient):
+        def get_module_info(self, tag):
+            with lock:
+                active[0] += 1
+                peak[0] = max(peak[0], active[0])
+            time.sleep(0.02)  # server round trip
+            with lock:
+                active[0] -= 1
+            return FakeConfigClient.get_module_info(self, tag)
+
+    def client_factory():
+        clients.append(SlowConfigClient(tags))
+        return clients[-1]
+
+    def solve(workers):
+        attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), FakeConfigClient(tags), workers=workers,
+                                                              client_factory=client_factory)
+        diagram = ModelBuilder.StateModelBuilder(attribute_builder=attribute_builder, bulk_attributes=True).parse(
+            tokens(spec))
+        return attribute_positions(diagram), attribute_builder
+
+    serial, serial_builder = solve(1)
+    concurrent, concurrent_builder = solve(4)
+    assert concurrent == serial
+    assert [tag for tag, value in concurrent[0][u'A']] == tags
+
+    # one connection per worker, every tag fetched once across the workers
+    assert len(clients) == 4 and peak[0] > 1
+    assert sorted(r[1] for client in clients for r in client.requests) == tags
+    assert concurrent_builder.client.requests == [r for r in serial_builder.client.requests
+                                                  if r[0] == 'get_config_values']
+
+
+def test_build_profile(tmpdir):
+    import json
+
+    spec = tmpdir.join('valves.puml')
+    spec.write(VALVE_SPEC.encode('utf-8'))
+    client = FakeConfigClient(['CV-1', 'CV-2'])
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), client)
+    diagram = ModelBuilder.build_state_diagram(str(spec), attribute_builder=attribute_builder, bulk_attributes=True,
+                                               profile=True)
+
+    report = json.loads(json.dumps(diagram.profile.report()))
+    stages = report['stages']
+    assert report['name'] == 'valves.puml'
+    assert sorted(stages) == ['attribute_parse', 'attribute_solve', 'build_state_diagram', 'dvconfig', 'lex',
+                              'model_parse', 'preprocess']
+    assert stages['lex']['items'] == len(list(PlantUML_Lexer.get_tokens_from_file(str(spec), preprocess=True)))
+    assert stages['preprocess']['bytes'] > 0 and stages['attribute_solve']['calls'] == 5
+    assert stages['dvconfig']['calls'] == len(client.requests) == 3
+    # self times of the stages add up to the wall time of the build
+    total = stages['build_state_diagram']['wall']
+    assert abs(sum(stage['self'] for stage in stages.values()) - total) < total * 1e-6
+    assert all(0 <= stage['self'] <= stage['wall'] for stage in stages.values())
+
+    events = diagram.profile.chrome_trace()['traceEvents']
+    build, = [event for event in events if event['name'] == 'build_state_diagram']
+    assert all(build['ts'] <= event['ts'] and event['ts'] + event['dur'] <= build['ts'] + build['dur']
+               for event in events)
+    assert 'lex' not in set(event['name'] for event in events)
+
+    # profiling is limited to the build
+    assert attribute_builder.profile is None and attribute_builder.parser.profile is None
+    assert ModelBuilder.build_state_diagram(str(spec)).profile is None
+
+
+def test_resolve_aliases(tmpdir):
+    spec = tmpdir.join('PH_FILL.puml')
+    spec.write(u"""@startuml
+title R2
+[*] --> Fill
+Fill : Open '#INLET_VLV#'
+Fill --> Drain : Close '#INLET_VLV#'
+Drain : Open '#DRAIN_VLV#'
+Drain : Close '#VENT_VLV#'
+@enduml
+""")
+    client = FakeConfigClient(['CV-1', 'CV-2'], aliases={u'R2': {u'INLET_VLV': u'CV-1', u'DRAIN_VLV': u'CV-2'}})
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), client)
+    diagram = ModelBuilder.build_state_diagram(str(spec), attribute_builder=attribute_builder, bulk_attributes=True,
+                                               resolve_aliases=True)
+
+    # all aliases of the unit in one request, undefined aliases are left in place
+    assert [r for r in client.requests if r[0] == 'get_aliases'] == [
+        ('get_aliases', u'R2', (u'DRAIN_VLV', u'INLET_VLV', u'VENT_VLV'))]
+    assert [(a.tag, a.target_value) for a in diagram.get_state(u'Fill').attrs] == [(u'CV-1', 1)]
+    assert [a.tag for a in diagram.get_state(u'Drain').attrs[:1]] == [u'CV-2']
+    assert [(a.tag, a.target_value) for t in diagram.get_transitions() for a in t.attrs] == [(u'CV-1', 0)]
+
+    # aliases are cached by the attribute builder
+    ModelBuilder.build_state_diagram(str(spec), attribute_builder=attribute_builder, resolve_aliases=True)
+    assert len([r for r in client.requests if r[0] == 'get_aliases']) == 1
+
+    # streamed tokens are substituted as they stream, titles keep their leading T
+    spec.write(spec.read().replace(u'title R2', u'title TK_15_EM'))
+    client.aliases[u'TK_15_EM'] = {u'INLET_VLV': u'CV-2'}
+    diagram = ModelBuilder.build_state_diagram(str(spec), attribute_builder=attribute_builder, stream=True,
+                                               resolve_aliases=True)
+    assert client.requests[-1] == ('get_aliases', u'TK_15_EM', (u'DRAIN_VLV', u'INLET_VLV', u'VENT_VLV'))
+    assert diagram.id == u'TK_15_EM'
+    assert [a.tag for a in diagram.get_state(u'Fill').attrs] == [u'CV-2']
+
+
+class SingleAliasServerClient(DVConfigClient):
+    '''DVConfigClient of a server answering get_alias only, recording the methods requested'''
+
+    def __init__(self, aliases):
+        self._address, self._port = 'localhost', 0
+        self.aliases = aliases  # {alias: tag}
+        self.methods = list()
+        self.request = None
+
+    def send_obj(self, obj):
+        self.methods.append(obj['method'])
+        self.request = obj
+
+    def read_obj(self):
+        if self.request['method'] != 'get_alias':
+            return {'error': 'Unknown method ' + self.request['method']}
+        return {'alias_value': self.aliases.get(self.request['reference_id'])}
+
+
+def test_aliases_without_batch_method():
+    client = SingleAliasServerClient({u'INLET_VLV': u'CV-1'})
+    assert client.get_aliases(u'R2', [u'INLET_VLV', u'VENT_VLV']) == {
+        'alias_values': [(u'INLET_VLV', u'CV-1'), (u'VENT_VLV', None)]}
+    assert client.get_aliases(u'R2', [u'INLET_VLV']) == {'alias_values': [(u'INLET_VLV', u'CV-1')]}
+    # the batch method is not requested again once the server did not answer it
+    assert client.methods == ['get_aliases', 'get_alias', 'get_alias', 'get_alias']
+    with pytest.raises(TypeError):
+        client.get_aliases(u'R2', u'INLET_VLV')
+
+
+def test_list_comprehension():
+    spec = u'''@startuml
+[*] --> Acquire
+Acquire : VLV_LIST = ['CV-1', CV-2]
+Acquire --> Fill : [Close VLV for VLV in VLV_LIST]
+Fill : [Open VLVx for VLV in ['CV-2', 'CV-1']]
+@enduml
+'''
+    client = FakeConfigClient(['CV-1', 'CV-2'])
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), client)
+    diagram = ModelBuilder.StateModelBuilder(attribute_builder=attribute_builder, bulk_attributes=True).parse(
+        tokens(spec))
+
+    assert attribute_builder.lists == {u'VLV_LIST': [u'CV-1', u'CV-2']}
+    assert isinstance(diagram.get_state(u'Acquire').attrs[0], AttributeBuilder.AttributeDummy)
+    close, = [t.attrs[0] for t in diagram.get_transitions() if t.attrs]
+    fill, = diagram.get_state(u'Fill').attrs
+    assert isinstance(close, AttributeBuilder.GroupAttribute) and close.tag == u'VLV_LIST'
+    assert [(a.tag, a.target_value) for a in close.members] == [(u'CV-1', 0), (u'CV-2', 0)]
+    assert [(a.tag, a.target_value) for a in fill.members] == [(u'CV-2', 1), (u'CV-1', 1)]
+    # run state of the attributes, group members included, is numbered per diagram
+    assert run_indexes(diagram) == range(diagram.run_layout.size) and diagram.run_layout.size >= 7
+
+
+def test_expand_member():
+    expand = AttributePreprocessor.expand_member
+    assert expand('HMxxx/ACTIVE = 1', 'HM', 'HM101') == "'HM101/ACTIVE' = 1"
+    assert expand("'HMxxx/ACTIVE.CV' = 1", 'HM', 'HM101') == "'HM101/ACTIVE.CV' = 1"
+    assert expand('Close VLV', 'VLV', 'CV-1') == "Close 'CV-1'"
+    assert expand('HMxxx ACTIVE', 'HM', 'HM101') == "'HM101' ACTIVE"
+    assert AttributePreprocessor.state_check("'HM101' ACTIVE") == "'HM101/ACTIVE' = TRUE"
+    assert AttributePreprocessor.state_check("Close 'CV-1'") is None
+
+
+@pytest.mark.parametrize('mode', ['lazy_attributes', 'bulk_attributes'])
+def test_list_comprehension_of_tag_parameters(mode):
+    # comprehensions of PH_AL_A165.puml, with their lists defined after use
+    spec = u'''@startuml
+[*] --> Charge
+Charge : [HMxxx ACTIVE for HM in HM_LIST]
+Charge : [SMxxx ACTIVE for SM in SM_LIST]
+Charge --> Done : [HMxxx/ACTIVE = 0 for HM in HM_LIST]
+Done : HM_LIST = [HM101, HM102]
+Done : SM_LIST = ['SM101']
+@enduml
+'''
+    client = FakeConfigClient(['HM101', 'HM102', 'SM101'])
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), client)
+    diagram = ModelBuilder.StateModelBuilder(attribute_builder=attribute_builder, **{mode: True}).parse(tokens(spec))
+    # another diagram defining the same list name does not change the lists of the first one
+    ModelBuilder.StateModelBuilder(attribute_builder=attribute_builder).parse(
+        tokens(u"@startuml\nA : HM_LIST = ['HM102']\n@enduml\n"))
+
+    charge = diagram.get_state(u'Charge').resolve_attributes()
+    transition, = [t for t in diagram.get_transitions() if t.attrs]
+    hm_active, sm_active = charge
+    hm_stopped, = transition.resolve_attributes()
+    assert diagram.lists == {u'HM_LIST': [u'HM101', u'HM102'], u'SM_LIST': [u'SM101']}
+    assert [type(group) for group in [hm_active, sm_active, hm_stopped]] == [AttributeBuilder.GroupAttribute] * 3
+    assert [m.lhs.OPC_path() for m in hm_active.members] == [u'HM101/ACTIVE', u'HM102/ACTIVE']
+    assert [m.lhs.OPC_path() for m in sm_active.members] == [u'SM101/ACTIVE']
+    assert [(m.lhs.OPC_path(), m.rhs.val) for m in hm_stopped.members] == [(u'HM101/ACTIVE', 0.0),
+                                                                            (u'HM102/ACTIVE', 0.0)]
+
+    values = {'HM101/ACTIVE.CV': 1, 'HM102/ACTIVE.CV': 1}
+    hm_active.set_read_hook(lambda path: (values[path], 'Good', 0))
+    assert hm_active.execute() is True
@@ -0,0 +1,236 @@
+'''
+Test definitions for PlantUML_Lexer.py
+'''
+
+__author__ = 'ekopache'
+
+import os
+import re
+import timeit
+import weakref
+import pytest
+
+from tools import config, PlantUML_Lexer, PlantUML_Fuzz
+
+
+def spec_files():
+    return sorted(os.path.join(root, f) for root, dirs, files in os.walk(config.specs_path)
+                  for f in files if f.endswith('.puml'))
+
+
+def spec_texts(file_path):
+    '''Raw and pre-processed text of a spec'''
+    with open(file_path) as f:
+        texts = [f.read()]
+    try:
+        texts.append(PlantUML_Lexer.PlantUML_Preprocessor.preprocess_file(file_path))
+    except IOError:
+        pass
+    return texts
+
+
+@pytest.mark.parametrize('file_path', spec_files())
+def test_line_lexer_matches_reference(file_path):
+    for text in spec_texts(file_path):
+        reference = list(PlantUML_Lexer.puml_state_lexer().get_tokens_unprocessed(text))
+        line = list(PlantUML_Lexer.puml_line_lexer().get_tokens_unprocessed(text))
+        assert line == reference
+
+
+@pytest.fixture(scope='module')
+def profiled_rules():
+    profile = PlantUML_Lexer.profile_specs(spec_files(), preprocess=False)
+    return profile, PlantUML_Lexer.reorder_rules(profile)
+
+
+def test_rule_profile(profiled_rules):
+    profile, rule_table = profiled_rules
+    report = profile.report()
+    assert len(report) == sum(len(rules) for rules in PlantUML_Lexer.puml_state_lexer._tokens.values())
+    assert all(0 <= r['hits'] <= r['attempts'] for r in report)
+    assert sum(r['hits'] for r in report) > 0
+
+
+@pytest.mark.parametrize('backend', ['pygments', 'line'])
+def test_reordered_rules_match_reference(profiled_rules, backend):
+    profile, rule_table = profiled_rules
+    for state, rules in PlantUML_Lexer.puml_state_lexer._tokens.items():
+        assert sorted(rule_table[state]) == sorted(rules)
+    for file_path in spec_files():
+        for text in spec_texts(file_path):
+            reference = list(PlantUML_Lexer.puml_state_lexer().get_tokens_unprocessed(text))
+            lexer = PlantUML_Lexer.get_lexer(backend, rule_table=rule_table)
+            assert list(lexer.get_tokens_unprocessed(text)) == reference
+
+
+def test_rule_classes_follow_table(profiled_rules):
+    profile, rule_table = profiled_rules
+    # tables discarded between lexers must not lend their classification to a later table
+    for i in range(20):
+        table = dict((state, list(reversed(rules)) if i % 2 else list(rules)) for state, rules in rule_table.items())
+        lexer = PlantUML_Lexer.puml_line_lexer(rule_table=table)
+        for state, rules in table.items():
+            assert [rule_class[0] for rule_class in lexer.rule_classes[state]] == rules
+        del table, lexer
+
+    # reordered tables hold their classification, released with the table
+    assert isinstance(rule_table, PlantUML_Lexer.RuleTable)
+    table = PlantUML_Lexer.RuleTable((state, list(reversed(rules))) for state, rules in rule_table.items())
+    lexers = [PlantUML_Lexer.puml_line_lexer(rule_table=table) for i in range(2)]
+    assert lexers[0].rule_classes is lexers[1].rule_classes is table.rule_classes
+    table_ref = weakref.ref(table)
+    del table, lexers
+    assert table_ref() is None
+
+
+def test_classify_rule_non_ascii():
+    anchored, first, ws_only = PlantUML_Lexer.classify_rule(re.compile(u'^[\xb0-\xff]C', re.U))
+    assert anchored and first == frozenset([PlantUML_Lexer.NONASCII]) and not ws_only
+    anchored, first, ws_only = PlantUML_Lexer.classify_rule(re.compile(r'\w+', re.U))
+    assert PlantUML_Lexer.NONASCII in first
+
+
+def test_classify_rule():
+    rules = dict((rule[0].__self__.pattern, PlantUML_Lexer.classify_rule(rule[0].__self__))
+                 for rule in PlantUML_Lexer.puml_state_lexer._tokens['root'])
+
+    anchored, first, ws_only = rules[r'(?i)^title$']
+    assert anchored and first == frozenset('tT') and not ws_only
+    anchored, first, ws_only = rules[r'\n']
+    assert not anchored and ws_only
+
+
+def test_get_lexer():
+    assert type(PlantUML_Lexer.get_lexer('pygments')) is PlantUML_Lexer.puml_state_lexer
+    assert type(PlantUML_Lexer.get_lexer('line')) is PlantUML_Lexer.puml_line_lexer
+    with pytest.raises(NameError):
+        PlantUML_Lexer.get_lexer('other')
+
+
+def merged_errors(tokens):
+    '''Returns (token, value) of tokens, with consecutive Error tokens merged into one'''
+    merged = list()
+    for pos, token, value in tokens:
+        if token is PlantUML_Lexer.Error and merged and merged[-1][0] is PlantUML_Lexer.Error:
+            merged[-1] = (token, merged[-1][1] + value)
+        else:
+            merged.append((token, unicode(value)))
+    return merged
+
+
+@pytest.mark.parametrize('backend', ['pygments', 'line'])
+def test_error_recovery(backend):
+    text = (u'@startuml\n[*] --> A\n  ???? bad line\nA --> B\n?\n'
+            u'state S {\n  state T as "T x" {\n    T : Close V\n    }\n  T --> A\n}\n@enduml\n')
+
+    lexer = PlantUML_Lexer.get_lexer(backend, recover=True)
+    tokens = list(lexer.get_tokens_unprocessed(text))
+    errors = [(value, value.line) for pos, token, value in tokens if token is PlantUML_Lexer.Error]
+    assert errors[:2] == [(u'  ???? bad line', 3), (u'?', 5)]
+    # only the unmatched run is skipped: the indented } closes the superstate, A follows the leading whitespace
+    assert (u'    ', 9) in errors
+    assert [value for pos, token, value in tokens if token is PlantUML_Lexer.SEND] == [u'}', u'}']
+    assert [(token, value) for pos, token, value in tokens if token in (PlantUML_Lexer.TSOURCE, PlantUML_Lexer.TDEST)
+            ][-2:] == [(PlantUML_Lexer.TSOURCE, u'T'), (PlantUML_Lexer.TDEST, u'A')]
+    assert [(d.line, d.column) for d in lexer.diagnostics][:3] == [(3, 0), (5, 0), (9, 0)]
+
+    # one Error token per character without recovery, the same tokens otherwise
+    lexer = PlantUML_Lexer.get_lexer(backend, recover=False)
+    plain = list(lexer.get_tokens_unprocessed(text))
+    assert len([token for pos, token, value in plain if token is PlantUML_Lexer.Error]) > len(errors)
+    assert merged_errors(plain) == merged_errors(tokens)
+    assert lexer.diagnostics == []
+
+
+@pytest.mark.parametrize('file_path', spec_files())
+def test_error_recovery_keeps_spec_tokens(file_path):
+    with open(file_path) as f:
+        text = f.read().decode('utf-8')
+    recovered = PlantUML_Lexer.get_lexer(recover=True).get_tokens_unprocessed(text)
+    plain = PlantUML_Lexer.get_lexer(recover=False).get_tokens_unprocessed(text)
+    assert merged_errors(recovered) == merged_errors(plain)
+
+
+# timing tests depend on the speed and load of the machine, run with PUML_BENCHMARK=1
+benchmark = pytest.mark.skipif(not os.environ.get('PUML_BENCHMARK'), reason='benchmark, set PUML_BENCHMARK=1')
+
+
+@benchmark
+def test_no_super_linear_rules():
+    assert [(o['state'], o['index'], o['line']) for o in PlantUML_Fuzz.rule_growth()] == []
+
+
+@pytest.mark.parametrize('backend', ['pygments', 'line'])
+def test_adversarial_spec_bounded(backend):
+    (short_size, short_attempts), (long_size, long_attempts) = PlantUML_Fuzz.lexing_attempts(
+        [50 * 1024, 100 * 1024], backend)
+    assert long_attempts < 2.2 * short_attempts
+
+
+@benchmark
+@pytest.mark.parametrize('backend', ['pygments', 'line'])
+def test_adversarial_spec_time_bounded(backend):
+    (short_size, short_time), (long_size, long_time) = PlantUML_Fuzz.lexing_growth([50 * 1024, 100 * 1024], backend)
+    assert long_time < 5.0
+    assert long_time < 4 * short_time + 0.05
+
+
+def whitespace_runs(n):
+    return u'@startuml\nstate S1' + u' ' * n + u'x\nS1' + u' ' * n + u'-' + u' ' * n + u'x\n@enduml\n'
+
+
+def test_long_whitespace_runs():
+    # exponential in the number of spaces before the state rules were hardened
+    text = whitespace_runs(5000)
+    tokens = list(PlantUML_Lexer.get_lexer().get_tokens_unprocessed(text))
+    assert u''.join(value for pos, token, value in tokens) == text
+    assert PlantUML_Fuzz.count_attempts(whitespace_runs(10000)) < 2.1 * PlantUML_Fuzz.count_attempts(text)
+
+
+@benchmark
+def test_long_whitespace_runs_time():
+    text = whitespace_runs(5000)
+    start = timeit.default_timer()
+    for item in PlantUML_Lexer.get_lexer().get_tokens_unprocessed(text):
+        pass
+    assert timeit.default_timer() - start < 1.0
+
+
+@pytest.mark.parametrize('file_path', spec_files())
+def test_stream_matches_lex(file_path):
+    with open(file_path) as f:
+        reference = [(token, value) for token, value in PlantUML_Lexer.lex(f.read(), PlantUML_Lexer.get_lexer())
+                     if token is not PlantUML_Lexer.Text]
+    streamed = [(token, value) for token, value, line in PlantUML_Lexer.stream_tokens(file_path)
+                if token is not PlantUML_Lexer.Text]
+    assert streamed == reference
+
+
+def test_stream_line_numbers(tmpdir, monkeypatch):
+    spec = tmpdir.join('spec.puml')
+    spec.write_binary('@startuml\r\n[*] --> A\r\n\r\nA : Set \xc3\xa9 = 1\r\n?? bad\r\n@enduml\r\n')
+
+    monkeypatch.setattr(config, 'lexer_recover', True)
+    diagnostics = list()
+    tokens = PlantUML_Lexer.get_tokens_from_file(str(spec), diagnostics=diagnostics, stream=True)
+    # tokens are generated as the file is lexed, the bad line has not been reached yet
+    assert next(tokens)[2] == 1 and diagnostics == []
+
+    tokens = [(value, line) for token, value, line in tokens if token is not PlantUML_Lexer.Text]
+    assert tokens == [(u'[*]', 2), (u'A', 2), (u'A', 4), (u'Set \xe9 = 1', 4), (u'?? bad', 5)]
+    assert [d.line for d in diagnostics] == [5]
+
+
+@pytest.mark.parametrize('use_cache', [True, False])
+def test_stream_preprocessed(tmpdir, monkeypatch, use_cache):
+    monkeypatch.setattr(config, 'cache_path', str(tmpdir.join('cache')))
+    monkeypatch.setattr(config, 'preprocess_cache', use_cache)
+    monkeypatch.setattr(PlantUML_Lexer.tempfile, 'tempdir', str(tmpdir.mkdir('tmp')))
+    spec = tmpdir.join('spec.puml')
+    spec.write('@startuml\n!define VLV CV-1\nA : Open VLV\n@enduml\n')
+
+    tokens = [(value, line) for token, value, line in
+              PlantUML_Lexer.get_tokens_from_file(str(spec), preprocess=True, stream=True)
+              if token is not PlantUML_Lexer.Text]
+    assert (u'Open CV-1', 2) in tokens
+    assert tmpdir.join('tmp').listdir() == []
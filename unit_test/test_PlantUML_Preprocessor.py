@@ -0,0 +1,160 @@
+'''
+Test definitions for PlantUML_Preprocessor.py
+'''
+
+__author__ = 'ekopache'
+
+import os
+import pytest
+
+from tools import config, PlantUML_Preprocessor
+from tools.Utilities.ContentCache import ContentCache
+
+
+def write_spec(tmpdir, name, text):
+    spec = tmpdir.join(name)
+    spec.write(text, ensure=True)
+    return str(spec)
+
+
+def test_include_strips_startuml(tmpdir):
+    write_spec(tmpdir, 'Procedures/Acquire.puml', '@startuml\nAcquire --> Done\n@enduml\n')
+    root = write_spec(tmpdir, 'root.puml', '@startuml\n[*] --> Acquire\n  !include Procedures/Acquire.puml\n@enduml\n')
+
+    text = PlantUML_Preprocessor.preprocess_file(root)
+    assert text == '@startuml\n[*] --> Acquire\nAcquire --> Done\n@enduml\n'
+
+
+def test_include_once(tmpdir):
+    write_spec(tmpdir, 'defs.puml', '@startuml\n!define VLV CV-1\n@enduml\n')
+    root = write_spec(tmpdir, 'root.puml', '@startuml\n!include defs.puml\n!include defs.puml\nA: Open VLV\n@enduml\n')
+
+    preprocessor = PlantUML_Preprocessor.PumlPreprocessor()
+    assert preprocessor.process_file(root) == '@startuml\nA: Open CV-1\n@enduml\n'
+    assert preprocessor.included == [str(tmpdir.join('defs.puml'))] * 2
+
+    # !include and !include_once drop files already included, !include_many includes them again
+    write_spec(tmpdir, 'step.puml', 'A --> B\n')
+    root = write_spec(tmpdir, 'root.puml', '@startuml\n!include step.puml\n!include_once step.puml\n'
+                                           '!include_many step.puml\n@enduml\n')
+    assert PlantUML_Preprocessor.preprocess_file(root) == '@startuml\nA --> B\nA --> B\n@enduml\n'
+
+
+def test_missing_include(tmpdir):
+    root = write_spec(tmpdir, 'root.puml', '@startuml\n!include missing.puml\n@enduml\n')
+    with pytest.raises(IOError) as error:
+        PlantUML_Preprocessor.preprocess_file(root)
+    assert str(error.value).startswith('Cannot include missing.puml from ')
+
+
+def test_text_outside_block_ignored(tmpdir):
+    root = write_spec(tmpdir, 'root.puml', 'Use !include <path>\n@startuml\nA --> B\n@enduml\ntrailing\n')
+    assert PlantUML_Preprocessor.preprocess_file(root) == '@startuml\nA --> B\n@enduml\n'
+
+
+def test_define_values_expand_earlier_definitions(tmpdir):
+    root = write_spec(tmpdir, 'root.puml', '\n'.join([
+        '@startuml',
+        '!define EM_NAME R10-WTRCHG-EM',
+        "\t!define CHG_SP   'EM_NAME/OP001'",
+        "!define OWNER_ID 'EM_NAME/OWNER_ID'",
+        'A --> B: OWNER_ID != "Operator"',
+        'B: Set CHG_SP = 0',
+        '!undef CHG_SP',
+        'C: Set CHG_SP = 0',
+        '@enduml']))
+
+    assert PlantUML_Preprocessor.preprocess_file(root).splitlines() == [
+        '@startuml',
+        'A --> B: \'R10-WTRCHG-EM/OWNER_ID\' != "Operator"',
+        "B: Set 'R10-WTRCHG-EM/OP001' = 0",
+        'C: Set CHG_SP = 0',
+        '@enduml']
+
+
+def test_definelong_and_function_defines(tmpdir):
+    write_spec(tmpdir, 'StartCharge.puml', '\n'.join([
+        '@startuml',
+        '!definelong START_CHARGE(material_name,charge_em,charge_next)',
+        '    !define mat_id material_name',
+        '    !define CHG_NAME(mat_id) mat_id##Charge',
+        '    CHG_NAME(mat_id) : charge_em##: CHARGE',
+        '    CHG_NAME(mat_id) --> charge_next',
+        '!enddefinelong',
+        '@enduml']))
+    root = write_spec(tmpdir, 'root.puml', '\n'.join([
+        '@startuml',
+        '!include StartCharge.puml',
+        'START_CHARGE(NaOH, TK50_CHG_EM, pH_Control)',
+        '@enduml']))
+
+    assert PlantUML_Preprocessor.preprocess_file(root).splitlines() == [
+        '@startuml',
+        '    NaOHCharge : TK50_CHG_EM: CHARGE',
+        '    NaOHCharge --> pH_Control',
+        '@enduml']
+
+
+def test_pragma_conditionals_and_continuation(tmpdir):
+    root = write_spec(tmpdir, 'root.puml', '\n'.join([
+        '@startuml',
+        '!pragma horizontalLineBetweenDifferentPackageAllowed',
+        '!define SIM',
+        '!ifdef SIM',
+        'A: Set \\',
+        "'PIC-1' to 1",
+        '!else',
+        'A: skipped',
+        '!endif',
+        '!ifndef SIM',
+        'B: skipped',
+        '!endif',
+        '@enduml']))
+
+    assert PlantUML_Preprocessor.preprocess_file(root).splitlines() == [
+        '@startuml',
+        '!pragma horizontalLineBetweenDifferentPackageAllowed',
+        "A: Set 'PIC-1' to 1",
+        '@enduml']
+
+
+@pytest.mark.skipif(not os.path.isfile(config.plantUML_jar), reason='plantUML jar not available')
+def test_native_matches_jar():
+    assert PlantUML_Preprocessor.diff_preprocessors(config.specs_path) == {}
+
+
+def test_spec_hash_tracks_includes(tmpdir):
+    write_spec(tmpdir, 'Procedures/SetPressure.puml', '@startuml\nSP: Set PIC = 1\n@enduml\n')
+    write_spec(tmpdir, 'Procedures/all.puml', '!include SetPressure.puml\n')
+    root = write_spec(tmpdir, 'root.puml', '@startuml\n!include Procedures/all.puml\n@enduml\n')
+
+    assert PlantUML_Preprocessor.find_includes(root) == [str(tmpdir.join('Procedures', 'all.puml')),
+                                                          str(tmpdir.join('Procedures', 'SetPressure.puml'))]
+    before = PlantUML_Preprocessor.spec_hash(root)
+    write_spec(tmpdir, 'Procedures/SetPressure.puml', '@startuml\nSP: Set PIC = 2\n@enduml\n')
+    assert PlantUML_Preprocessor.spec_hash(root) != before
+
+
+def test_preprocess_cached(tmpdir):
+    cache = ContentCache(str(tmpdir.join('cache')), max_bytes=1024)
+    root = write_spec(tmpdir, 'root.puml', '@startuml\n!define VLV CV-1\nA: Open VLV\n@enduml\n')
+
+    for i in range(2):
+        text = PlantUML_Preprocessor.preprocess_cached(root, PlantUML_Preprocessor.preprocess_file, cache)
+        assert text == '@startuml\nA: Open CV-1\n@enduml\n'
+    stats = cache.stats()
+    assert (stats['hits'], stats['misses'], stats['entries']) == (1, 1, 1)
+
+
+def test_cache_lru_eviction(tmpdir):
+    cache = ContentCache(str(tmpdir.join('cache')), max_bytes=300)
+    for key in ['a', 'b', 'c']:
+        cache.put(key, key * 100)
+        os.utime(cache.entry_path(key), (ord(key), ord(key)))
+    # touch 'a' so that 'b' is least recently used
+    cache.get('a')
+    cache.put('d', 'd' * 100)
+
+    assert cache.get('b') is None
+    assert [cache.get(key) for key in ['a', 'c', 'd']] == ['a' * 100, 'c' * 100, 'd' * 100]
+    assert cache.stats()['evictions'] == 1
@@ -0,0 +1,128 @@
+'''
+Test definitions for RecipeParameters.py
+'''
+
+__author__ = 'ekopache'
+
+import pytest
+
+from tools import ModelBuilder
+from tools import RecipeParameters
+from tools import TestAdmin
+from tools.Attributes import AttributeBuilder
+from tools.Attributes.AttributeParser import AttributeParser
+from test_ModelBuilder import FakeConfigClient, tokens
+
+SPEC = u'''@startuml
+[*] --> Charge
+Charge : PARAM_LIST = [R_BATCHSIZE, R_A165_PAD_SP]
+Charge : Open 'CV-1' to R_A165_PAD_SP * 2
+Charge --> Done : Close 'CV-2' to R_BATCHSIZE / 4 + 1
+Done : Close 'CV-1'
+Done --> [*]
+@enduml
+'''
+
+
+def test_symbolic_attribute():
+    attr = RecipeParameters.SymbolicAttribute(u"Open 'CV-1' to R_A165_PAD_SP * 2 + R_OFFSET")
+    assert attr.parameters == [u'R_A165_PAD_SP', u'R_OFFSET']
+    assert [e.text for _, _, e in attr.expressions] == [u'R_A165_PAD_SP * 2 + R_OFFSET']
+    rows = [{'R_A165_PAD_SP': 20, 'R_OFFSET': 0.5}, {'R_A165_PAD_SP': 5, 'R_OFFSET': 0}]
+    assert attr.bind(rows) == [u"Open 'CV-1' to 40.5", u"Open 'CV-1' to 10"]
+    with pytest.raises(RecipeParameters.ParameterError):
+        attr.bind([{'R_A165_PAD_SP': 20}])
+
+
+def test_expression_evaluated_once_per_combination(monkeypatch):
+    evaluated = list()
+    monkeypatch.setattr(RecipeParameters, 'eval', lambda code, *args: evaluated.append(args[1]) or eval(code, *args),
+                        raising=False)
+    rows = [{'R_BATCHSIZE': size, 'R_OTHER': i} for i, size in enumerate([1000, 2000, 1000, 1000])]
+    assert RecipeParameters.ParameterExpression('R_BATCHSIZE / 4').evaluate(rows) == [250, 500, 250, 250]
+    assert evaluated == [{'R_BATCHSIZE': 1000}, {'R_BATCHSIZE': 2000}]
+
+    with pytest.raises(NameError):  # builtins are not available to parameter expressions
+        RecipeParameters.ParameterExpression('abs(R_BATCHSIZE)').evaluate(rows)
+
+
+def test_bind_parameter_table():
+    client = FakeConfigClient(['CV-1', 'CV-2'])
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), client)
+    diagram = ModelBuilder.StateModelBuilder(attribute_builder=attribute_builder).parse(tokens(SPEC))
+    matrix = RecipeParameters.ParameterMatrix(diagram, attribute_builder=attribute_builder)
+    assert matrix.parameters() == [u'R_A165_PAD_SP', u'R_BATCHSIZE']
+    assert len(matrix.symbolic) == 2
+
+    with pytest.raises(RecipeParameters.ParameterError):
+        matrix.bind([{'R_A165_PAD_SP': 20}])
+
+    rows = [{'R_BATCHSIZE': size, 'R_A165_PAD_SP': 20} for size in [1000, 2000]]
+    first, second = matrix.bind(rows)
+    assert client.requests.count(('get_module_info', 'CV-2')) == 1  # tags of the table are fetched once
+    requests = len(client.requests)
+    matrix.bind(rows)
+    assert len(client.requests) == requests
+    assert first.test_cases.keys() == second.test_cases.keys() and first.test_cases
+    for case_name in first.test_cases:
+        assert first.test_cases[case_name] is not second.test_cases[case_name]
+        assert first.test_cases[case_name].diagram is second.test_cases[case_name].diagram
+
+    charge = diagram.get_state(u'Charge')
+    transition, = [t for t in diagram.get_transitions() if t.attrs]
+    symbolic = list(transition.attrs)
+    for parameter_set, target in [(first, 251), (second, 501)]:
+        run = TestAdmin.TestAdmin(first.test_cases.values()[0].diagram, diagram, None, binding=parameter_set)
+        attribute, = run.attributes(transition)
+        assert (attribute.tag, attribute.rhs.val) == (u'CV-2', target)
+        assert (run.attributes(charge)[1].tag, run.attributes(charge)[1].rhs.val) == (u'CV-1', 40)
+        assert transition.attrs == symbolic  # the diagram is not bound
+    assert transition.attrs == symbolic == [u"Close 'CV-2' to R_BATCHSIZE / 4 + 1"]
+    assert TestAdmin.TestAdmin(None, diagram, None).attributes(transition) is transition.attrs
+
+
+def test_only_declared_parameters_are_bound():
+    spec = u'''@startuml
+    [*] --> Charge
+    Charge : Close 'R_VENT'
+    Charge --> Done : PARAM_LIST = [R_BATCHSIZE]
+    Done : Close 'R_DRAIN'
+    Done : Open 'CV-1' to R_BATCHSIZE / 4
+    Done --> [*]
+    @enduml
+    '''
+    client = FakeConfigClient(['CV-1', 'R_VENT', 'R_DRAIN'])
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), client)
+    diagram = ModelBuilder.StateModelBuilder(attribute_builder=attribute_builder).parse(tokens(spec))
+    drain, setpoint = diagram.get_state(u'Done').attrs
+    assert drain.tag == u'R_DRAIN'  # solved in the build, R_DRAIN is not a declared parameter
+    assert setpoint == u"Open 'CV-1' to R_BATCHSIZE / 4"
+
+    matrix = RecipeParameters.ParameterMatrix(diagram, attribute_builder=attribute_builder)
+    assert matrix.parameters() == [u'R_BATCHSIZE']
+    parameter_set, = matrix.bind([{'R_BATCHSIZE': 1000}])
+    # quoted tag used before the parameter list, solved in the build
+    vent, = parameter_set.attributes(diagram.get_state(u'Charge'))
+    assert vent.tag == u'R_VENT'
+    assert parameter_set.attributes(diagram.get_state(u'Done'))[1].rhs.val == 250
+
+
+def test_tag_paths_and_prompts_are_not_parameters():
+    assert not RecipeParameters.is_symbolic(u"'^/P_AA_RESULT.CV' > '^/R_SMPL_AA_SPEC.CV'")
+    assert not RecipeParameters.is_symbolic(u"(Set, //#UNIT_SUPPORT#/TMR3/TM_HOLD.CV, =, '^/R_SMPL_AA_DLY.CV')")
+    assert not RecipeParameters.is_symbolic(u'OARYN - Is Batch size correct? \\n(R_BATCH_SIZE)')
+    assert RecipeParameters.is_symbolic(u'vent vlv sp = R_VENT_SP (4 psig)')
+    # declared parameters are bound wherever they are referenced
+    assert RecipeParameters.is_symbolic(u'OARYN - Is Batch size correct? (R_BATCH_SIZE)', [u'R_BATCH_SIZE'])
+
+    spec = u'''@startuml
+    [*] --> SetResult
+    SetResult --> LargeAA : '^/P_AA_RESULT.CV' > '^/R_SMPL_AA_SPEC.CV'
+    LargeAA --> [*]
+    @enduml
+    '''
+    client = FakeConfigClient(['^/P_AA_RESULT.CV', '^/R_SMPL_AA_SPEC.CV'])
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), client)
+    diagram = ModelBuilder.StateModelBuilder(attribute_builder=attribute_builder).parse(tokens(spec))
+    matrix = RecipeParameters.ParameterMatrix(diagram, attribute_builder=attribute_builder)
+    assert matrix.symbolic == [] and matrix.parameters() == []
@@ -0,0 +1,103 @@
+'''
+Test definitions for SpecCorpus.py
+'''
+
+__author__ = 'ekopache'
+
+import os
+import pytest
+
+from tools import SpecCorpus
+
+
+@pytest.fixture
+def corpus(tmpdir):
+    specs = tmpdir.join('specs')
+    specs.join('Standard_Procedures', 'SetPressure.puml').write('@startuml\nSP : Set PIC = 1\n@enduml\n', ensure=True)
+    specs.join('Standard_Procedures', 'Acquire.puml').write('@startuml\nAcq --> Done\n@enduml\n', ensure=True)
+    specs.join('PH_A.puml').write('@startuml\n[*] --> SP\n!include Standard_Procedures/SetPressure.puml\n@enduml\n')
+    specs.join('PH_B.puml').write('@startuml\n[*] --> Acq\n!include Standard_Procedures/Acquire.puml\n@enduml\n')
+    specs.join('EM', 'S_EMC_X.puml').write('@startuml\n[*] --> Open\nOpen : Open VLV\n@enduml\n', ensure=True)
+    specs.join('EM', 'Definitions', 'S_EMC_X', 'R1-X-EM.puml').write('@startuml\n!define VLV CV-1\n@enduml\n',
+                                                                     ensure=True)
+    return specs
+
+
+def rebuilt(corpus, tmpdir, **kwargs):
+    '''Runs an incremental rebuild, returning the rebuilt specs relative to the corpus folder'''
+    results = SpecCorpus.rebuild(str(corpus), graph_path=str(tmpdir.join('graph.json')),
+                                 build_function=lambda spec_path, attribute_builder: None, **kwargs)
+    return sorted(os.path.relpath(spec_path, str(corpus)) for spec_path in results)
+
+
+def test_incremental_rebuild(corpus, tmpdir):
+    assert len(rebuilt(corpus, tmpdir)) == 6
+    assert rebuilt(corpus, tmpdir) == []
+
+    corpus.join('Standard_Procedures', 'SetPressure.puml').write('@startuml\nSP : Set PIC = 2\n@enduml\n')
+    assert rebuilt(corpus, tmpdir) == ['PH_A.puml', os.path.join('Standard_Procedures', 'SetPressure.puml')]
+
+    # unit definitions are rebuilt with their class spec
+    corpus.join('EM', 'S_EMC_X.puml').write('@startuml\n[*] --> Close\n@enduml\n')
+    assert rebuilt(corpus, tmpdir) == [os.path.join('EM', 'Definitions', 'S_EMC_X', 'R1-X-EM.puml'),
+                                       os.path.join('EM', 'S_EMC_X.puml')]
+
+    assert len(rebuilt(corpus, tmpdir, force=True)) == 6
+
+
+def test_rebuild_tracks_include_changes(corpus, tmpdir):
+    rebuilt(corpus, tmpdir)
+
+    # removed includes rebuild their dependents, and are rebuilt once they are created again
+    corpus.join('Standard_Procedures', 'Acquire.puml').remove()
+    assert rebuilt(corpus, tmpdir) == ['PH_B.puml']
+    corpus.join('Standard_Procedures', 'Acquire.puml').write('@startuml\nAcq --> Done\n@enduml\n')
+    assert rebuilt(corpus, tmpdir) == ['PH_B.puml', os.path.join('Standard_Procedures', 'Acquire.puml')]
+
+    # a spec switching includes depends on the new include only
+    corpus.join('PH_B.puml').write('@startuml\n!include Standard_Procedures/SetPressure.puml\n@enduml\n')
+    rebuilt(corpus, tmpdir)
+    graph = SpecCorpus.SpecDependencyGraph.load(str(tmpdir.join('graph.json')), str(corpus))
+    assert graph.successors('PH_B.puml') == [os.path.join('Standard_Procedures', 'SetPressure.puml')]
+
+
+def test_rebuild_retries_failed_specs(corpus, tmpdir):
+    corpus.join('PH_C.puml').write('@startuml\n!include Standard_Procedures/Missing.puml\n@enduml\n')
+    graph_path = str(tmpdir.join('graph.json'))
+    results = SpecCorpus.rebuild(str(corpus), graph_path=graph_path)
+    assert [os.path.basename(path) for path, result in results.items() if result.error is not None] == ['PH_C.puml']
+
+    # the failed spec is rebuilt on the next run, the specs built successfully are not
+    assert rebuilt(corpus, tmpdir) == ['PH_C.puml']
+    assert rebuilt(corpus, tmpdir) == []
+
+
+def test_build_spec_without_attribute_builder(corpus):
+    result = SpecCorpus.build_spec(str(corpus.join('PH_B.puml')))
+    assert result.error is None
+    assert sorted(result.diagram.state_names) == ['Acq', 'Done', 'START']
+    assert len(result.test_cases) == 1
+
+
+@pytest.mark.parametrize('processes', [1, 2])
+def test_build_corpus(corpus, processes):
+    corpus.join('PH_C.puml').write('@startuml\n!include Standard_Procedures/Missing.puml\n@enduml\n')
+
+    build = SpecCorpus.build_corpus(str(corpus), processes=processes)
+    assert build.processes == processes
+    assert [summary.spec_path for summary in build.results] == SpecCorpus.find_specs(str(corpus))
+    assert build.errors().keys() == [str(corpus.join('PH_C.puml'))]
+
+    summary = build.results[[s.spec_path for s in build.results].index(str(corpus.join('PH_B.puml')))]
+    assert (summary.states, summary.transitions, len(summary.test_cases)) == (3, 2, 1)
+    assert summary.times['total'] == summary.times['build'] + summary.times['solve']
+    assert build.wall_time > 0
+
+
+def test_build_corpus_without_server_ignores_worker_builder(corpus, monkeypatch):
+    # a builder left connected by an earlier build is not reused by a build without server
+    monkeypatch.setattr(SpecCorpus, '_worker_attribute_builder', object())
+    build = SpecCorpus.build_corpus(str(corpus), processes=1)
+    assert build.errors() == {}
+    SpecCorpus._init_worker(None, True)
+    assert SpecCorpus._worker_attribute_builder is None
@@ -0,0 +1,91 @@
+'''
+Test definitions for SpecWatcher.py
+'''
+
+__author__ = 'ekopache'
+
+import os
+import pytest
+
+from tools import SpecWatcher
+from tools.Attributes import AttributeBuilder
+from tools.Attributes.AttributeParser import AttributeParser
+from test_ModelBuilder import FakeConfigClient
+
+
+@pytest.fixture
+def corpus(tmpdir):
+    specs = tmpdir.join('specs')
+    specs.join('Standard_Procedures', 'Acquire.puml').write('@startuml\nAcq --> Done\n@enduml\n', ensure=True)
+    specs.join('PH_B.puml').write('@startuml\n[*] --> Acq\n!include Standard_Procedures/Acquire.puml\n@enduml\n')
+    return specs
+
+
+def save(path, text):
+    '''Writes text, making sure the change is seen even within the file system's timestamp resolution'''
+    mtime = os.path.getmtime(str(path))
+    path.write(text)
+    os.utime(str(path), (mtime + 1, mtime + 1))
+
+
+def test_watch_rebuilds_dependents(corpus):
+    watcher = SpecWatcher.SpecWatcher(str(corpus))
+    diffs = watcher.poll()
+    assert sorted(diff.spec_path for diff in diffs) == [str(corpus.join('PH_B.puml')),
+                                                        str(corpus.join('Standard_Procedures', 'Acquire.puml'))]
+    assert all(diff.old is None and diff.error is None for diff in diffs)
+    assert watcher.poll() == []
+
+    save(corpus.join('Standard_Procedures', 'Acquire.puml'), '@startuml\nAcq --> Check\nCheck --> Done\n@enduml\n')
+    diff = dict((d.spec_path, d) for d in watcher.poll())[str(corpus.join('PH_B.puml'))]
+    assert diff.added_states == ['Check'] and diff.removed_states == []
+    assert diff.added_transitions == [(u'Acq', u'Check', ()), (u'Check', u'Done', ())]
+    assert diff.removed_transitions == [(u'Acq', u'Done', ())]
+    assert diff.changed_cases == ['START-Done_1']
+    assert '+ state Check' in str(diff)
+
+
+def test_watch_skips_solving_unchanged_diagrams(corpus):
+    watcher = SpecWatcher.SpecWatcher(str(corpus), spec_paths=[str(corpus.join('PH_B.puml'))])
+    assert len(watcher.poll()) == 1
+    diagram = watcher.results[str(corpus.join('PH_B.puml'))].diagram
+    test_cases = watcher.results[str(corpus.join('PH_B.puml'))].test_cases
+
+    # a comment does not change the diagram, the diagram is kept with its test cases
+    save(corpus.join('PH_B.puml'), "@startuml\n' comment\n[*] --> Acq\n!include Standard_Procedures/Acquire.puml\n@enduml\n")
+    assert watcher.poll() == []
+    assert watcher.results[str(corpus.join('PH_B.puml'))].test_cases is test_cases
+    assert watcher.results[str(corpus.join('PH_B.puml'))].diagram is diagram
+    assert all(state in diagram for case in test_cases.values() for state in case.diagram.nodes())
+
+    save(corpus.join('PH_B.puml'), '@startuml\n[*] --> Acq\nAcq : Set X = 1\n'
+                                   '!include Standard_Procedures/Acquire.puml\n@enduml\n')
+    diff, = watcher.poll()
+    assert diff.changed_states == ['Acq']
+    assert watcher.results[str(corpus.join('PH_B.puml'))].test_cases is not test_cases
+
+
+def test_watch_solves_attributes_of_changed_diagrams_only(corpus):
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), FakeConfigClient(['CV-1']))
+    solved = list()
+    solve_attribute = attribute_builder.solve_attribute
+    attribute_builder.solve_attribute = lambda raw_string, *args: solved.append(raw_string) or \
+        solve_attribute(raw_string, *args)
+    spec_path = str(corpus.join('PH_B.puml'))
+    save(corpus.join('PH_B.puml'), "@startuml\n[*] --> Acq\nAcq : Open 'CV-1'\n@enduml\n")
+    watcher = SpecWatcher.SpecWatcher(str(corpus), spec_paths=[spec_path], attribute_builder=attribute_builder)
+    watcher.poll()
+    assert solved == [u"Open 'CV-1'"]
+    assert watcher.results[spec_path].diagram.get_state(u'Acq').attrs[0].tag == u'CV-1'
+
+    save(corpus.join('PH_B.puml'), "@startuml\n' comment\n[*] --> Acq\nAcq : Open 'CV-1'\n@enduml\n")
+    assert watcher.poll() == [] and solved == [u"Open 'CV-1'"]
+
+
+def test_watch_removed_spec(corpus):
+    watcher = SpecWatcher.SpecWatcher(str(corpus))
+    watcher.poll()
+    corpus.join('PH_B.puml').remove()
+    diff, = watcher.poll()
+    assert diff.new is None and str(diff).endswith('removed')
+    assert str(corpus.join('PH_B.puml')) not in watcher.results
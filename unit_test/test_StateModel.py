@@ -0,0 +1,164 @@
+'''
+Test definitions for StateModel.py
+'''
+
+__author__ = 'ekopache'
+
+import pickle
+from random import Random
+
+import networkx
+import pytest
+
+from tools import ModelBuilder, StateModel
+from tools.graph_utils import GraphSolver
+from test_ModelBuilder import tokens
+
+SPEC = u'''@startuml
+[*] --> Fill
+state Fill {
+  [*] --> Open
+  Open --> Closed : Close 'CV-2'
+  Open --> Closed : Level > 50
+  Closed --> Open
+  Closed --> [*]
+}
+Fill --> Drain
+Drain --> Fill
+Drain --> [*]
+@enduml
+'''
+
+
+def filtered_transitions(diagram, source=None, dest=None):
+    '''Linear filter of diagram.transitions by source and destination states'''
+    return [t for t in diagram.transitions if (not source or source in t.source) and (not dest or dest in t.dest)]
+
+
+def test_indexed_transitions():
+    diagram = ModelBuilder.StateModelBuilder().parse(tokens(SPEC))
+    fill = diagram.get_state(u'Fill')
+    states = diagram.state_names.values()
+    for scope in [diagram, fill.substates]:
+        assert scope.get_transitions() is scope.transitions
+        for source in states + [None]:
+            for dest in states + [None]:
+                assert scope.get_transitions(source, dest) == filtered_transitions(scope, source, dest)
+
+    # superstate transitions are indexed by both the diagram and the superstate
+    open_closed = diagram.get_transitions(source=u'Open', dest=u'Closed')
+    assert len(open_closed) == 2 and [t.attrs for t in open_closed] == [[u"Close 'CV-2'"], [u'Level > 50']]
+    nested = fill.substates.get_transitions(diagram.get_state(u'Open'), diagram.get_state(u'Closed'))
+    assert [t.attrs for t in nested] == [t.attrs for t in open_closed]
+
+    # transitions appended directly are indexed on the next lookup
+    drain, done = diagram.get_state(u'Drain'), diagram.get_state(u'END')
+    extra = StateModel.Transition(drain, done)
+    diagram.transitions.append(extra)
+    assert diagram.get_transitions(u'Drain', u'END')[-1] is extra
+    assert diagram.get_transitions(u'Drain', u'END') == filtered_transitions(diagram, drain, done)
+
+
+def edge_names(graph):
+    return sorted((source.name, dest.name) for source, dest in graph.edges())
+
+
+def test_flatten_graph():
+    diagram = ModelBuilder.StateModelBuilder().parse(tokens(SPEC))
+    flat_graph = diagram.flatten_graph()
+    assert edge_names(flat_graph) == [
+        (u'Closed', u'END Fill'), (u'Closed', u'Open'), (u'Drain', u'END'), (u'Drain', u'START Fill'),
+        (u'END Fill', u'Drain'), (u'Open', u'Closed'), (u'START', u'START Fill'), (u'START Fill', u'Open')]
+    assert diagram.get_state(u'Fill') not in flat_graph
+
+    # cached until a state or transition is added anywhere in the model
+    assert diagram.flatten_graph() is flat_graph
+    diagram.get_state(u'Fill').substates.add_transition(diagram.get_state(u'Open'), diagram.get_state(u'END Fill'))
+    assert (u'Open', u'END Fill') in edge_names(diagram.flatten_graph())
+
+
+def test_flatten_superstate_to_superstate():
+    spec = u'''@startuml
+[*] --> Acquire
+state Acquire {
+  [*] --> AcquireDevices
+  AcquireDevices --> [*]
+}
+Acquire --> Charge
+state Charge {
+  [*] --> SP
+  SP --> [*]
+}
+Charge --> [*]
+@enduml
+'''
+    diagram = ModelBuilder.StateModelBuilder().parse(tokens(spec))
+    # transitions between superstates leave from the end state of the source superstate,
+    # the superstates themselves are not part of the flat graph
+    assert edge_names(diagram.flatten_graph()) == [
+        (u'AcquireDevices', u'END Acquire'), (u'END Acquire', u'START Charge'), (u'END Charge', u'END'),
+        (u'SP', u'END Charge'), (u'START', u'START Acquire'), (u'START Acquire', u'AcquireDevices'),
+        (u'START Charge', u'SP')]
+
+
+def test_flatten_deeply_nested():
+    diagram = StateModel.StateDiagram()
+    parent = None
+    for level in range(3000):
+        diagram.add_state(u'S%d' % level, parent_state=parent)
+        parent = u'S%d' % level
+    diagram.add_transition(u'[*]', u'Leaf', parent_state=parent)
+    diagram.add_transition(u'[*]', u'S0')
+    diagram.add_transition(u'S0', u'[*]')
+    assert edge_names(diagram.flatten_graph()) == [
+        (u'Leaf', u'END'), (u'START', u'START S2999'), (u'START S2999', u'Leaf')]
+
+
+def test_compact_graph():
+    diagram = ModelBuilder.StateModelBuilder().parse(tokens(SPEC))
+    flat_graph = diagram.flatten_graph()
+    compact = diagram.compact_graph()
+    assert compact is diagram.compact_graph()
+    assert (compact.number_of_nodes(), compact.number_of_edges()) == (len(flat_graph), flat_graph.number_of_edges())
+    edges = sorted((compact.nodes[s].name, compact.nodes[t].name) for s, t, _ in compact.edges())
+    assert edges == edge_names(flat_graph)
+    open_closed = [trans for s, t, trans in compact.edges()
+                   if (compact.nodes[s].name, compact.nodes[t].name) == (u'Open', u'Closed')]
+    # transitions of superstates are the instances held by the superstate
+    fill = diagram.get_state(u'Fill').substates
+    assert open_closed[0] in fill.get_transitions(diagram.get_state(u'Open'), diagram.get_state(u'Closed'))
+    with pytest.raises(AttributeError):
+        compact.targets = None
+
+
+def test_solver_matches_networkx():
+    random = Random(7)
+    graph = networkx.gnp_random_graph(12, 0.25, seed=3, directed=True)
+    for _ in range(10):
+        graph.add_edge(random.randrange(12), random.randrange(12))
+    solver = GraphSolver.GraphSolver(graph)
+    assert solver.calculate_complexity() == \
+        graph.number_of_edges() - len(graph) + networkx.number_weakly_connected_components(graph)
+    for source in graph:
+        for target in graph:
+            assert solver.check_path(source, target) == networkx.has_path(graph, source, target)
+            assert solver.generate_path_lists(source, target) == list(networkx.all_simple_paths(graph, source, target))
+
+
+def test_slotted_states():
+    diagram = ModelBuilder.StateModelBuilder().parse(tokens(SPEC))
+    fill, drain = diagram.get_state(u'Fill'), diagram.get_state(u'Drain')
+    assert not drain.has_substate_diagram() and drain.get_substate_names() == []
+    assert fill.has_substate_diagram() and sorted(fill.get_substate_names()) == [u'Closed', u'END Fill', u'Open',
+                                                                                  u'START Fill']
+    assert drain.attributes is drain.attrs
+    with pytest.raises(AttributeError):
+        drain.color = 'red'
+
+    # slotted states pickle with any protocol
+    source, dest = StateModel.State(u'A'), StateModel.State(u'B')
+    transition = StateModel.Transition(source, dest, attrs=[u'Level > 50'])
+    for protocol in [0, pickle.HIGHEST_PROTOCOL]:
+        loaded = pickle.loads(pickle.dumps(transition, protocol))
+        assert [s.name for s in loaded.source + loaded.dest] == [u'A', u'B'] and loaded.attrs == [u'Level > 50']
+        assert not loaded.source[0].has_substate_diagram()
@@ -0,0 +1,116 @@
+'''
+Test definitions for UnitTemplate.py
+'''
+
+__author__ = 'ekopache'
+
+import os
+import re
+import shutil
+import pytest
+
+from tools import config
+from tools import ModelBuilder
+from tools import UnitTemplate
+from tools.Attributes import AttributeBuilder
+from tools.Attributes.AttributeParser import AttributeParser
+from tools.SpecWatcher import state_signatures, transition_signatures
+from test_ModelBuilder import FakeConfigClient
+
+EM_PATH = os.path.join(config.specs_path, 'EM')
+CLASS_SPECS = ['S_EMC_CHARGE.puml', 'S_EMC_CHARGE_V2.puml', 'S_EMC_CHG_BLWDN.puml', 'S_EMC_PRESS_CND.puml']
+
+UNIT_INCLUDE = re.compile(r'^!include[\s]+Definitions/.*$', re.MULTILINE)
+
+
+def unit_state_signatures(unit):
+    '''Returns state_signatures of the class diagram with the attributes of unit'''
+    return dict((name, tuple(repr(attr) for attr in unit.attributes(state)))
+                for name, state in unit.diagram.state_names.items())
+
+
+def unit_transition_signatures(unit):
+    '''Returns transition_signatures of the class diagram with the attributes of unit'''
+    return set((u', '.join(s.name for s in trans.source), u', '.join(s.name for s in trans.dest),
+                tuple(repr(attr) for attr in unit.attributes(trans))) for trans in unit.diagram.get_transitions())
+
+
+def full_build(tmpdir, class_spec, unit):
+    '''Builds a copy of class_spec including only the given unit definition through the full pipeline'''
+    em_copy = tmpdir.join('EM')
+    if not em_copy.check():
+        shutil.copytree(EM_PATH, str(em_copy))
+    with open(os.path.join(EM_PATH, class_spec)) as f:
+        text = f.read()
+    include = '!include ' + os.path.relpath(unit, EM_PATH).replace(os.sep, '/')
+    spec = em_copy.join('unit_' + class_spec)
+    head, start, body = text.partition('@startuml\n')
+    if UNIT_INCLUDE.search(body):
+        body = UNIT_INCLUDE.sub(include, body)
+    else:
+        body = include + '\n' + body
+    spec.write(head + start + body)
+    return ModelBuilder.build_state_diagram(str(spec), preprocess=True)
+
+
+@pytest.mark.parametrize('class_spec', CLASS_SPECS)
+def test_units_match_full_build(tmpdir, monkeypatch, class_spec):
+    monkeypatch.setattr(config, 'preprocessor', 'native')
+    monkeypatch.setattr(config, 'preprocess_cache', False)
+    units = UnitTemplate.unit_definitions(os.path.join(EM_PATH, class_spec.replace('_V2', '')))
+    assert units
+    template = UnitTemplate.UnitTemplate(os.path.join(EM_PATH, class_spec))
+    for unit in units:
+        instance = template.instantiate(unit)
+        expected = full_build(tmpdir, class_spec, unit)
+        assert unit_state_signatures(instance) == state_signatures(expected), unit
+        assert unit_transition_signatures(instance) == transition_signatures(expected), unit
+
+
+def test_units_share_class_diagram(tmpdir):
+    spec = tmpdir.join('EM', 'S_EMC_X.puml')
+    spec.write('@startuml\n!include Definitions/S_EMC_X/R1.puml\n[*] --> Open\nOpen : Open VLV\n'
+               "Open : Close 'CV-9'\nOpen --> Done : VLV/PV = 1\n@enduml\n", ensure=True)
+    for unit in ['R1', 'R2']:
+        spec.dirpath().join('Definitions', 'S_EMC_X', unit + '.puml').write(
+            "@startuml\n!define VLV '%s-CV-1'\n@enduml\n" % unit, ensure=True)
+
+    units = UnitTemplate.instantiate_units(str(spec))
+    r1, r2 = [units[path] for path in UnitTemplate.unit_definitions(str(spec))]
+    assert r1.diagram is r2.diagram
+    assert [u''.join(r1.attributes(t)) for t in r1.diagram.get_transitions()] == [u'', u"'R1-CV-1'/PV = 1"]
+    assert [u''.join(r2.attributes(t)) for t in r2.diagram.get_transitions()] == [u'', u"'R2-CV-1'/PV = 1"]
+    assert [u''.join(t.attrs) for t in r1.diagram.get_transitions()] == [u'', u'VLV/PV = 1']
+
+    # attributes without aliases are solved once in the class diagram, unit attributes for each unit
+    client = FakeConfigClient(['R1-CV-1', 'R2-CV-1', 'CV-9'])
+    attribute_builder = AttributeBuilder.AttributeBuilder(AttributeParser(), client)
+    template = UnitTemplate.UnitTemplate(str(spec), attribute_builder=attribute_builder)
+    r1, r2 = [template.instantiate(path) for path in UnitTemplate.unit_definitions(str(spec))]
+    state = template.diagram.state_names['Open']
+    open_r1, close_r1 = r1.attributes(state)
+    open_r2, close_r2 = r2.attributes(state)
+    assert (open_r1.tag, open_r2.tag) == (u'R1-CV-1', u'R2-CV-1')
+    assert close_r1 is close_r2 is state.attrs[1] and close_r1.tag == u'CV-9'
+    assert state.attrs[0] == u'Open VLV'
+    assert client.requests.count(('get_module_info', 'CV-9')) == 1
+
+    # attributes of titled units may default to the unit tag, and are all solved for the unit
+    titled = spec.dirpath().join('Definitions', 'S_EMC_X', 'R5.puml')
+    titled.write("@startuml\ntitle R5-EM\n!define VLV 'R1-CV-1'\n@enduml\n")
+    r5 = template.instantiate(str(titled))
+    assert r5.title == u'R5-EM'
+    assert r5.attributes(state)[1] is not state.attrs[1] and r5.attributes(state)[1].tag == u'CV-9'
+    assert attribute_builder.default_tag == u''
+
+    # units redefining class spec definitions are not templated
+    spec.dirpath().join('Definitions', 'S_EMC_X', 'R3.puml').write("@startuml\n!define DONE x\n@enduml\n")
+    spec.write('@startuml\n!define DONE Done\n!include Definitions/S_EMC_X/R1.puml\n[*] --> DONE\n@enduml\n')
+    with pytest.raises(UnitTemplate.TemplateError):
+        UnitTemplate.UnitTemplate(str(spec)).instantiate(str(spec.dirpath().join('Definitions', 'S_EMC_X', 'R3.puml')))
+
+    # units substituting aliases in states are not templated
+    spec.dirpath().join('Definitions', 'S_EMC_X', 'R4.puml').write("@startuml\n!define STATE Open\n@enduml\n")
+    spec.write('@startuml\n!include Definitions/S_EMC_X/R1.puml\n[*] --> STATE\n@enduml\n')
+    with pytest.raises(UnitTemplate.TemplateError):
+        UnitTemplate.UnitTemplate(str(spec)).instantiate(str(spec.dirpath().join('Definitions', 'S_EMC_X', 'R4.puml')))
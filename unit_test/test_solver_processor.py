@@ -1,7 +1,7 @@
 __author__ = 'vpeng'
 
 import os
-from tools import config, ModelBuilder, TestSolver
+from tools import config, DiagramSnapshot, TestSolver
 from tools.Attributes import AttributeBuilder
 
 def S_EMC_PRESS_CND():
@@ -23,8 +23,8 @@ def test_solver_processor(test_class, test_spec):
     # create attribute builder instance for solving attributes
     # abuilder = AttributeBuilder.create_attribute_builder(server_ip='127.0.0.1', server_port=5489)
     abuilder = AttributeBuilder.create_attribute_builder(server_ip='10.0.1.200', server_port=5489)
-    # build StateDiagram instance
-    diagram = ModelBuilder.build_state_diagram(file_path, attribute_builder=abuilder)
+    # build StateDiagram instance, or load it from its snapshot if the spec is unchanged
+    diagram = DiagramSnapshot.load_or_build(file_path, attribute_builder=abuilder)
 
     # generate test cases from model
     test_gen = TestSolver.TestCaseGenerator(diagram)